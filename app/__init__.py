@@ -26,8 +26,25 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    # Uploaded files are streamed to their final path while the request is parsed.
+    from .utils.uploads import StreamingUploadRequest, discard_unclaimed_uploads
+    app.request_class = StreamingUploadRequest
+    app.teardown_request(discard_unclaimed_uploads)
+
     # Initialize Celery
     celery_init_app(app)
+
+    # Metrics (before any request or task records one)
+    from .services import metrics
+    metrics.init_app(app)
+
+    # Intra-file parallelism: threads per job follow the worker's concurrency
+    from .services import parallel
+    parallel.init_app(app)
+
+    # Warm-up: validator handles now, DSP state when a worker process starts
+    from .services import warmup
+    warmup.init_app(app)
     
     # Initialize Bootstrap
     bootstrap = Bootstrap(app) 
@@ -92,6 +109,8 @@ def create_app(config_class=Config):
 
     # Ensure UPLOAD_FOLDER and PROCESSED_FOLDER exist (moved to end of factory for safety)
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['UPLOAD_PARTIAL_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['PREVIEW_FOLDER'], exist_ok=True)
     os.makedirs(app.config['PROCESSED_FOLDER'], exist_ok=True)
 
     return app
@@ -1,33 +1,65 @@
 import os
+import math
+import time
 import uuid
 import json # For parsing effects_chain
+import mimetypes
+import tarfile
+import zipfile
 from flask import (
-    Blueprint, render_template, request, jsonify,
+    Blueprint, render_template, request, jsonify, Response, stream_with_context,
     current_app, send_from_directory, flash, redirect, url_for
 )
+from werkzeug.exceptions import NotFound, RequestedRangeNotSatisfiable
+from werkzeug.http import parse_content_range_header
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import wrap_file
+from urllib.parse import quote
+from celery import chord, group
 from celery.result import AsyncResult
 
 # Import the CORRECT Celery task for effects
-from .tasks import process_audio_task_effects # THIS LINE IS IMPORTANT
-from .utils.file_validator import is_allowed_file
+from .tasks import process_audio_task_effects, finalize_batch_task # THIS LINE IS IMPORTANT
+from .utils.file_validator import is_allowed_file, check_audio_metadata, probe_metadata
+from .utils import uploads
+from .services import result_cache
+from .services import stage_cache
+from .services import batches
+from .services import progress_events
+from .services import blob_store
+from .services import metrics
+from .services import encoders
+from .services import job_routing
+from .services import preview
+from .services import file_registry
+
+BATCH_ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
 
 @current_app.route('/', methods=['GET'])
 def index():
     return render_template('index.html', app_name="Audio Mood Shifter")
 
-@current_app.route('/upload', methods=['POST'])
-def upload_audio():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part in the request'}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No file selected for uploading'}), 400
+def _parse_processing_options():
+    """
+    Reads output_format, effects_chain and encoder_profile from the form.
+    output_format may be repeated or comma-separated to export several formats from
+    one run of the chain; it is then returned as a list (a single format stays a string).
+    encoder_profile defaults to the ENCODER_PROFILE setting.
+    Returns (output_format, effects_chain, encoder_profile, error_response); error_response is None if valid.
+    """
+    output_formats = []
+    for value in request.form.getlist('output_format'):
+        for fmt in value.split(','):
+            fmt = fmt.strip().lower()
+            if fmt in current_app.config['ALLOWED_EXTENSIONS'] and fmt not in output_formats:
+                output_formats.append(fmt)
+    if not output_formats:
+        output_formats = ['wav']
+    output_format = output_formats[0] if len(output_formats) == 1 else output_formats
 
-    output_format = request.form.get('output_format', 'wav').lower()
-    if output_format not in current_app.config['ALLOWED_EXTENSIONS']:
-        output_format = 'wav'
+    encoder_profile = request.form.get('encoder_profile', '').strip().lower() or encoders.resolve_profile(current_app.config.get('ENCODER_PROFILE'))
+    if encoder_profile not in encoders.ENCODER_PROFILES:
+        return None, None, None, (jsonify({'error': f"Unknown encoder profile. Use one of: {', '.join(encoders.ENCODER_PROFILES)}"}), 400)
 
     effects_chain_json = request.form.get('effects_chain', '[]')
     try:
@@ -36,111 +68,749 @@ def upload_audio():
             raise ValueError("Effects chain must be a list.")
     except json.JSONDecodeError:
         current_app.logger.error(f"Invalid JSON for effects_chain: {effects_chain_json}")
-        return jsonify({'error': 'Invalid effects configuration data.'}), 400
+        return None, None, None, (jsonify({'error': 'Invalid effects configuration data.'}), 400)
     except ValueError as ve:
         current_app.logger.error(f"Validation error for effects_chain: {ve}")
-        return jsonify({'error': str(ve)}), 400
+        return None, None, None, (jsonify({'error': str(ve)}), 400)
+    return output_format, effects_chain, encoder_profile, None
 
-    is_valid, validation_msg = is_allowed_file(file.filename, file.stream)
+@current_app.route('/upload', methods=['POST'])
+def upload_audio():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file part in the request'}), 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No file selected for uploading'}), 400
+
+    output_format, effects_chain, encoder_profile, error_response = _parse_processing_options()
+    if error_response:
+        return error_response
+
+    # With the streaming request class the file is already on disk, hashed, with its header kept.
+    streamed = isinstance(file.stream, uploads.StreamedUploadFile)
+    is_valid, validation_msg = is_allowed_file(file.filename, file.stream, header=file.stream.header if streamed else None)
+    if is_valid:
+        # Header-only probe: corrupt or out-of-limits files are refused before they take a queue slot.
+        is_valid, validation_msg, audio_info = check_audio_metadata(
+            file.filename, path=file.stream.path if streamed else None, stream=None if streamed else file.stream)
     if not is_valid:
         current_app.logger.warning(f"Upload rejected: {file.filename}, Reason: {validation_msg}")
         return jsonify({'error': validation_msg}), 400
 
+    # Identical upload + chain + format already processed (or in flight)? Reuse it.
+    content_digest = file.stream.hexdigest() if streamed else None
+    cache_key, content_digest, cached_response = _check_result_cache(file.filename, file.stream, content_digest, effects_chain, output_format, encoder_profile)
+    if cached_response:
+        return cached_response
+
     try:
         original_filename = secure_filename(file.filename)
-        file_ext = original_filename.rsplit('.', 1)[1].lower()
-        
-        unique_id = uuid.uuid4().hex
-        temp_input_filename = f"{unique_id}_input.{file_ext}"
-        input_filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], temp_input_filename)
-        
-        file.save(input_filepath)
-        current_app.logger.info(f"File {original_filename} (saved as {temp_input_filename}) uploaded to {input_filepath}")
-
-        output_filename_base = f"effects_{unique_id}_{os.path.splitext(original_filename)[0]}"
-
-        # Dispatch the Celery task with effects
-        task = process_audio_task_effects.delay( # Ensure this is the correct task name
-            input_filepath, 
-            original_filename, 
-            output_filename_base, 
-            output_format,
-            effects_chain 
+        if streamed:
+            unique_id = file.stream.unique_id
+            input_filepath = file.stream.claim()
+        else:
+            file_ext = original_filename.rsplit('.', 1)[1].lower()
+            unique_id = uuid.uuid4().hex
+            input_filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], f"{unique_id}_input.{file_ext}")
+            file.save(input_filepath)
+        queue = job_routing.select_queue(input_filepath, effects_chain, output_format, audio_info)
+        input_key = _store_upload(input_filepath)
+        current_app.logger.info(f"File {original_filename} uploaded to {input_key}")
+        return _dispatch_effects_task(input_key, original_filename, unique_id, output_format, effects_chain, cache_key, content_digest, encoder_profile,
+                                      queue=queue, audio_info=audio_info)
+    except Exception as e:
+        current_app.logger.error(f"Error during file upload or task dispatch for {file.filename}: {e}", exc_info=True)
+        if 'input_filepath' in locals():
+            _discard_upload(input_filepath)
+        return jsonify({'error': f'Server error during upload: {str(e)}'}), 500
+
+def _store_upload(input_filepath):
+    """Moves a saved upload into the blob store (nothing to move for the local backend). Returns its key."""
+    input_key = blob_store.upload_key(input_filepath)
+    size = os.path.getsize(input_filepath)
+    blob_store.get_blob_store(current_app.config).put_file(input_key, input_filepath)
+    file_registry.register(input_key, size)
+    return input_key
+
+def _discard_upload(input_filepath):
+    """Removes an upload after an error, wherever it got to (local file and/or blob)."""
+    try:
+        if os.path.exists(input_filepath):
+            os.remove(input_filepath)
+        blob_store.get_blob_store(current_app.config).delete(blob_store.upload_key(input_filepath))
+        file_registry.forget(blob_store.upload_key(input_filepath))
+    except Exception as e:
+        current_app.logger.error(f"Could not remove {input_filepath} after upload error: {e}")
+
+def _check_result_cache(filename, stream, content_digest, effects_chain, output_format, encoder_profile):
+    """
+    Looks the upload up in the result cache (hashing the stream unless the digest is known).
+    Returns (cache_key, content_digest, response); response is set on a hit.
+    """
+    if not result_cache.is_enabled():
+        return None, content_digest, None
+    try:
+        if content_digest is None:
+            content_digest = result_cache.hash_stream(stream)
+        cache_key = result_cache.make_key(content_digest, effects_chain, output_format, encoder_profile)
+        cached = result_cache.lookup(cache_key)
+        if cached:
+            current_app.logger.info(f"Result cache hit for {filename}: task {cached['task_id']}")
+            return cache_key, content_digest, _cached_upload_response(cached)
+        return cache_key, content_digest, None
+    except Exception as e:
+        current_app.logger.warning(f"Result cache unavailable, processing without it: {e}")
+        return None, content_digest, None
+
+def _output_filenames(output_filename_base, output_format):
+    formats = [output_format] if isinstance(output_format, str) else output_format
+    return [f"{output_filename_base}.{fmt}" for fmt in formats]
+
+def _download_urls(result_filenames):
+    """Download URL per output format ({format: url})."""
+    return {
+        filename.rsplit('.', 1)[-1]: url_for('download_processed_file', filename=filename, _external=True)
+        for filename in result_filenames
+    }
+
+def _dispatch_effects_task(input_key, original_filename, unique_id, output_format, effects_chain, cache_key, content_digest, encoder_profile,
+                           queue=None, audio_info=None):
+    """
+    Dispatches the effects task for an upload in the blob store and returns the 202 response.
+    queue, if given, is the Celery queue picked by job_routing; audio_info is the
+    probed header metadata (saves the worker a probe).
+    """
+    output_filename_base = f"effects_{unique_id}_{os.path.splitext(original_filename)[0]}"
+    task_id = uuid.uuid4().hex
+
+    # Registered before dispatch: a task that finishes first must find its entry to complete.
+    if cache_key:
+        try:
+            result_cache.register(cache_key, task_id, _output_filenames(output_filename_base, output_format))
+        except Exception as e:
+            current_app.logger.warning(f"Could not register task {task_id} in the result cache: {e}")
+
+    # Dispatch the Celery task with effects
+    try:
+        task = process_audio_task_effects.apply_async(
+            args=(input_key, original_filename, output_filename_base, output_format, effects_chain),
+            kwargs={'cache_key': cache_key, 'input_digest': content_digest, 'encoder_profile': encoder_profile, 'audio_info': audio_info},
+            task_id=task_id,
+            **({'queue': queue} if queue else {})
         )
-        current_app.logger.info(f"Dispatched Celery effects task {task.id} for {original_filename} with effects: {effects_chain}")
+    except Exception:
+        if cache_key:
+            _drop_cache_registrations([cache_key])
+        raise
+    current_app.logger.info(f"Dispatched Celery effects task {task.id} for {original_filename} to queue '{queue or 'default'}' with effects: {effects_chain}")
+
+    return jsonify({
+        'task_id': task.id,
+        'status_url': url_for('task_status', task_id=task.id, _external=True),
+        'message': 'File upload successful, applying effects...'
+    }), 202
+
+def _drop_cache_registrations(cache_keys):
+    """Drops result cache entries registered for tasks that were never dispatched."""
+    for cache_key in cache_keys:
+        try:
+            result_cache.remove(cache_key, delete_file=False)
+        except Exception as e:
+            current_app.logger.warning(f"Could not drop result cache entry {cache_key}: {e}")
+
+def _cached_upload_response(cached):
+    """Upload response for a result cache hit: finished (200) or still in flight (202)."""
+    response_data = {
+        'task_id': cached['task_id'],
+        'status_url': url_for('task_status', task_id=cached['task_id'], _external=True),
+        'cached': True,
+    }
+    if not cached['ready']:
+        response_data['message'] = 'An identical request is already being processed.'
+        return jsonify(response_data), 202
+    response_data.update({
+        'state': 'SUCCESS',
+        'progress': 100,
+        'result_filename': cached['result_filename'],
+        'result_filenames': cached['result_filenames'],
+        'download_url': url_for('download_processed_file', filename=cached['result_filename'], _external=True),
+        'download_urls': _download_urls(cached['result_filenames']),
+        'message': 'This file was already processed with the same effects.'
+    })
+    return jsonify(response_data), 200
+
+# --- Resumable uploads: POST /uploads, then PUT chunks, then POST /uploads/<id>/complete ---
 
-        return jsonify({
-            'task_id': task.id,
-            'status_url': url_for('task_status', task_id=task.id, _external=True),
-            'message': 'File upload successful, applying effects...'
-        }), 202
+def _session_response(session, status=200):
+    return jsonify({
+        'upload_id': session['upload_id'],
+        'filename': session['filename'],
+        'size': session['size'],
+        'offset': session.get('offset', 0),
+        'upload_url': url_for('upload_chunk', upload_id=session['upload_id'], _external=True),
+        'complete_url': url_for('complete_chunked_upload', upload_id=session['upload_id'], _external=True),
+    }), status
 
+@current_app.route('/uploads', methods=['POST'])
+def create_chunked_upload():
+    """Starts a resumable upload. Expects 'filename' and 'size' (bytes), as JSON or form fields."""
+    data = request.get_json(silent=True) or request.form
+    filename = data.get('filename', '')
+    try:
+        size = int(data.get('size', 0))
+    except (TypeError, ValueError):
+        size = 0
+    if uploads.allowed_extension(filename) is None:
+        metrics.count_rejected_upload('extension')
+        return jsonify({'error': "File extension not allowed."}), 400
+    if not (0 < size <= current_app.config['CHUNKED_UPLOAD_MAX_BYTES']):
+        metrics.count_rejected_upload('size')
+        return jsonify({'error': f"Size must be between 1 and {current_app.config['CHUNKED_UPLOAD_MAX_BYTES']} bytes."}), 400
+    session = uploads.create_session(filename, size)
+    current_app.logger.info(f"Resumable upload {session['upload_id']} started for {session['filename']} ({size} bytes)")
+    return _session_response(session, 201)
+
+@current_app.route('/uploads/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+def upload_chunk(upload_id):
+    """
+    GET returns the current offset (to resume), DELETE aborts, and PUT appends the
+    request body at the offset given by 'Content-Range: bytes <start>-<end>/<size>'.
+    """
+    session = uploads.load_session(upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found or expired.'}), 404
+    if request.method == 'GET':
+        return _session_response(session)
+    if request.method == 'DELETE':
+        uploads.abort_session(session)
+        return jsonify({'upload_id': upload_id, 'message': 'Upload aborted.'})
+
+    content_range = parse_content_range_header(request.headers.get('Content-Range'))
+    length = request.content_length or 0
+    if content_range is None or content_range.units != 'bytes' or content_range.stop - content_range.start != length:
+        return jsonify({'error': "PUT needs a 'Content-Range: bytes <start>-<end>/<size>' header matching the body length."}), 400
+    try:
+        uploads.append_chunk(session, content_range.start, request.stream, length)
+    except ValueError as e:
+        response, _ = _session_response(session)
+        response_data = response.get_json()
+        response_data['error'] = str(e)
+        return jsonify(response_data), 409
+
+    # Reject non-audio content as soon as the header is in, not after the whole transfer.
+    if content_range.start == 0:
+        is_valid, validation_msg = is_allowed_file(session['filename'], None, header=uploads.read_header(session))
+        if not is_valid:
+            uploads.abort_session(session)
+            current_app.logger.warning(f"Resumable upload {upload_id} rejected: {validation_msg}")
+            return jsonify({'error': validation_msg}), 400
+    return _session_response(session)
+
+@current_app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    """Finishes a resumable upload and dispatches it like /upload (same form fields and responses)."""
+    session = uploads.load_session(upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found or expired.'}), 404
+    if session['offset'] != session['size']:
+        response, _ = _session_response(session)
+        response_data = response.get_json()
+        response_data['error'] = f"Upload incomplete: {session['offset']} of {session['size']} bytes received."
+        return jsonify(response_data), 409
+
+    output_format, effects_chain, encoder_profile, error_response = _parse_processing_options()
+    if error_response:
+        return error_response
+    is_valid, validation_msg = is_allowed_file(session['filename'], None, header=uploads.read_header(session))
+    if not is_valid:
+        uploads.abort_session(session)
+        return jsonify({'error': validation_msg}), 400
+
+    try:
+        unique_id, input_filepath, content_digest = uploads.finish_session(session, uploads.allowed_extension(session['filename']))
+        is_valid, validation_msg, audio_info = check_audio_metadata(session['filename'], path=input_filepath)
+        if not is_valid:
+            os.remove(input_filepath)
+            return jsonify({'error': validation_msg}), 400
+        cache_key, content_digest, cached_response = _check_result_cache(session['filename'], None, content_digest, effects_chain, output_format, encoder_profile)
+        if cached_response:
+            os.remove(input_filepath)
+            return cached_response
+        queue = job_routing.select_queue(input_filepath, effects_chain, output_format, audio_info)
+        input_key = _store_upload(input_filepath)
+        return _dispatch_effects_task(input_key, session['filename'], unique_id, output_format, effects_chain, cache_key, content_digest, encoder_profile,
+                                      queue=queue, audio_info=audio_info)
     except Exception as e:
-        current_app.logger.error(f"Error during file upload or task dispatch for {file.filename}: {e}", exc_info=True)
-        if 'input_filepath' in locals() and os.path.exists(input_filepath) and 'task' not in locals():
-             try:
-                os.remove(input_filepath)
-             except OSError:
-                current_app.logger.error(f"Could not remove {input_filepath} after upload error.")
+        current_app.logger.error(f"Error completing resumable upload {upload_id}: {e}", exc_info=True)
+        if 'input_filepath' in locals():
+            _discard_upload(input_filepath)
         return jsonify({'error': f'Server error during upload: {str(e)}'}), 500
 
-@current_app.route('/status/<task_id>', methods=['GET'])
-def task_status(task_id):
-    celery_app = current_app.extensions['celery']
-    task = celery_app.AsyncResult(task_id) 
+def _iter_archive_files(archive, max_bytes):
+    """Yields (filename, stream) for the regular files in a zip or tar upload."""
+    if archive.filename.lower().endswith('.zip'):
+        with zipfile.ZipFile(archive.stream) as zf:
+            members = [info for info in zf.infolist() if not info.is_dir()]
+            if sum(info.file_size for info in members) > max_bytes:
+                raise ValueError("Archive content exceeds the batch size limit.")
+            for info in members:
+                with zf.open(info) as member:
+                    yield info.filename, member
+    else:
+        with tarfile.open(fileobj=archive.stream, mode='r:*') as tf:
+            members = [member for member in tf.getmembers() if member.isfile()]
+            if sum(member.size for member in members) > max_bytes:
+                raise ValueError("Archive content exceeds the batch size limit.")
+            for member in members:
+                yield member.name, tf.extractfile(member)
+
+@current_app.route('/batch/upload', methods=['POST'])
+def batch_upload():
+    """
+    Fans one request out into an effects task per file: either several 'files'
+    parts or a single 'archive' (.zip/.tar/.tar.gz). The effects chain is parsed
+    once and all tasks are dispatched together as a Celery chord whose callback
+    records the results. Returns a batch id for /batch/status.
+    """
+    output_format, effects_chain, encoder_profile, error_response = _parse_processing_options()
+    if error_response:
+        return error_response
+
+    config = current_app.config
+    archive = request.files.get('archive')
+    files = [f for f in request.files.getlist('files') if f.filename]
+    if archive and archive.filename:
+        if not archive.filename.lower().endswith(BATCH_ARCHIVE_EXTENSIONS):
+            return jsonify({'error': f"Archive must be one of: {', '.join(BATCH_ARCHIVE_EXTENSIONS)}"}), 400
+        sources = _iter_archive_files(archive, config['BATCH_MAX_EXTRACTED_BYTES'])
+    elif files:
+        sources = ((f.filename, f.stream) for f in files)
+    else:
+        return jsonify({'error': "No files in the request. Send 'files' parts or one 'archive'."}), 400
+
+    batch_id = uuid.uuid4().hex
+    use_cache = result_cache.is_enabled()
+    bulk_queue = job_routing.bulk_queue() # Batch items never compete with interactive uploads.
+    store = blob_store.get_blob_store(config)
+    items, rejected, saved_keys = [], [], []
+    signatures, cache_registrations = [], []
+    items_by_key = {}
+    try:
+        for name, stream in sources:
+            original_filename = secure_filename(os.path.basename(name))
+            if len(items) >= config['BATCH_MAX_FILES']:
+                metrics.count_rejected_upload('batch_limit')
+                rejected.append({'filename': original_filename, 'error': f"Batch limit of {config['BATCH_MAX_FILES']} files reached."})
+                continue
+            streamed = isinstance(stream, uploads.StreamedUploadFile)
+            is_valid, validation_msg = is_allowed_file(original_filename, stream, header=stream.header if streamed else None)
+            if is_valid:
+                is_valid, validation_msg, audio_info = check_audio_metadata(
+                    original_filename, path=stream.path if streamed else None, stream=None if streamed else stream)
+            if not is_valid:
+                rejected.append({'filename': original_filename, 'error': validation_msg})
+                continue
+
+            cache_key = None
+            content_digest = stream.hexdigest() if streamed else None
+            if use_cache:
+                try:
+                    if content_digest is None:
+                        content_digest = result_cache.hash_stream(stream)
+                    cache_key = result_cache.make_key(content_digest, effects_chain, output_format, encoder_profile)
+                    duplicate = items_by_key.get(cache_key)
+                    cached = None if duplicate else result_cache.lookup(cache_key)
+                    if duplicate or cached:
+                        source = duplicate or cached
+                        item = {'filename': original_filename, 'task_id': source['task_id'], 'cached': True}
+                        if source.get('ready') or (duplicate and duplicate.get('result_filename')):
+                            item['result_filename'] = source['result_filename']
+                        items.append(item)
+                        continue
+                except Exception as e:
+                    current_app.logger.warning(f"Result cache unavailable for batch {batch_id}, processing without it: {e}")
+                    use_cache = False
+                    cache_key = None
+
+            if isinstance(stream, uploads.StreamedUploadFile):
+                unique_id = stream.unique_id
+                # Already written to its upload path while the request was parsed. Claimed only once
+                # stored, so the request teardown still removes it if the store fails.
+                input_key = blob_store.upload_key(stream.path)
+                saved_keys.append(input_key)
+                stream.close()
+                size = os.path.getsize(stream.path)
+                store.put_file(input_key, stream.path)
+                stream.claim()
+            else:
+                unique_id = uuid.uuid4().hex
+                file_ext = original_filename.rsplit('.', 1)[1].lower()
+                input_key = blob_store.upload_key(f"{unique_id}_input.{file_ext}")
+                saved_keys.append(input_key)
+                stream.seek(0)
+                store.put_stream(input_key, stream)
+                size = store.stat(input_key).size
+            file_registry.register(input_key, size)
+
+            output_filename_base = f"effects_{unique_id}_{os.path.splitext(original_filename)[0]}"
+            task_id = uuid.uuid4().hex
+            signatures.append(process_audio_task_effects.s(
+                input_key, original_filename, output_filename_base, output_format, effects_chain,
+                cache_key=cache_key, input_digest=content_digest, encoder_profile=encoder_profile, audio_info=audio_info
+            ).set(task_id=task_id, **({'queue': bulk_queue} if bulk_queue else {})))
+            item = {'filename': original_filename, 'task_id': task_id, 'cached': False}
+            items.append(item)
+            if cache_key:
+                items_by_key[cache_key] = item
+                cache_registrations.append((cache_key, task_id, _output_filenames(output_filename_base, output_format)))
+    except (ValueError, zipfile.BadZipFile, tarfile.TarError) as e:
+        _remove_blobs(store, saved_keys)
+        current_app.logger.warning(f"Batch {batch_id} rejected: {e}")
+        return jsonify({'error': f'Invalid archive: {str(e)}'}), 400
+    except Exception as e:
+        _remove_blobs(store, saved_keys)
+        current_app.logger.error(f"Error while preparing batch {batch_id}: {e}", exc_info=True)
+        return jsonify({'error': f'Server error during batch upload: {str(e)}'}), 500
+
+    if not items:
+        return jsonify({'error': 'No valid audio files in the batch.', 'rejected': rejected}), 400
+
+    # Registered before dispatch, as for single uploads.
+    registered = []
+    for cache_key, task_id, result_filenames in cache_registrations:
+        try:
+            result_cache.register(cache_key, task_id, result_filenames)
+            registered.append(cache_key)
+        except Exception as e:
+            current_app.logger.warning(f"Could not register task {task_id} in the result cache: {e}")
+            break
+
+    try:
+        # The record must exist before the chord callback can run.
+        batches.save(batches.new_record(batch_id, output_format, effects_chain, items))
+        if signatures:
+            task_ids = [sig.options['task_id'] for sig in signatures]
+            chord(group(signatures))(finalize_batch_task.s(batch_id, task_ids))
+    except Exception as e:
+        _drop_cache_registrations(registered)
+        _remove_blobs(store, saved_keys)
+        current_app.logger.error(f"Error dispatching batch {batch_id}: {e}", exc_info=True)
+        return jsonify({'error': f'Server error during batch dispatch: {str(e)}'}), 500
+    current_app.logger.info(f"Dispatched batch {batch_id}: {len(signatures)} tasks, {len(items) - len(signatures)} cached, "
+                            f"{len(rejected)} rejected, effects: {effects_chain}")
 
+    return jsonify({
+        'batch_id': batch_id,
+        'status_url': url_for('batch_status', batch_id=batch_id, _external=True),
+        'total': len(items),
+        'dispatched': len(signatures),
+        'items': items,
+        'rejected': rejected,
+        'message': f'Batch accepted: {len(items)} files, applying effects...'
+    }), 202
+
+def _remove_blobs(store, keys):
+    for key in keys:
+        try:
+            store.delete(key)
+        except Exception as e:
+            current_app.logger.error(f"Could not remove {key} after batch error: {e}")
+    file_registry.forget(*keys)
+
+@current_app.route('/batch/status/<batch_id>', methods=['GET'])
+def batch_status(batch_id):
+    record = batches.load(batch_id)
+    if record is None:
+        return jsonify({'error': 'Batch not found or expired.'}), 404
+    response_data = batches.aggregate_status(record, current_app.extensions['celery'])
+    for item in response_data['items']:
+        if item['result_filename']:
+            item['download_url'] = url_for('download_processed_file', filename=item['result_filename'], _external=True)
+            # Every output of an item shares the first one's base name.
+            base = item['result_filename'].rsplit('.', 1)[0]
+            item['download_urls'] = _download_urls(_output_filenames(base, record['output_format']))
+    return jsonify(response_data)
+
+def _task_status_payload(task_id, state, info):
+    """Status response for a task state and its meta (shared by /status and /events)."""
     response_data = {
         'task_id': task_id,
-        'state': task.state,
+        'state': state,
     }
 
-    if task.state == 'PENDING':
+    if state == 'PENDING':
         response_data['status'] = 'Task is pending or not yet started.'
         response_data['progress'] = 0
-    elif task.state == 'PROGRESS':
-        response_data.update(task.info or {}) 
-    elif task.state == 'SUCCESS':
-        response_data.update(task.info if isinstance(task.info, dict) else {'result': task.info})
+    elif state == 'PROGRESS':
+        response_data.update(info or {}) 
+    elif state == 'SUCCESS':
+        response_data.update(info if isinstance(info, dict) else {'result': info})
         if 'result_filename' in response_data: 
              response_data['download_url'] = url_for('download_processed_file', filename=response_data['result_filename'], _external=True)
+             response_data['download_urls'] = _download_urls(response_data.get('result_filenames') or [response_data['result_filename']])
         response_data['progress'] = 100
-    elif task.state == 'FAILURE':
-        response_data.update(task.info if isinstance(task.info, dict) else {'error_details': str(task.info)})
+    elif state == 'FAILURE':
+        response_data.update(info if isinstance(info, dict) else {'error_details': str(info)})
         response_data['status'] = 'Task failed.'
-        if task.info and isinstance(task.info, dict) and 'status' in task.info:
-            response_data['status_message'] = task.info.get('status', 'An error occurred during processing.')
-        elif task.info: 
-             response_data['status_message'] = str(task.info)
+        if info and isinstance(info, dict) and 'status' in info:
+            response_data['status_message'] = info.get('status', 'An error occurred during processing.')
+        elif info: 
+             response_data['status_message'] = str(info)
         else:
             response_data['status_message'] = 'An unknown error occurred.'
         response_data['progress'] = 0
     else: 
-        response_data['status'] = f'Task is in state: {task.state}'
-        if task.info and isinstance(task.info, dict):
-            response_data.update(task.info)
+        response_data['status'] = f'Task is in state: {state}'
+        if info and isinstance(info, dict):
+            response_data.update(info)
+    return response_data
 
-    return jsonify(response_data)
+@current_app.route('/status/<task_id>', methods=['GET'])
+def task_status(task_id):
+    celery_app = current_app.extensions['celery']
+    task = celery_app.AsyncResult(task_id) 
+    return jsonify(_task_status_payload(task_id, task.state, task.info))
 
+def _sse_message(data):
+    return f"data: {json.dumps(data)}\n\n"
 
-@current_app.route('/download/<filename>', methods=['GET'])
-def download_processed_file(filename):
-    directory = current_app.config['PROCESSED_FOLDER']
-    current_app.logger.info(f"Download requested for: {filename} from {directory}")
+@current_app.route('/events/<task_id>', methods=['GET'])
+def task_events(task_id):
+    """
+    Server-Sent Events stream of a task's progress, fed by Redis pub/sub.
+    The first event is the current state; the stream ends after SUCCESS/FAILURE.
+    Each open stream holds a server worker, so run the app with a threaded or
+    async worker class. Answers 503 when pub/sub is unavailable (clients then poll /status).
+    """
+    config = current_app.config
+    try:
+        subscription = progress_events.Subscription(config['PROGRESS_REDIS_URL'], task_id)
+    except Exception as e:
+        current_app.logger.warning(f"Progress stream unavailable for task {task_id}: {e}")
+        return jsonify({'error': 'Progress stream unavailable, poll the status URL instead.',
+                        'status_url': url_for('task_status', task_id=task_id, _external=True)}), 503
+
+    task = current_app.extensions['celery'].AsyncResult(task_id)
+    snapshot = _task_status_payload(task_id, task.state, task.info)
+
+    def generate():
+        try:
+            yield _sse_message(snapshot)
+            if snapshot['state'] in progress_events.TERMINAL_STATES:
+                return
+            for event in subscription.events(config['PROGRESS_STREAM_KEEPALIVE_SECONDS'], config['PROGRESS_STREAM_MAX_SECONDS']):
+                if event is None:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _sse_message(_task_status_payload(task_id, event.get('state'), event.get('meta')))
+        finally:
+            subscription.close()
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def _form_float(name, default):
+    value = request.form.get(name, '')
+    if not value.strip():
+        return default
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"'{name}' must be a finite number.")
+    return number
+
+@current_app.route('/preview', methods=['POST'])
+def preview_audio():
+    """
+    Renders the effects chain on a short window of the input, synchronously, and returns
+    the clip (mp3/ogg/wav, 'format' field). The input is either a 'file' or the
+    'source_id' returned by an earlier preview (X-Preview-Source header), so adjusting
+    effects does not upload the file again. Window: 'start' and 'duration' in seconds;
+    'sample_rate' (0 = the input's own) defaults to PREVIEW_SAMPLE_RATE.
+    """
+    config = current_app.config
+    output_format = request.form.get('format', 'mp3').strip().lower()
+    if output_format not in preview.MIMETYPES:
+        return jsonify({'error': f"Unsupported preview format. Use one of: {', '.join(preview.MIMETYPES)}"}), 400
     try:
-        return send_from_directory(directory, filename, as_attachment=True)
-    except FileNotFoundError:
-        current_app.logger.error(f"Download failed: File {filename} not found in {directory}.")
+        effects_chain = json.loads(request.form.get('effects_chain', '[]'))
+        if not isinstance(effects_chain, list):
+            raise ValueError("Effects chain must be a list.")
+        start_s = max(0.0, _form_float('start', 0.0))
+        duration_s = _form_float('duration', config['PREVIEW_DEFAULT_SECONDS'])
+        sample_rate = int(_form_float('sample_rate', config['PREVIEW_SAMPLE_RATE']))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid preview parameters: {e}'}), 400
+    if not 0 < duration_s <= config['PREVIEW_MAX_SECONDS']:
+        return jsonify({'error': f"Preview duration must be between 0 and {config['PREVIEW_MAX_SECONDS']:g} seconds."}), 400
+    if sample_rate and not config['AUDIO_MIN_SAMPLE_RATE'] <= sample_rate <= config['AUDIO_MAX_SAMPLE_RATE']:
+        return jsonify({'error': 'Unsupported preview sample rate.'}), 400
+
+    file = request.files.get('file')
+    if file and file.filename:
+        streamed = isinstance(file.stream, uploads.StreamedUploadFile)
+        is_valid, validation_msg = is_allowed_file(file.filename, file.stream, header=file.stream.header if streamed else None)
+        if is_valid:
+            is_valid, validation_msg, audio_info = check_audio_metadata(
+                file.filename, path=file.stream.path if streamed else None, stream=None if streamed else file.stream)
+        if not is_valid:
+            current_app.logger.warning(f"Preview rejected: {file.filename}, Reason: {validation_msg}")
+            return jsonify({'error': validation_msg}), 400
+        file_ext = secure_filename(file.filename).rsplit('.', 1)[1].lower()
+        if streamed:
+            source_id = file.stream.unique_id
+            saved_path = file.stream.claim()
+        else:
+            source_id = uuid.uuid4().hex
+            saved_path = os.path.join(config['UPLOAD_FOLDER'], f"{source_id}_input.{file_ext}")
+            file.save(saved_path)
+        input_path = preview.save_source(saved_path, source_id, file_ext)
+    else:
+        source_id = request.form.get('source_id', '').strip().lower()
+        input_path = preview.source_path(source_id)
+        if input_path is None:
+            return jsonify({'error': 'Unknown or expired preview source, upload the file again.'}), 404
+        try:
+            audio_info = probe_metadata(input_path, path=input_path)
+        except ValueError:
+            audio_info = None
+
+    # Headers without the details ffmpeg needs are decoded as stereo (downmixed or duplicated).
+    channels = (audio_info or {}).get('channels') or 2
+    frame_rate = sample_rate or (audio_info or {}).get('sample_rate') or 44100
+    if audio_info and audio_info.get('duration') and start_s >= audio_info['duration']:
+        return jsonify({'error': 'The preview start is past the end of the file.'}), 400
+
+    started = time.perf_counter()
+    try:
+        clip = preview.render_preview(input_path, effects_chain, start_s, duration_s, frame_rate, channels,
+                                      output_format=output_format, max_preroll_s=config['PREVIEW_MAX_PREROLL_SECONDS'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Preview of {input_path} failed: {e}", exc_info=True)
+        return jsonify({'error': f'Server error during preview: {str(e)}'}), 500
+    elapsed = time.perf_counter() - started
+    metrics.observe('preview', elapsed, format=output_format)
+    current_app.logger.info(f"Preview of {os.path.basename(input_path)} ({start_s:g}s +{duration_s:g}s at {frame_rate} Hz) rendered in {elapsed * 1000:.0f} ms")
+    return Response(clip, mimetype=preview.MIMETYPES[output_format], headers={
+        'X-Preview-Source': source_id,
+        'X-Preview-Sample-Rate': str(frame_rate),
+        'Server-Timing': f"render;dur={elapsed * 1000:.1f}",
+        'Cache-Control': 'no-store',
+    })
+
+
+@current_app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint (aggregated over all app processes in multiprocess mode)."""
+    if not metrics.is_enabled():
+        return jsonify({'error': 'Metrics are disabled.'}), 404
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+@current_app.route('/stats/cache', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters of the intermediate-stage cache, for monitoring."""
+    return jsonify({'stage_cache': stage_cache.read_stats(current_app.config)})
+
+
+def _set_validators(response, key, info):
+    """ETag, Last-Modified and Cache-Control of a processed result, whoever sends the bytes."""
+    response.last_modified = info.mtime
+    digest = file_registry.content_digest(key)
+    if digest:
+        response.set_etag(digest)
+    else:
+        response.set_etag(f"{info.size:x}-{int(info.mtime):x}", weak=True)
+    # Results never change under a name, but may be cleaned up: revalidate (cheap 304) after max-age.
+    response.cache_control.private = True
+    response.cache_control.max_age = current_app.config.get('DOWNLOAD_CACHE_MAX_AGE_SECONDS', 3600)
+
+def _processed_file_response(store, key, inline=False):
+    """
+    Serves a processed result with Range and conditional request support (206, 304, 416).
+    The ETag is the SHA-256 recorded when the result was stored (file_registry), else a
+    weak tag from size and mtime. With DOWNLOAD_ACCEL_REDIRECT_PREFIX or DOWNLOAD_X_SENDFILE
+    the reverse proxy streams the bytes and the worker is free right away; the validators
+    are the same and a matching If-None-Match is still answered with a 304 here.
+    """
+    config = current_app.config
+    info = store.stat(key)
+    if info is None:
+        raise FileNotFoundError(key)
+    filename = os.path.basename(key)
+    local_path = store.local_path(key)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    headers = {'Content-Disposition': f'{"inline" if inline else "attachment"}; filename="{filename}"'}
+
+    accel_prefix = config.get('DOWNLOAD_ACCEL_REDIRECT_PREFIX')
+    if accel_prefix:
+        # nginx serves the internal location itself, ranges included.
+        headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{quote(filename)}"
+    elif config.get('DOWNLOAD_X_SENDFILE') and local_path is not None:
+        headers['X-Sendfile'] = os.path.abspath(local_path)
+    if 'X-Accel-Redirect' in headers or 'X-Sendfile' in headers:
+        response = Response(mimetype=mimetype, headers=headers)
+        _set_validators(response, key, info)
+        response = response.make_conditional(request)
+        if response.status_code == 304:
+            # Nothing for the proxy to send.
+            response.headers.pop('X-Accel-Redirect', None)
+            response.headers.pop('X-Sendfile', None)
+        return response
+
+    if local_path is not None:
+        body = wrap_file(request.environ, open(local_path, 'rb')) # sendfile() where the server supports it
+    else:
+        body = blob_store.BlobReader(store, key)
+    headers['Accept-Ranges'] = 'bytes' # Also on full responses: players only seek when they see it
+    response = Response(body, mimetype=mimetype, headers=headers, direct_passthrough=True)
+    response.content_length = info.size
+    _set_validators(response, key, info)
+    try:
+        response = response.make_conditional(request, accept_ranges=True, complete_length=info.size)
+    except RequestedRangeNotSatisfiable:
+        body.close()
+        raise
+    if response.status_code == 304 or request.method == 'HEAD':
+        # No body is sent, so the server never closes it.
+        body.close()
+    return response
+
+def _serve_processed_file(filename, inline):
+    store = blob_store.get_blob_store(current_app.config)
+    current_app.logger.info(f"{'Playback' if inline else 'Download'} requested for: {filename}")
+    try:
+        key = blob_store.processed_key(secure_filename(filename))
+        file_registry.touch(key)
+        return _processed_file_response(store, key, inline=inline)
+    except RequestedRangeNotSatisfiable:
+        raise
+    except (FileNotFoundError, NotFound, ValueError): # ValueError: not a valid result name
+        current_app.logger.error(f"Download failed: File {filename} not found in the blob store.")
+        if inline:
+            return jsonify({'error': 'File not found'}), 404
         flash("Requested file not found. It might have been cleaned up or an error occurred.", "error")
         if request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html:
             return jsonify({'error': 'File not found'}), 404
         return redirect(url_for('index')) 
     except Exception as e:
         current_app.logger.error(f"Error during download of {filename}: {e}", exc_info=True)
-        if request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html:
+        if inline or (request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html):
             return jsonify({'error': 'Server error during download'}), 500
         flash("An error occurred while trying to download the file.", "error")
         return redirect(url_for('index'))
 
+@current_app.route('/download/<filename>', methods=['GET'])
+def download_processed_file(filename):
+    return _serve_processed_file(filename, inline=False)
+
+@current_app.route('/play/<filename>', methods=['GET'])
+def play_processed_file(filename):
+    """Inline variant of /download for <audio> players (seeking uses Range requests)."""
+    return _serve_processed_file(filename, inline=True)
+
 @current_app.route('/results/<task_id>', methods=['GET'])
 def result_page(task_id):
     celery_app = current_app.extensions['celery']
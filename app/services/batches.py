@@ -0,0 +1,136 @@
+"""
+Registry of batch uploads.
+
+A batch is one /batch/upload request fanned out into one effects task per file
+(dispatched as a Celery chord). Its record is stored in Redis as JSON:
+    <prefix><batch_id>   {batch_id, created, output_format, effects_chain,
+                          items: [{filename, task_id, cached, result_filename?}],
+                          results: {task_id: result_filename | None}  (set by the chord callback)}
+
+aggregate_status() turns a record into the per-file and overall progress. Once
+the chord callback has stored the results, finished batches need no result
+backend lookups at all.
+"""
+import json
+import time
+import logging
+import redis
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+_clients = {}
+
+UNFINISHED_STATES = ('PENDING', 'STARTED', 'PROGRESS', 'RETRY')
+
+
+def _client():
+    url = current_app.config['BATCH_REDIS_URL']
+    if url not in _clients:
+        _clients[url] = redis.Redis.from_url(url, decode_responses=True)
+    return _clients[url]
+
+def _key(batch_id):
+    return f"{current_app.config.get('BATCH_KEY_PREFIX', 'ams:batch:')}{batch_id}"
+
+
+def save(record):
+    """Stores (or replaces) a batch record; it expires after BATCH_RECORD_TTL_SECONDS."""
+    _client().set(_key(record['batch_id']), json.dumps(record), ex=current_app.config['BATCH_RECORD_TTL_SECONDS'])
+
+def load(batch_id):
+    raw = _client().get(_key(batch_id))
+    return json.loads(raw) if raw else None
+
+def new_record(batch_id, output_format, effects_chain, items):
+    return {
+        'batch_id': batch_id,
+        'created': time.time(),
+        'output_format': output_format,
+        'effects_chain': effects_chain,
+        'items': items,
+    }
+
+def store_results(batch_id, task_results):
+    """
+    Called by the chord callback with the return values of the batch's tasks
+    ({task_id: result dict}). Records the output filename (or None on failure) per task.
+    """
+    record = load(batch_id)
+    if record is None:
+        logger.warning(f"Batch {batch_id}: record expired before the results were stored.")
+        return None
+    results = record.setdefault('results', {})
+    for task_id, result in task_results.items():
+        results[task_id] = result.get('result_filename') if isinstance(result, dict) else None
+    record['finished'] = time.time()
+    save(record)
+    return record
+
+
+def _item_status(item, record, celery_app, task_cache):
+    """(state, progress, result_filename, message) of one batch item."""
+    if item.get('result_filename'):
+        return 'SUCCESS', 100, item['result_filename'], None
+    task_id = item['task_id']
+    results = record.get('results', {})
+    if task_id in results:
+        filename = results[task_id]
+        return ('SUCCESS', 100, filename, None) if filename else ('FAILURE', 0, None, 'Processing failed.')
+
+    if task_id not in task_cache:
+        task = celery_app.AsyncResult(task_id)
+        task_cache[task_id] = (task.state, task.info)
+    state, info = task_cache[task_id]
+    info = info if isinstance(info, dict) else {}
+    if state in UNFINISHED_STATES:
+        return state, int(info.get('progress', 0)), None, info.get('status')
+    # The effects task reports its own errors in a returned dict, so SUCCESS without an output is a failure.
+    if state == 'SUCCESS' and info.get('result_filename'):
+        return 'SUCCESS', 100, info['result_filename'], None
+    return 'FAILURE', 0, None, info.get('status') or 'Processing failed.'
+
+def aggregate_status(record, celery_app):
+    """
+    Overall batch status: state is PROGRESS while any file is unfinished, then
+    SUCCESS, PARTIAL_FAILURE or FAILURE. 'items' carries the per-file state.
+    """
+    task_cache = {}
+    items = []
+    completed = failed = 0
+    progress_total = 0
+    for item in record['items']:
+        state, progress, result_filename, message = _item_status(item, record, celery_app, task_cache)
+        if state == 'SUCCESS':
+            completed += 1
+        elif state == 'FAILURE':
+            failed += 1
+        progress_total += 100 if state == 'FAILURE' else progress
+        items.append({
+            'filename': item['filename'],
+            'task_id': item['task_id'],
+            'cached': item.get('cached', False),
+            'state': state,
+            'progress': progress,
+            'result_filename': result_filename,
+            'status': message,
+        })
+
+    total = len(items)
+    if completed + failed < total:
+        state = 'PROGRESS'
+    elif failed == 0:
+        state = 'SUCCESS'
+    elif completed == 0:
+        state = 'FAILURE'
+    else:
+        state = 'PARTIAL_FAILURE'
+    return {
+        'batch_id': record['batch_id'],
+        'state': state,
+        'total': total,
+        'completed': completed,
+        'failed': failed,
+        'progress': int(progress_total / total) if total else 100,
+        'items': items,
+    }
@@ -0,0 +1,279 @@
+"""
+Pluggable storage for uploaded inputs and processed outputs.
+
+Web and worker nodes exchange files through a blob store instead of a shared
+local path. Keys are '<namespace>/<name>' with two namespaces:
+    uploads/<unique_id>_input.<ext>     input waiting for (or being processed by) a task
+    processed/<output filename>         task result served by /download
+
+Backends:
+    local  files in UPLOAD_FOLDER / PROCESSED_FOLDER (single host or a shared mount);
+           local_path() exposes the file, so nothing is copied.
+    s3     any S3-compatible service (AWS, MinIO, ...) through boto3, which is only
+           imported when this backend is configured. Files are transferred with
+           boto3's streamed multipart transfers; local scratch copies live in
+           UPLOAD_FOLDER / PROCESSED_FOLDER of the node that needs them.
+
+Reads support byte ranges (open_read(key, start, length), or a seekable BlobReader)
+for download requests.
+"""
+import os
+import shutil
+import logging
+from collections import namedtuple
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+UPLOADS = 'uploads'
+PROCESSED = 'processed'
+READ_CHUNK_SIZE = 1024 * 1024
+# Object headers kept when S3BlobStore.touch() copies an object onto itself.
+COPIED_HEADERS = ('ContentType', 'ContentDisposition', 'ContentEncoding', 'ContentLanguage', 'CacheControl')
+
+BlobInfo = namedtuple('BlobInfo', ['key', 'size', 'mtime'])
+
+
+def upload_key(filename):
+    return f"{UPLOADS}/{os.path.basename(filename)}"
+
+def processed_key(filename):
+    return f"{PROCESSED}/{os.path.basename(filename)}"
+
+def _split_key(key):
+    namespace, _, name = key.partition('/')
+    # Namespaces are flat: never let a key reach outside them.
+    if not name or name != os.path.basename(name) or name in ('.', '..'):
+        raise ValueError(f"Invalid blob key: {key!r}")
+    return namespace, name
+
+
+class LocalBlobStore:
+    def __init__(self, roots):
+        self.roots = roots # namespace -> folder
+
+    def local_path(self, key):
+        namespace, name = _split_key(key)
+        return os.path.join(self.roots[namespace], name)
+
+    def put_file(self, key, path, move=True):
+        """Stores a local file under key (moved by default; a no-op if it is already there)."""
+        dest = self.local_path(key)
+        if os.path.abspath(path) == os.path.abspath(dest):
+            return
+        if move:
+            shutil.move(path, dest)
+        else:
+            shutil.copyfile(path, dest)
+
+    def put_stream(self, key, stream):
+        dest = self.local_path(key)
+        tmp_path = f"{dest}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            shutil.copyfileobj(stream, f, READ_CHUNK_SIZE)
+        os.replace(tmp_path, dest)
+
+    @contextmanager
+    def local_copy(self, key):
+        """Yields a local path with the blob's content (here: the file itself)."""
+        yield self.local_path(key)
+
+    def open_read(self, key, start=0, length=None):
+        """Yields the blob's bytes from start, length bytes (or to the end), in chunks."""
+        with open(self.local_path(key), 'rb') as f:
+            f.seek(start)
+            remaining = length
+            while remaining is None or remaining > 0:
+                chunk = f.read(READ_CHUNK_SIZE if remaining is None else min(READ_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def stat(self, key):
+        try:
+            st = os.stat(self.local_path(key))
+        except FileNotFoundError:
+            return None
+        return BlobInfo(key, st.st_size, st.st_mtime)
+
+    def exists(self, key):
+        return os.path.isfile(self.local_path(key))
+
+    def touch(self, key):
+        """Refreshes the blob's modification time (keeps age-based cleanup away)."""
+        os.utime(self.local_path(key), None)
+
+    def delete(self, key):
+        try:
+            os.remove(self.local_path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def list(self, namespace):
+        """Yields BlobInfo for every blob in a namespace (subfolders are not part of it)."""
+        folder = self.roots[namespace]
+        if not os.path.isdir(folder):
+            return
+        for entry in os.scandir(folder):
+            if entry.is_file():
+                st = entry.stat()
+                yield BlobInfo(f"{namespace}/{entry.name}", st.st_size, st.st_mtime)
+
+
+class S3BlobStore:
+    def __init__(self, bucket, prefix='', scratch_folders=None, endpoint_url=None, region_name=None,
+                 access_key_id=None, secret_access_key=None):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError as e:
+            raise RuntimeError("BLOB_STORE_BACKEND=s3 needs the 'boto3' package.") from e
+        self._client_error = ClientError
+        self.client = boto3.client(
+            's3', endpoint_url=endpoint_url or None, region_name=region_name or None,
+            aws_access_key_id=access_key_id or None, aws_secret_access_key=secret_access_key or None
+        )
+        self.bucket = bucket
+        self.prefix = prefix
+        self.scratch_folders = scratch_folders or {}
+
+    def _object_key(self, key):
+        _split_key(key)
+        return f"{self.prefix}{key}"
+
+    def _is_missing(self, error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def local_path(self, key):
+        return None
+
+    def put_file(self, key, path, move=True):
+        self.client.upload_file(path, self.bucket, self._object_key(key))
+        if move:
+            os.remove(path)
+
+    def put_stream(self, key, stream):
+        self.client.upload_fileobj(stream, self.bucket, self._object_key(key))
+
+    @contextmanager
+    def local_copy(self, key):
+        """Downloads the blob to a scratch file for the duration of the block."""
+        namespace, name = _split_key(key)
+        path = os.path.join(self.scratch_folders.get(namespace) or '/tmp', f"{os.getpid()}_{name}")
+        self.client.download_file(self.bucket, self._object_key(key), path)
+        try:
+            yield path
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def open_read(self, key, start=0, length=None):
+        params = {'Bucket': self.bucket, 'Key': self._object_key(key)}
+        if start or length is not None:
+            end = '' if length is None else start + length - 1
+            params['Range'] = f"bytes={start}-{end}"
+        body = self.client.get_object(**params)['Body']
+        try:
+            for chunk in body.iter_chunks(READ_CHUNK_SIZE):
+                yield chunk
+        finally:
+            body.close()
+
+    def stat(self, key):
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except self._client_error as e:
+            if self._is_missing(e):
+                return None
+            raise
+        return BlobInfo(key, head['ContentLength'], head['LastModified'].timestamp())
+
+    def exists(self, key):
+        return self.stat(key) is not None
+
+    def touch(self, key):
+        # S3 only refreshes LastModified through a copy onto itself, which must replace the metadata:
+        # carry the existing headers and user metadata over so the copy does not drop them.
+        object_key = self._object_key(key)
+        head = self.client.head_object(Bucket=self.bucket, Key=object_key)
+        headers = {name: head[name] for name in COPIED_HEADERS if head.get(name)}
+        self.client.copy_object(Bucket=self.bucket, Key=object_key, CopySource={'Bucket': self.bucket, 'Key': object_key},
+                                MetadataDirective='REPLACE', Metadata=head.get('Metadata', {}), **headers)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        return True
+
+    def list(self, namespace):
+        paginator = self.client.get_paginator('list_objects_v2')
+        list_prefix = f"{self.prefix}{namespace}/"
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=list_prefix):
+            for obj in page.get('Contents', []):
+                name = obj['Key'][len(list_prefix):]
+                if name and '/' not in name:
+                    yield BlobInfo(f"{namespace}/{name}", obj['Size'], obj['LastModified'].timestamp())
+
+
+class BlobReader:
+    """
+    Lazily opened, seekable iterator over a blob's chunks. werkzeug's range handling
+    (Response.make_conditional) seeks it to the range start before the first read,
+    so only the requested bytes are fetched.
+    """
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+        self.position = 0
+        self._chunks = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._chunks is None:
+            self._chunks = self.store.open_read(self.key, self.position)
+        chunk = next(self._chunks)
+        self.position += len(chunk)
+        return chunk
+
+    def seekable(self):
+        return True
+
+    def seek(self, position):
+        if self._chunks is not None:
+            raise ValueError("BlobReader can only seek before the first read.")
+        self.position = position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        if self._chunks is not None:
+            self._chunks.close()
+
+
+_instances = {}
+
+def get_blob_store(config):
+    """Process-wide blob store for the configured backend."""
+    backend = config.get('BLOB_STORE_BACKEND', 'local')
+    if backend not in _instances:
+        roots = {UPLOADS: config['UPLOAD_FOLDER'], PROCESSED: config['PROCESSED_FOLDER']}
+        if backend == 'local':
+            _instances[backend] = LocalBlobStore(roots)
+        elif backend == 's3':
+            _instances[backend] = S3BlobStore(
+                bucket=config['S3_BUCKET'],
+                prefix=config.get('S3_PREFIX', ''),
+                scratch_folders=roots,
+                endpoint_url=config.get('S3_ENDPOINT_URL'),
+                region_name=config.get('S3_REGION'),
+                access_key_id=config.get('S3_ACCESS_KEY_ID'),
+                secret_access_key=config.get('S3_SECRET_ACCESS_KEY'),
+            )
+        else:
+            raise ValueError(f"Unknown BLOB_STORE_BACKEND '{backend}' (expected 'local' or 's3').")
+    return _instances[backend]
@@ -0,0 +1,221 @@
+"""
+Effects-chain planner.
+
+compile_chain() turns an effects_chain into an ExecutionPlan before any audio is
+touched:
+  * no-op steps are dropped (gain 0 dB, speed factor 1.0, reverb wet_level 0,
+    unknown or unnamed effects);
+  * gains are folded into one scalar and moved past the linear effects (filters,
+    echo, reverb, speed_pitch), so they end up in the final PCM conversion. Any
+    other whole-buffer effect is a barrier: pending gain is applied before it;
+  * adjacent high/low-pass filters are merged into one SOS cascade, i.e. one pass
+    instead of one per filter (HPF + LPF becomes a band-pass).
+
+The float pipeline only clips at export, so moving gain past linear effects does
+not change the result beyond float rounding.
+"""
+import json
+import logging
+import numpy as np
+
+from . import dsp_engine
+
+logger = logging.getLogger(__name__)
+
+FILTER_EFFECTS = ('high_pass_filter', 'low_pass_filter')
+STAGE_EFFECTS = FILTER_EFFECTS + ('echo', 'reverb')
+# Effects a constant gain commutes with (both speed_pitch backends scale linearly).
+LINEAR_EFFECTS = STAGE_EFFECTS + ('speed_pitch',)
+
+
+def _canonical_value(value):
+    # 1 and 1.0 must produce the same key; booleans stay booleans.
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+def canonical_effect(effect_config):
+    """Effect config with default parameters filled in and numbers normalized."""
+    if not isinstance(effect_config, dict):
+        return effect_config
+    params = dsp_engine.effect_params(effect_config)
+    entry = {k: _canonical_value(v) for k, v in params.items()}
+    entry['name'] = effect_config.get('name')
+    return entry
+
+def canonicalize_chain(effects_chain):
+    """Returns the chain as canonical JSON (defaults filled in, keys sorted)."""
+    return json.dumps([canonical_effect(e) for e in effects_chain], sort_keys=True, separators=(',', ':'))
+
+
+class PlanStep:
+    """
+    One pass over the audio.
+    kind: 'filters' (one SOS cascade for one or more adjacent filters),
+          'stage' (echo/reverb), 'gain' (materialized pending gain) or
+          'whole_buffer' (effects that change the length, e.g. speed_pitch).
+    """
+    def __init__(self, kind, effects, gain_db=0.0):
+        self.kind = kind
+        self.effects = effects # [(index in the original chain, effect_config)]
+        self.gain_db = gain_db
+
+    @property
+    def names(self):
+        return [config.get('name') for _, config in self.effects]
+
+    @property
+    def label(self):
+        """Short name of the step for metrics, e.g. 'echo' or 'high_pass_filter+low_pass_filter'."""
+        return 'gain' if self.kind == 'gain' else '+'.join(self.names)
+
+    @property
+    def title(self):
+        if self.kind == 'gain':
+            return 'Gain'
+        if self.kind == 'filters' and set(self.names) == set(FILTER_EFFECTS):
+            return 'Band-pass Filter'
+        return ' + '.join(name.replace('_', ' ').title() for name in self.names)
+
+    def signature(self):
+        """Canonical description of what this step does to the buffer."""
+        if self.kind == 'gain':
+            return {'kind': 'gain', 'gain_db': float(self.gain_db)}
+        return {'kind': self.kind, 'effects': [canonical_effect(config) for _, config in self.effects]}
+
+    def describe(self):
+        if self.kind == 'gain':
+            return f"gain {self.gain_db:+.2f} dB"
+        detail = f" ({len(self.effects)} filters, 1 SOS pass)" if self.kind == 'filters' and len(self.effects) > 1 else ''
+        return '+'.join(self.names) + detail
+
+    def build(self, frame_rate, channels):
+        """Creates the stage for this step, or None if every effect in it turned out to be a no-op."""
+        if self.kind == 'gain':
+            return dsp_engine.GainStage(10 ** (self.gain_db / 20.0))
+        if self.kind == 'stage':
+            return dsp_engine.create_stage(self.effects[0][1], frame_rate, channels)
+        if self.kind == 'filters':
+            stages = [dsp_engine.create_stage(config, frame_rate, channels) for _, config in self.effects]
+            sections = [stage.sos for stage in stages if stage is not None]
+            if not sections:
+                return None
+            return dsp_engine.SOSFilterStage(np.vstack(sections))
+        raise ValueError(f"Plan step of kind '{self.kind}' has no stage.")
+
+    def run(self, samples, frame_rate, progress_func=None):
+        """
+        Runs this step over a whole buffer and returns the resulting array.
+        progress_func is called with the processed fraction (block stages only).
+        """
+        if self.kind == 'whole_buffer':
+            result = dsp_engine.apply_effect(samples, frame_rate, self.effects[0][1])
+            return samples if result is None else result
+        stage = self.build(frame_rate, samples.shape[0])
+        if stage is None or samples.shape[1] == 0:
+            return samples
+        return dsp_engine.run_stage(stage, samples, progress_func=progress_func)
+
+
+class ExecutionPlan:
+    def __init__(self, steps, output_gain_db, effect_count):
+        self.steps = steps
+        self.output_gain_db = output_gain_db
+        self.effect_count = effect_count
+
+    @property
+    def output_gain(self):
+        """Linear gain applied during the final PCM conversion."""
+        return 10 ** (self.output_gain_db / 20.0)
+
+    @property
+    def pass_count(self):
+        return len(self.steps)
+
+    @property
+    def is_streamable(self):
+        return all(step.kind != 'whole_buffer' for step in self.steps)
+
+    def prefix_signatures(self):
+        """
+        Canonical signatures of the plan prefixes: entry k describes the buffer after
+        the first k steps (entry 0 is the decoded input). Used as stage cache keys.
+        """
+        signatures = []
+        for k in range(len(self.steps) + 1):
+            signatures.append(json.dumps([step.signature() for step in self.steps[:k]], sort_keys=True, separators=(',', ':')))
+        return signatures
+
+    def build_stages(self, frame_rate, channels):
+        """Stages for the block-wise (streaming) pipeline; the plan must be streamable."""
+        return build_stages(self.steps, frame_rate, channels)
+
+    def describe(self):
+        saved = self.effect_count - self.pass_count
+        lines = [f"Execution plan: {self.effect_count} effects -> {self.pass_count} passes ({saved} saved)"]
+        for i, step in enumerate(self.steps):
+            lines.append(f"  {i + 1}. {step.describe()}")
+        if self.output_gain_db:
+            lines.append(f"  output gain {self.output_gain_db:+.2f} dB applied at PCM conversion")
+        return '\n'.join(lines)
+
+
+def build_stages(steps, frame_rate, channels):
+    """Fresh stages for consecutive non-whole-buffer steps (steps that turn out to be no-ops are left out)."""
+    return [stage for _, stage in build_labelled_stages(steps, frame_rate, channels)]
+
+def build_labelled_stages(steps, frame_rate, channels):
+    """Like build_stages, as (step label, stage) pairs."""
+    labelled = []
+    for step in steps:
+        stage = step.build(frame_rate, channels)
+        if stage is not None:
+            labelled.append((step.label, stage))
+    return labelled
+
+def _is_noop(name, params):
+    if name == 'gain':
+        return params['gain_db'] == 0
+    if name == 'speed_pitch':
+        return params['factor'] == 1.0
+    if name == 'reverb':
+        return params['wet_level'] == 0
+    return False
+
+def compile_chain(effects_chain):
+    """Builds the ExecutionPlan for an effects_chain (see the module docstring)."""
+    steps = []
+    pending_gain_db = 0.0
+    for i, effect_config in enumerate(effects_chain):
+        name = effect_config.get('name')
+        if not name:
+            logger.warning(f"Skipping effect {i}: missing 'name'. Config: {effect_config}")
+            continue
+        if name not in dsp_engine.EFFECT_DEFAULTS:
+            logger.warning(f"Unknown effect: '{name}'. Skipping.")
+            continue
+        params = dsp_engine.effect_params(effect_config)
+        if _is_noop(name, params):
+            logger.info(f"Dropping no-op effect {i}: {effect_config}")
+            continue
+
+        if name == 'gain':
+            gain_db = params['gain_db']
+            if isinstance(gain_db, bool) or not isinstance(gain_db, (int, float)):
+                logger.warning(f"Invalid gain_db type: {gain_db}. Must be a number. Skipping gain.")
+                continue
+            pending_gain_db += float(gain_db)
+        elif name in FILTER_EFFECTS:
+            if steps and steps[-1].kind == 'filters':
+                steps[-1].effects.append((i, effect_config))
+            else:
+                steps.append(PlanStep('filters', [(i, effect_config)]))
+        elif name in STAGE_EFFECTS:
+            steps.append(PlanStep('stage', [(i, effect_config)]))
+        else:
+            # Gain cannot be moved past a non-linear whole-buffer effect: apply it first.
+            if pending_gain_db and name not in LINEAR_EFFECTS:
+                steps.append(PlanStep('gain', [], gain_db=pending_gain_db))
+                pending_gain_db = 0.0
+            steps.append(PlanStep('whole_buffer', [(i, effect_config)]))
+    return ExecutionPlan(steps, pending_gain_db, len(effects_chain))
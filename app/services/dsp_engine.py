@@ -0,0 +1,491 @@
+"""
+NumPy DSP engine for the effects chain.
+
+The input is decoded once into a float32 array of shape (channels, samples)
+scaled to [-1.0, 1.0). Every effect works on that array in place (or through
+small preallocated scratch blocks), and the audio is only converted back to
+integer PCM at export time. Clipping therefore happens once, at the end,
+instead of after every pydub operation.
+"""
+import math
+import logging
+from fractions import Fraction
+from functools import lru_cache
+import numpy as np
+from pydub import AudioSegment
+from scipy.signal import butter, sosfilt, sosfilt_zi, resample_poly
+from scipy.fft import rfft, irfft
+
+logger = logging.getLogger(__name__)
+
+# Number of frames processed per scratch block by the delay-line and filter effects.
+BLOCK_FRAMES = 65536
+# Partition size range of the convolution reverb (powers of two; the FFT is twice the partition).
+CONVOLUTION_MIN_PARTITION_FRAMES = 4096
+CONVOLUTION_MAX_PARTITION_FRAMES = 16384
+
+# Default parameters for every effect name accepted in an effects_chain.
+EFFECT_DEFAULTS = {
+    'gain': {'gain_db': 0.0},
+    'high_pass_filter': {'cutoff_hz': 80, 'order': 1},
+    'low_pass_filter': {'cutoff_hz': 5000, 'order': 1},
+    'speed_pitch': {'factor': 1.0, 'mode': 'resample'},
+    'echo': {'delay_ms': 500, 'decay_factor': 0.5},
+    'reverb': {'wet_level': 0.3, 'room_size': 0.5, 'mode': 'auto', 'tail_seconds': 0.0},
+}
+
+# Reverb tap tables (the same as the pydub reference in benchmarks/pydub_reference.py).
+REVERB_BASE_DELAYS_MS = [23, 37, 53, 71, 97, 131, 173, 223]
+REVERB_BASE_DECAYS = [0.7, 0.65, 0.6, 0.55, 0.5, 0.45, 0.4, 0.35]
+REVERB_MODES = ('auto', 'taps', 'convolution')
+MAX_FILTER_ORDER = 8
+REVERB_MAX_TAIL_SECONDS = 10.0
+SPEED_FACTOR_MIN = 0.25
+SPEED_FACTOR_MAX = 4.0
+# Largest denominator of the resampling ratio; bounds the polyphase filter bank size.
+SPEED_MAX_DENOMINATOR = 200
+
+_PCM_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+
+
+# --- PCM <-> float conversion ---
+
+def segment_to_array(audio_segment):
+    """
+    Converts a pydub AudioSegment into a float32 (channels, samples) array.
+    Returns (samples, frame_rate, sample_width).
+    """
+    if audio_segment.sample_width not in _PCM_DTYPES:
+        audio_segment = audio_segment.set_sample_width(4)
+    sample_width = audio_segment.sample_width
+    channels = audio_segment.channels
+
+    pcm = np.frombuffer(audio_segment.raw_data, dtype=_PCM_DTYPES[sample_width])
+    frame_count = pcm.size // channels
+    samples = np.empty((channels, frame_count), dtype=np.float32)
+    samples[...] = pcm[:frame_count * channels].reshape(frame_count, channels).T
+    samples *= np.float32(1.0 / (1 << (8 * sample_width - 1)))
+    return samples, audio_segment.frame_rate, sample_width
+
+def array_to_pcm_bytes(samples, sample_width, gain=1.0):
+    """
+    Clips and quantizes a float32 (channels, samples) array into interleaved PCM bytes.
+    gain is a linear output gain applied before clipping (see chain_planner).
+    The array is modified in place and should not be reused afterwards.
+    """
+    scale = float(1 << (8 * sample_width - 1))
+    # The largest positive value must survive the round trip through float32 without overflowing.
+    upper = np.float32(min((scale - 1.0) / scale, float(np.nextafter(np.float32(1.0), np.float32(0.0)))))
+    if gain != 1.0:
+        samples *= np.float32(gain)
+    np.clip(samples, -1.0, upper, out=samples)
+    samples *= np.float32(scale)
+    np.rint(samples, out=samples)
+
+    channels, frame_count = samples.shape
+    pcm = np.empty((frame_count, channels), dtype=_PCM_DTYPES[sample_width])
+    np.copyto(pcm.T, samples, casting='unsafe')
+    return pcm.tobytes()
+
+def array_to_segment(samples, frame_rate, sample_width, gain=1.0):
+    """Builds a pydub AudioSegment from a float32 (channels, samples) array (consumes the array)."""
+    channels = samples.shape[0]
+    return AudioSegment(
+        data=array_to_pcm_bytes(samples, sample_width, gain=gain),
+        sample_width=sample_width,
+        frame_rate=frame_rate,
+        channels=channels
+    )
+
+def decode_file(input_path):
+    """Decodes an audio file once. Returns (samples, frame_rate, sample_width)."""
+    audio = AudioSegment.from_file(input_path)
+    return segment_to_array(audio)
+
+
+# --- Stages ---
+# A stage processes consecutive (channels, n) blocks in place and carries the state
+# it needs (filter memory, delay lines, convolution overlap) from one block to the
+# next. Whole-buffer processing and the streaming pipeline run the same stages.
+# memory_frames() is how many input frames a fresh stage must see before its output
+# matches a stage that has run from the start (used to warm up parallel segments).
+
+class GainStage:
+    """Constant linear gain."""
+    def __init__(self, gain):
+        self.gain = np.float32(gain)
+
+    def process(self, block):
+        block *= self.gain
+        return block
+
+    def memory_frames(self):
+        return 0
+
+class SOSFilterStage:
+    """
+    IIR filter as second-order sections (scipy.signal.sosfilt) with its state
+    carried between blocks. The state is seeded from the first frame at its
+    steady-state value, so a constant input produces no start-up transient.
+    """
+    def __init__(self, sos):
+        self.sos = sos
+        self.zi = None
+
+    def process(self, block):
+        if block.shape[1] == 0:
+            return block
+        if self.zi is None:
+            # (sections, 2) * (channels,) -> (sections, channels, 2)
+            self.zi = sosfilt_zi(self.sos)[:, None, :] * block[:, 0].astype(np.float64)[None, :, None]
+        filtered, self.zi = sosfilt(self.sos, block, axis=-1, zi=self.zi)
+        block[...] = filtered
+        return block
+
+    def memory_frames(self, tolerance=1e-7):
+        """Frames until the transient of each section (pole radius r < 1) has decayed below tolerance."""
+        frames = 0
+        for section in self.sos:
+            poles = np.roots(section[3:])
+            radius = float(np.abs(poles).max()) if poles.size else 0.0
+            frames += 2 if radius <= tolerance else int(math.ceil(math.log(tolerance) / math.log(radius)))
+        return frames
+
+class DelayTapStage:
+    """
+    Multi-tap delay: out[n] = dry_gain * x[n] + wet_gain * sum(g * x[n - d]).
+    The last max(d) input frames are kept as a delay line between blocks. Output
+    keeps the input length (taps running past the end are dropped), matching
+    AudioSegment.overlay.
+    """
+    def __init__(self, taps, channels, dry_gain=1.0, wet_gain=1.0):
+        self.taps = [(int(d), np.float32(wet_gain * g)) for d, g in taps if d > 0]
+        self.dry_gain = np.float32(dry_gain)
+        max_delay = max((d for d, _ in self.taps), default=0)
+        self.history = np.zeros((channels, max_delay), dtype=np.float32)
+
+    def process(self, block):
+        frame_count = block.shape[1]
+        history_len = self.history.shape[1]
+        if frame_count == 0:
+            return block
+        extended = np.concatenate((self.history, block), axis=1)
+        if self.dry_gain != 1.0:
+            block *= self.dry_gain
+        scratch = np.empty_like(block)
+        for delay, tap_gain in self.taps:
+            start = history_len - delay
+            np.multiply(extended[:, start:start + frame_count], tap_gain, out=scratch)
+            block += scratch
+        self.history = extended[:, frame_count:].copy()
+        return block
+
+    def memory_frames(self):
+        return self.history.shape[1]
+
+class PartitionedConvolver:
+    """
+    FFT convolution with a fixed mono impulse response, uniformly partitioned
+    (overlap-save with a frequency-domain delay line). The FFT size follows the
+    partition size, not the impulse response: a 10 s tail costs a few more
+    spectrum multiply-adds per partition instead of a multi-million-point FFT per
+    block. State is carried between calls to process(), so the same object can be
+    fed consecutive blocks of any size, with no added latency.
+    """
+    def __init__(self, impulse_response, channels):
+        self.ir = np.asarray(impulse_response, dtype=np.float32)
+        self.ir_len = len(self.ir)
+        # A power of two between CONVOLUTION_MIN/MAX_PARTITION_FRAMES, so it divides BLOCK_FRAMES.
+        self.partition = min(CONVOLUTION_MAX_PARTITION_FRAMES, max(CONVOLUTION_MIN_PARTITION_FRAMES, 1 << (self.ir_len - 1).bit_length()))
+        self.fft_size = 2 * self.partition
+        partitions = -(-self.ir_len // self.partition)
+        padded = np.zeros(partitions * self.partition, dtype=np.float32)
+        padded[:self.ir_len] = self.ir
+        # Spectra of the IR partitions, each zero-padded to the FFT size.
+        self.ir_spectra = rfft(padded.reshape(partitions, self.partition), n=self.fft_size, axis=-1)
+        bins = self.ir_spectra.shape[1]
+        # Spectra of the last partitions-1 complete input partitions, newest first.
+        self.history = np.zeros((partitions - 1, channels, bins), dtype=self.ir_spectra.dtype)
+        # Their contribution to the current partition's output (sum of history * later IR partitions).
+        self.tail = np.zeros((channels, bins), dtype=self.ir_spectra.dtype)
+        # Overlap-save frame: previous input partition, then the current (partly filled) one.
+        self.frame = np.zeros((channels, self.fft_size), dtype=np.float32)
+        self.filled = 0
+
+    def process(self, block):
+        """Convolves one (channels, n) block in place and returns it."""
+        frame_count = block.shape[1]
+        start = 0
+        while start < frame_count:
+            length = min(self.partition - self.filled, frame_count - start)
+            piece = block[:, start:start + length]
+            position = self.partition + self.filled
+            self.frame[:, position:position + length] = piece
+            # Samples after the filled part are still zero, so the output up to it is already exact.
+            spectrum = rfft(self.frame, axis=-1)
+            out = irfft(spectrum * self.ir_spectra[0] + self.tail, n=self.fft_size, axis=-1)
+            piece[...] = out[:, position:position + length]
+            self.filled += length
+            start += length
+            if self.filled == self.partition:
+                self._advance(spectrum)
+        return block
+
+    def _advance(self, spectrum):
+        """Completes the current partition: shifts the delay line and precomputes the next tail."""
+        if len(self.history):
+            self.history[1:] = self.history[:-1]
+            self.history[0] = spectrum
+            self.tail = np.einsum('kf,kcf->cf', self.ir_spectra[1:], self.history)
+        self.frame[:, :self.partition] = self.frame[:, self.partition:]
+        self.frame[:, self.partition:] = 0.0
+        self.filled = 0
+
+    def memory_frames(self):
+        return self.ir_len - 1
+
+def run_stage(stage, samples, progress_func=None):
+    """
+    Runs a stage over a whole (channels, samples) array in BLOCK_FRAMES-sized views.
+    progress_func, if given, is called with the processed fraction after every block.
+    """
+    frame_count = samples.shape[1]
+    for start in range(0, frame_count, BLOCK_FRAMES):
+        stage.process(samples[:, start:start + BLOCK_FRAMES])
+        if progress_func:
+            progress_func(min(frame_count, start + BLOCK_FRAMES) / float(frame_count))
+    return samples
+
+
+# --- Effect parameters -> stages ---
+# Each factory validates the effect's parameters and returns a stage, or None when
+# the effect should be skipped (invalid parameters or a no-op).
+
+def _gain_stage(params, frame_rate, channels):
+    gain_db = params['gain_db']
+    logger.info(f"Applying gain of {gain_db} dB.")
+    if not isinstance(gain_db, (int, float)):
+        logger.warning(f"Invalid gain_db type: {gain_db}. Must be a number. Skipping gain.")
+        return None
+    return GainStage(10 ** (float(gain_db) / 20.0))
+
+def _validate_cutoff(kind, cutoff_hz, frame_rate):
+    if not isinstance(cutoff_hz, (int, float)) or cutoff_hz <= 0:
+        logger.warning(f"Invalid {kind} cutoff frequency: {cutoff_hz}. Must be positive. Skipping filter.")
+        return False
+    if cutoff_hz >= frame_rate / 2: # Check against Nyquist
+        logger.warning(f"{kind.capitalize()} cutoff {int(cutoff_hz)}Hz is too high for sample rate {frame_rate}Hz. Skipping filter.")
+        return False
+    return True
+
+@lru_cache(maxsize=256)
+def butterworth_sos(btype, cutoff_hz, frame_rate, order):
+    """Butterworth filter design as second-order sections (cached per parameter set)."""
+    return butter(order, cutoff_hz, btype=btype, fs=frame_rate, output='sos')
+
+def _filter_order(kind, order):
+    if isinstance(order, bool) or not isinstance(order, (int, float)) or int(order) != order or not (1 <= order <= MAX_FILTER_ORDER):
+        logger.warning(f"Invalid {kind} filter order: {order}. Must be an integer from 1 to {MAX_FILTER_ORDER}. Using order 1.")
+        return 1
+    return int(order)
+
+def _high_pass_stage(params, frame_rate, channels):
+    """Butterworth high-pass filter (order 1 = 6 dB/octave, each extra order adds 6 dB)."""
+    cutoff_hz = params['cutoff_hz']
+    order = _filter_order('high-pass', params['order'])
+    logger.info(f"Applying high-pass filter effect with cutoff {cutoff_hz} Hz, order {order}.")
+    if not _validate_cutoff('high-pass', cutoff_hz, frame_rate):
+        return None
+    return SOSFilterStage(butterworth_sos('highpass', float(cutoff_hz), frame_rate, order))
+
+def _low_pass_stage(params, frame_rate, channels):
+    """Butterworth low-pass filter (order 1 = 6 dB/octave, each extra order adds 6 dB)."""
+    cutoff_hz = params['cutoff_hz']
+    order = _filter_order('low-pass', params['order'])
+    logger.info(f"Applying low-pass filter with cutoff {cutoff_hz} Hz, order {order}.")
+    if not _validate_cutoff('low-pass', cutoff_hz, frame_rate):
+        return None
+    return SOSFilterStage(butterworth_sos('lowpass', float(cutoff_hz), frame_rate, order))
+
+def _ms_to_frames(duration_ms, frame_rate):
+    # Same rounding as AudioSegment.silent(duration=...)
+    return int(frame_rate * (duration_ms / 1000.0))
+
+def _echo_stage(params, frame_rate, channels):
+    delay_ms, decay_factor = params['delay_ms'], params['decay_factor']
+    logger.info(f"Applying echo with delay {delay_ms}ms and decay {decay_factor}.")
+    if not isinstance(delay_ms, (int, float)) or delay_ms <= 0:
+        logger.warning(f"Invalid echo delay_ms: {delay_ms}. Skipping.")
+        return None
+    if not isinstance(decay_factor, (int, float)) or not (0 < decay_factor < 1):
+        logger.warning(f"Invalid echo decay_factor: {decay_factor}. Must be between 0 (exclusive) and 1 (exclusive). Skipping.")
+        return None
+    delay_frames = _ms_to_frames(int(delay_ms), frame_rate)
+    return DelayTapStage([(delay_frames, float(decay_factor))], channels)
+
+def reverb_taps(frame_rate, room_size):
+    """Returns the (delay_frames, gain) taps of the simple reverb for a room size."""
+    delays = [int(d * (0.5 + room_size * 1.5)) for d in REVERB_BASE_DELAYS_MS]
+    decays = [d * (1.0 - room_size * 0.5) for d in REVERB_BASE_DECAYS]
+    return [(_ms_to_frames(delay_ms, frame_rate), max(0.01, decay)) for delay_ms, decay in zip(delays, decays)]
+
+def reverb_mix_gains(wet_level):
+    """Returns the (dry, wet) linear gains used to mix the simple reverb."""
+    dry_gain_db = -120.0 # Effectively silent if wet_level is 1.0
+    if wet_level < 1.0:
+        dry_gain_db = 20 * math.log10(1.0 - wet_level + 1e-6)
+    wet_gain_db = 20 * math.log10(wet_level + 1e-6)
+    return 10 ** (dry_gain_db / 20.0), 10 ** (wet_gain_db / 20.0)
+
+def reverb_impulse_response(frame_rate, wet_level, room_size, tail_seconds=0.0):
+    """
+    Builds the reverb impulse response from the tap tables: the dry gain at lag 0,
+    the eight scaled taps, and optionally an exponentially decaying noise tail
+    (reaching -60 dB after tail_seconds) starting at the last tap.
+    """
+    taps = reverb_taps(frame_rate, room_size)
+    dry_gain, wet_gain = reverb_mix_gains(wet_level)
+    last_tap = max(d for d, _ in taps)
+    tail_frames = int(frame_rate * tail_seconds)
+
+    ir = np.zeros(last_tap + tail_frames + 1, dtype=np.float64)
+    ir[0] += dry_gain
+    for delay, tap_gain in taps:
+        ir[delay] += wet_gain * tap_gain
+
+    if tail_frames > 0:
+        t = np.arange(1, tail_frames + 1) / float(frame_rate)
+        envelope = 10 ** (-3.0 * t / tail_seconds)
+        noise = np.random.default_rng(0).standard_normal(tail_frames) * envelope
+        # Give the diffuse tail the same energy as the discrete early reflections.
+        tap_energy = sum(g * g for _, g in taps)
+        noise *= math.sqrt(tap_energy / float(np.sum(noise * noise)))
+        ir[last_tap + 1:] += wet_gain * noise
+    return ir.astype(np.float32)
+
+def _reverb_stage(params, frame_rate, channels):
+    """
+    Simple algorithmic reverb: eight delayed, attenuated copies mixed with the dry signal.
+    wet_level: How much of the reverberated signal to mix (0.0 to 1.0).
+    room_size: Affects delay times and decay (0.0 to 1.0).
+    mode: 'taps' mixes the eight taps directly, 'convolution' applies them (plus the
+          optional tail) as an impulse response. 'auto' uses convolution only when a
+          tail is requested.
+    tail_seconds: Length of the optional synthetic decay tail (convolution only).
+    """
+    wet_level, room_size = params['wet_level'], params['room_size']
+    mode, tail_seconds = params['mode'], params['tail_seconds']
+    logger.info(f"Applying simple reverb with wet_level: {wet_level}, room_size: {room_size}, mode: {mode}, tail: {tail_seconds}s")
+    if not (0 <= wet_level <= 1 and 0 <= room_size <= 1):
+        logger.warning("Invalid reverb parameters (wet_level/room_size out of 0-1 range). Skipping effect.")
+        return None
+    if mode not in REVERB_MODES:
+        logger.warning(f"Unknown reverb mode '{mode}'. Falling back to 'auto'.")
+        mode = 'auto'
+    if not isinstance(tail_seconds, (int, float)) or not (0 <= tail_seconds <= REVERB_MAX_TAIL_SECONDS):
+        logger.warning(f"Invalid reverb tail_seconds: {tail_seconds}. Must be between 0 and {REVERB_MAX_TAIL_SECONDS}. Ignoring tail.")
+        tail_seconds = 0.0
+    if wet_level == 0:
+        logger.info("Reverb wet_level is 0. Skipping reverb effect.")
+        return None
+    if mode == 'convolution' or (mode == 'auto' and tail_seconds > 0):
+        ir = reverb_impulse_response(frame_rate, wet_level, room_size, tail_seconds)
+        logger.info(f"Convolution reverb: IR length {len(ir)} frames ({len(ir)/float(frame_rate):.2f}s).")
+        return PartitionedConvolver(ir, channels)
+    if tail_seconds > 0:
+        logger.warning("Reverb tail_seconds is only supported in convolution mode. Ignoring tail.")
+    dry_gain, wet_gain = reverb_mix_gains(wet_level)
+    return DelayTapStage(reverb_taps(frame_rate, room_size), channels, dry_gain=dry_gain, wet_gain=wet_gain)
+
+STAGE_FACTORIES = {
+    'gain': _gain_stage,
+    'high_pass_filter': _high_pass_stage,
+    'low_pass_filter': _low_pass_stage,
+    'echo': _echo_stage,
+    'reverb': _reverb_stage,
+}
+
+# Effects that change the length of the audio and need the whole buffer.
+WHOLE_BUFFER_EFFECTS = {'speed_pitch'}
+
+
+# --- Whole-buffer effects ---
+
+def _resample_speed(samples, factor):
+    """Speed and pitch change: polyphase resampling by a rational approximation of 1/factor."""
+    ratio = Fraction(1.0 / factor).limit_denominator(SPEED_MAX_DENOMINATOR)
+    logger.info(f"Resampling by {ratio.numerator}/{ratio.denominator} (effective factor {ratio.denominator / ratio.numerator:.4f}).")
+    result = resample_poly(samples, ratio.numerator, ratio.denominator, axis=1)
+    return result.astype(np.float32, copy=False)
+
+def _time_stretch_speed(samples, factor):
+    """Speed change with the pitch preserved: librosa's phase vocoder over all channels at once."""
+    import librosa # Imported lazily: loading librosa is slow and only this mode needs it.
+    result = librosa.effects.time_stretch(samples, rate=float(factor))
+    return np.ascontiguousarray(result, dtype=np.float32)
+
+SPEED_BACKENDS = {
+    'resample': _resample_speed,
+    'time_stretch': _time_stretch_speed,
+}
+
+def apply_speed_pitch(samples, frame_rate, factor, mode='resample'):
+    """
+    Changes the playback speed by factor (> 1 faster, < 1 slower).
+    mode 'resample' changes pitch along with speed (polyphase resampler, cheapest);
+    mode 'time_stretch' keeps the pitch (phase vocoder).
+    """
+    logger.info(f"Applying speed/pitch change with factor {factor}, mode {mode}.")
+    if isinstance(factor, bool) or not isinstance(factor, (int, float)):
+        logger.warning(f"Invalid speed factor type: {factor}. Must be a number. Skipping effect.")
+        return samples
+    if factor == 1.0:
+        logger.info("Speed factor is 1.0, no change applied.")
+        return samples
+    if not (SPEED_FACTOR_MIN <= factor <= SPEED_FACTOR_MAX):
+        logger.warning(f"Speed factor must be between {SPEED_FACTOR_MIN} and {SPEED_FACTOR_MAX}. Value was {factor}. Skipping effect.")
+        return samples
+    if mode not in SPEED_BACKENDS:
+        logger.warning(f"Unknown speed_pitch mode '{mode}'. Expected one of {sorted(SPEED_BACKENDS)}. Skipping effect.")
+        return samples
+    if samples.shape[1] == 0:
+        return samples
+    try:
+        return SPEED_BACKENDS[mode](samples, float(factor))
+    except Exception as e:
+        logger.error(f"Error during {mode} speed change with factor {factor}: {e}", exc_info=True)
+        return samples
+
+
+# --- Dispatch ---
+
+def effect_params(effect_config):
+    """Returns the effect's parameters with the documented defaults filled in."""
+    params = dict(EFFECT_DEFAULTS.get(effect_config.get('name'), {}))
+    params.update({k: v for k, v in effect_config.items() if k != 'name'})
+    return params
+
+def create_stage(effect_config, frame_rate, channels):
+    """
+    Returns the stage for a streamable effect, or None if the effect is skipped.
+    Raises KeyError for effects that have no stage (unknown or whole-buffer effects).
+    """
+    factory = STAGE_FACTORIES[effect_config.get('name')]
+    return factory(effect_params(effect_config), frame_rate, channels)
+
+def apply_effect(samples, frame_rate, effect_config):
+    """
+    Applies one effects_chain entry to the array and returns the resulting array
+    (the same object unless the effect changes the length).
+    Returns None for an unknown effect name.
+    """
+    name = effect_config.get('name')
+    if name == 'speed_pitch':
+        params = effect_params(effect_config)
+        return apply_speed_pitch(samples, frame_rate, params['factor'], mode=params['mode'])
+    if name not in STAGE_FACTORIES:
+        return None
+    stage = create_stage(effect_config, frame_rate, samples.shape[0])
+    if stage is None or samples.shape[1] == 0:
+        return samples
+    return run_stage(stage, samples)
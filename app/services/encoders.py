@@ -0,0 +1,173 @@
+"""
+ffmpeg encoders for the processed audio.
+
+Processed PCM is piped straight into ffmpeg's stdin (no intermediate WAV file).
+The encoder settings come from a named profile (ENCODER_PROFILES): 'fast' trades
+size/quality for encoding speed, 'balanced' matches the former fixed settings
+(192 kbit/s MP3, the encoders' own defaults otherwise), 'archival' favours quality.
+
+One processed buffer can be exported to several formats at once. The buffer is
+converted to PCM once, and every format gets its own ffmpeg process that reads
+that same bytes object from its stdin (fed from one thread per encoder, through
+memoryview slices, so nothing is copied or re-serialized per format). The
+encoders run concurrently; the export takes about as long as the slowest one.
+"""
+import os
+import time
+import logging
+import tempfile
+import threading
+import subprocess
+from pydub import AudioSegment
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# ffmpeg container and codec per output format.
+ENCODER_ARGS = {
+    'wav': ['-f', 'wav'],
+    'mp3': ['-f', 'mp3', '-acodec', 'libmp3lame'],
+    'm4a': ['-f', 'ipod', '-acodec', 'aac'],
+    'ogg': ['-f', 'ogg', '-acodec', 'libvorbis'],
+    'flac': ['-f', 'flac', '-acodec', 'flac'],
+}
+# Codec settings per profile and format (ffmpeg picks the thread count unless ENCODER_THREADS is set).
+# MP3: -compression_level is LAME's algorithm quality (0 slowest/best .. 9 fastest), -q:a its VBR quality.
+# AAC: -aac_coder 'fast' skips twoloop's bit allocation search. Vorbis: -q:a is the VBR quality (0..10).
+# FLAC: -compression_level 0 (fastest) .. 12 (smallest).
+ENCODER_PROFILES = {
+    'fast': {
+        'mp3': ['-b:a', '128k', '-compression_level', '9'],
+        'm4a': ['-b:a', '128k', '-aac_coder', 'fast'],
+        'ogg': ['-q:a', '2'],
+        'flac': ['-compression_level', '0'],
+    },
+    'balanced': {
+        # As before the profiles: 192 kbit/s MP3, the encoders' defaults (spelled out) otherwise.
+        'mp3': ['-b:a', '192k'],
+        'm4a': ['-aac_coder', 'twoloop'],
+        'ogg': ['-q:a', '3'],
+        'flac': ['-compression_level', '5'],
+    },
+    'archival': {
+        'mp3': ['-q:a', '0', '-compression_level', '0'],
+        'm4a': ['-b:a', '320k'],
+        'ogg': ['-q:a', '8'],
+        'flac': ['-compression_level', '8'],
+    },
+}
+DEFAULT_PROFILE = 'balanced'
+WAV_CODECS = {1: 'pcm_u8', 2: 'pcm_s16le', 4: 'pcm_s32le'}
+# ffmpeg raw input format per PCM sample width (see dsp_engine.array_to_pcm_bytes).
+PCM_INPUT_FORMATS = {1: 's8', 2: 's16le', 4: 's32le'}
+FEED_CHUNK_BYTES = 1024 * 1024
+
+
+def resolve_profile(profile):
+    """Profile name to use for profile (unknown or empty names fall back to DEFAULT_PROFILE)."""
+    profile = (profile or '').lower()
+    return profile if profile in ENCODER_PROFILES else DEFAULT_PROFILE
+
+def encoder_args(output_format, sample_width, profile=None, threads=None):
+    """
+    ffmpeg output arguments for a format under an encoder profile.
+    threads, if not None, sets ffmpeg's thread count (else ffmpeg decides).
+    """
+    output_format = output_format.lower()
+    if output_format not in ENCODER_ARGS:
+        output_format = 'wav'
+    settings = ENCODER_PROFILES[resolve_profile(profile)]
+    args = list(ENCODER_ARGS[output_format])
+    if output_format == 'wav':
+        args += ['-acodec', WAV_CODECS.get(sample_width, 'pcm_s32le')]
+    else:
+        args += settings[output_format]
+    if threads is not None:
+        args += ['-threads', str(threads)]
+    return args
+
+def as_outputs(output_path, output_format):
+    """
+    Normalizes the (output_path, output_format) arguments of the processing functions,
+    each a single value or equal-length lists, into [(output_format, output_path)].
+    """
+    if isinstance(output_format, (list, tuple)):
+        if not isinstance(output_path, (list, tuple)) or len(output_path) != len(output_format):
+            raise ValueError("output_path must list one path per output format.")
+        return list(zip(output_format, output_path))
+    return [(output_format, output_path)]
+
+def spawn_ffmpeg(args, **popen_kwargs):
+    """
+    Starts ffmpeg with its stderr in a temporary file (read with finish_ffmpeg). A stderr
+    pipe that is only read at the end would block ffmpeg once it fills, while the caller
+    is still blocked on stdin/stdout.
+    """
+    stderr_log = tempfile.TemporaryFile()
+    try:
+        process = subprocess.Popen([AudioSegment.converter] + args, stderr=stderr_log, **popen_kwargs)
+    except Exception:
+        stderr_log.close()
+        raise
+    process.stderr_log = stderr_log
+    return process
+
+def finish_ffmpeg(process):
+    """Waits for a process from spawn_ffmpeg to exit. Returns its stderr output."""
+    process.wait()
+    with process.stderr_log as stderr_log:
+        stderr_log.seek(0)
+        return stderr_log.read().decode(errors='replace')
+
+def open_encoder(output_format, output_path, input_args, sample_width, profile=None, threads=None):
+    """Starts ffmpeg encoding raw audio (described by input_args) from its stdin into output_path."""
+    return spawn_ffmpeg(
+        ['-v', 'error', '-y'] + input_args + ['-i', '-'] + encoder_args(output_format, sample_width, profile, threads) + [output_path],
+        stdin=subprocess.PIPE
+    )
+
+
+def _feed(encoder, data, result):
+    """Writes data to the encoder's stdin, closes it and waits for the encoder to exit."""
+    started = time.perf_counter()
+    try:
+        for offset in range(0, len(data), FEED_CHUNK_BYTES):
+            encoder.stdin.write(data[offset:offset + FEED_CHUNK_BYTES])
+    except BrokenPipeError:
+        pass # The encoder exited; its error is reported below.
+    finally:
+        try:
+            encoder.stdin.close()
+        except BrokenPipeError:
+            pass
+        result['stderr'] = finish_ffmpeg(encoder)
+        result['seconds'] = time.perf_counter() - started
+
+def export_pcm(pcm, frame_rate, channels, sample_width, outputs, profile=None, threads=None):
+    """
+    Encodes interleaved PCM bytes to every (output_format, output_path) in outputs,
+    with one concurrent ffmpeg process per output, using the given encoder profile.
+    Raises RuntimeError naming the formats whose encoder failed.
+    """
+    data = memoryview(pcm)
+    input_args = ['-f', PCM_INPUT_FORMATS[sample_width], '-ar', str(frame_rate), '-ac', str(channels)]
+    jobs = []
+    for output_format, output_path in outputs:
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        encoder = open_encoder(output_format, output_path, input_args, sample_width, profile, threads)
+        result = {}
+        thread = threading.Thread(target=_feed, args=(encoder, data, result), name=f"encode-{output_format}", daemon=True)
+        thread.start()
+        jobs.append((output_format, encoder, thread, result))
+
+    errors = []
+    for output_format, encoder, thread, result in jobs:
+        thread.join()
+        metrics.observe('export', result.get('seconds', 0.0), format=output_format.lower())
+        if encoder.returncode != 0:
+            errors.append(f"{output_format}: {result.get('stderr', '').strip()}")
+    if errors:
+        raise RuntimeError(f"ffmpeg encoding failed ({'; '.join(errors)})")
+    if len(outputs) > 1:
+        logger.info(f"Encoded {len(outputs)} formats concurrently: {', '.join(fmt for fmt, _ in outputs)}")
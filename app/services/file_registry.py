@@ -0,0 +1,252 @@
+"""
+Index of the files in the blob store, so cleanup never has to list the folders.
+
+Every upload and every processed output is registered when it is stored, with an
+expiry (CLEANUP_MAX_FILE_AGE_DAYS after it was stored or last served from the
+result cache) and its size. cleanup_old_files_task then runs every few minutes
+and deletes what has expired, in batches of CLEANUP_BATCH_SIZE, so its cost is
+proportional to the number of expired files instead of the number of files. It
+also keeps the processed results within FILE_STORE_MAX_BYTES, least recently
+used first (uploads are transient: they neither count towards the quota nor are
+evicted for size).
+
+Index layout in Redis:
+    <prefix>expiry   zset  blob key -> expiry timestamp
+    <prefix>lru      zset  processed blob key -> last use timestamp
+    <prefix>sizes    hash  blob key -> size
+    <prefix>digests  hash  processed blob key -> SHA-256 of the content (download ETags)
+    <prefix>processed_bytes  int  total size of the registered processed results
+
+Files written while Redis was unavailable (or before the registry existed) are
+picked up by reconcile(), a full listing run by its own, infrequent beat entry.
+Expired results still owned by the result cache are left to its eviction
+(result_cache.evict); a result evicted for size here takes its cache entry with it.
+"""
+import time
+import logging
+import redis
+from flask import current_app
+
+from .blob_store import get_blob_store, UPLOADS, PROCESSED
+from . import result_cache
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_CHUNK = 1000
+
+_clients = {}
+
+
+def _client():
+    url = current_app.config['FILE_REGISTRY_REDIS_URL']
+    if url not in _clients:
+        _clients[url] = redis.Redis.from_url(url, decode_responses=True)
+    return _clients[url]
+
+def _prefix():
+    return current_app.config.get('FILE_REGISTRY_KEY_PREFIX', 'ams:files:')
+
+def _is_processed(key):
+    return key.startswith(f"{PROCESSED}/")
+
+def is_enabled():
+    return bool(current_app.config.get('FILE_REGISTRY_ENABLED'))
+
+def max_age_seconds():
+    return int(current_app.config.get('CLEANUP_MAX_FILE_AGE_DAYS', 7)) * 24 * 60 * 60
+
+
+# --- Registration ---
+
+def register(key, size, stored_at=None, digest=None):
+    """
+    Records a stored blob (expiring max_age_seconds() after stored_at, default now),
+    with the SHA-256 hex digest of its content if known.
+    Never raises: an unregistered file is still found by reconcile().
+    """
+    if not is_enabled():
+        return
+    now = time.time()
+    stored_at = now if stored_at is None else stored_at
+    try:
+        r = _client()
+        prefix = _prefix()
+        previous = int(r.hget(f"{prefix}sizes", key) or 0)
+        pipe = r.pipeline()
+        pipe.zadd(f"{prefix}expiry", {key: stored_at + max_age_seconds()})
+        pipe.hset(f"{prefix}sizes", key, size)
+        if digest:
+            pipe.hset(f"{prefix}digests", key, digest)
+        if _is_processed(key):
+            pipe.zadd(f"{prefix}lru", {key: stored_at})
+            pipe.incrby(f"{prefix}processed_bytes", size - previous)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"File registry: could not register '{key}': {e}")
+
+def forget(*keys):
+    """Drops deleted blobs from the index."""
+    if not is_enabled() or not keys:
+        return
+    try:
+        r = _client()
+        prefix = _prefix()
+        sizes = r.hmget(f"{prefix}sizes", keys)
+        pipe = r.pipeline()
+        pipe.zrem(f"{prefix}expiry", *keys)
+        pipe.zrem(f"{prefix}lru", *keys)
+        pipe.hdel(f"{prefix}sizes", *keys)
+        pipe.hdel(f"{prefix}digests", *keys)
+        freed = sum(int(size) for key, size in zip(keys, sizes) if size and _is_processed(key))
+        if freed:
+            pipe.decrby(f"{prefix}processed_bytes", freed)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"File registry: could not forget {', '.join(keys)}: {e}")
+
+def touch(key, extend=False):
+    """Marks a result as used (size eviction is least recently used first); extend also restarts its expiry."""
+    if not is_enabled():
+        return
+    now = time.time()
+    try:
+        r = _client()
+        prefix = _prefix()
+        pipe = r.pipeline()
+        # xx: a file that is not indexed stays for reconcile() to register with its real size.
+        pipe.zadd(f"{prefix}lru", {key: now}, xx=True)
+        if extend:
+            pipe.zadd(f"{prefix}expiry", {key: now + max_age_seconds()}, xx=True)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"File registry: could not touch '{key}': {e}")
+
+def content_digest(key):
+    """SHA-256 hex digest recorded for a blob, or None."""
+    if not is_enabled():
+        return None
+    try:
+        return _client().hget(f"{_prefix()}digests", key)
+    except Exception as e:
+        logger.warning(f"File registry: could not read the digest of '{key}': {e}")
+        return None
+
+def processed_bytes():
+    """Total size of the registered processed results (what FILE_STORE_MAX_BYTES limits)."""
+    return int(_client().get(f"{_prefix()}processed_bytes") or 0)
+
+
+# --- Cleanup ---
+
+def _cache_owner(key):
+    if not _is_processed(key) or not result_cache.is_enabled():
+        return None
+    return result_cache.owner(key.split('/', 1)[1])
+
+def _delete(store, key):
+    try:
+        store.delete(key)
+    except Exception as e:
+        logger.error(f"Cleanup: Error deleting file '{key}': {e}")
+        return False
+    forget(key)
+    logger.info(f"Cleanup: Deleted file '{key}'")
+    return True
+
+def delete_expired(batch_size, max_deletes, now=None):
+    """
+    Deletes blobs whose expiry has passed, batch_size index entries at a time, at most
+    max_deletes per call (the rest is left for the next run). Results still owned by the
+    result cache are rescheduled instead. Returns the number of files deleted.
+    """
+    store = get_blob_store(current_app.config)
+    r = _client()
+    prefix = _prefix()
+    now = time.time() if now is None else now
+    deleted = 0
+    while deleted < max_deletes:
+        keys = r.zrangebyscore(f"{prefix}expiry", '-inf', now, start=0, num=min(batch_size, max_deletes - deleted))
+        if not keys:
+            break
+        for key in keys:
+            if _cache_owner(key):
+                r.zadd(f"{prefix}expiry", {key: now + max_age_seconds()})
+            elif _delete(store, key):
+                deleted += 1
+            else:
+                # Leave it for the next run instead of retrying it in this one.
+                r.zadd(f"{prefix}expiry", {key: now + 60 * 60})
+    return deleted
+
+def enforce_quota(max_bytes, batch_size):
+    """
+    Deletes the least recently used processed results until they fit in max_bytes
+    (0 disables the quota). Returns the number of files deleted.
+    """
+    if not max_bytes:
+        return 0
+    store = get_blob_store(current_app.config)
+    r = _client()
+    prefix = _prefix()
+    deleted = 0
+    while processed_bytes() > max_bytes:
+        keys = r.zrange(f"{prefix}lru", 0, batch_size - 1)
+        if not keys:
+            break
+        for key in keys:
+            if processed_bytes() <= max_bytes:
+                break
+            cache_key = _cache_owner(key)
+            if cache_key:
+                # The entry's other outputs (other formats) are no longer owned and follow on their own.
+                result_cache.remove(cache_key, delete_file=False)
+            if not _delete(store, key):
+                r.zrem(f"{prefix}lru", key) # Not evictable now; stays indexed for its expiry.
+                continue
+            deleted += 1
+    if deleted:
+        logger.info(f"Cleanup: Evicted {deleted} results to stay within {max_bytes} bytes.")
+    return deleted
+
+def reconcile():
+    """
+    Registers blobs that are missing from the index (expiring relative to their mtime),
+    drops index entries whose blob is gone and recounts processed_bytes from the index.
+    Lists the whole store: run it rarely. Returns (registered, dropped).
+    """
+    store = get_blob_store(current_app.config)
+    r = _client()
+    prefix = _prefix()
+    registered = 0
+    seen = set()
+    for namespace in (UPLOADS, PROCESSED):
+        blobs = []
+        for blob in store.list(namespace):
+            seen.add(blob.key)
+            blobs.append(blob)
+            if len(blobs) >= RECONCILE_CHUNK:
+                registered += _register_missing(r, prefix, blobs)
+                blobs = []
+        registered += _register_missing(r, prefix, blobs)
+
+    # Keys registered after the listing started are kept (their blob may not have been listed).
+    started = time.time() - 60
+    stale = [key for key, score in r.zscan_iter(f"{prefix}expiry")
+             if key not in seen and score - max_age_seconds() < started]
+    for i in range(0, len(stale), RECONCILE_CHUNK):
+        forget(*stale[i:i + RECONCILE_CHUNK])
+    # Repairs drift (a failed pipeline, counters from before uploads were left out); a file
+    # registered during the scan is off by its size until the next run.
+    r.set(f"{prefix}processed_bytes", sum(int(size) for key, size in r.hscan_iter(f"{prefix}sizes") if _is_processed(key)))
+    if registered or stale:
+        logger.info(f"File registry: reconciled, {registered} files registered, {len(stale)} stale entries dropped.")
+    return registered, len(stale)
+
+def _register_missing(r, prefix, blobs):
+    if not blobs:
+        return 0
+    known = r.hmget(f"{prefix}sizes", [blob.key for blob in blobs])
+    missing = [blob for blob, size in zip(blobs, known) if size is None]
+    for blob in missing:
+        register(blob.key, blob.size, stored_at=blob.mtime)
+    return len(missing)
@@ -0,0 +1,81 @@
+"""
+Routing of effects tasks to Celery queues by estimated cost.
+
+The cost of a job is estimated before dispatch from the input's header metadata
+(duration, sample rate, channels; probed by file_validator.check_audio_metadata,
+else estimated from the file size) and the compiled effects chain: decode + every plan step +
+every export format, each with a per-audio-second cost measured on stereo 44.1 kHz
+(see benchmarks/bench_suite.py), scaled by the input's channels and sample rate.
+
+Jobs estimated at up to TASK_ROUTING_SHORT_MAX_COST_SECONDS go to TASK_QUEUE_SHORT,
+everything else (and every batch item) to TASK_QUEUE_LONG. Each queue is consumed
+by its own worker pool (see celery_worker.py), so short interactive jobs never
+wait behind bulk work.
+"""
+import os
+import logging
+from flask import current_app
+
+from . import chain_planner
+
+logger = logging.getLogger(__name__)
+
+# Estimated CPU seconds per second of stereo 44.1 kHz audio.
+DECODE_COST = 0.002
+EFFECT_COSTS = {
+    'high_pass_filter': 0.002,
+    'low_pass_filter': 0.002,
+    'echo': 0.002,
+    'reverb': 0.004,
+    'speed_pitch': 0.01,
+}
+DEFAULT_EFFECT_COST = 0.005
+GAIN_COST = 0.0005
+EXPORT_COSTS = {'wav': 0.001, 'mp3': 0.02, 'm4a': 0.03, 'ogg': 0.03, 'flac': 0.005}
+
+# Used when the header was not probed: duration estimated from the file size.
+ASSUMED_BYTES_PER_SECOND = {'wav': 176400, 'flac': 88200, 'mp3': 24000, 'm4a': 24000, 'ogg': 24000}
+DEFAULT_BYTES_PER_SECOND = 24000
+
+
+def _size_estimate(input_path):
+    ext = input_path.rsplit('.', 1)[-1].lower()
+    duration = os.path.getsize(input_path) / float(ASSUMED_BYTES_PER_SECOND.get(ext, DEFAULT_BYTES_PER_SECOND))
+    return {'duration': duration, 'channels': 2, 'sample_rate': 44100}
+
+def estimate_cost(audio_info, effects_chain, output_format):
+    """Estimated processing time in seconds for audio_info ({duration, channels, sample_rate})."""
+    formats = [output_format] if isinstance(output_format, str) else output_format
+    plan = chain_planner.compile_chain(effects_chain or [])
+    per_second = DECODE_COST
+    for step in plan.steps:
+        if step.kind == 'gain':
+            per_second += GAIN_COST
+        else:
+            per_second += sum(EFFECT_COSTS.get(name, DEFAULT_EFFECT_COST) for name in step.names)
+    per_second += sum(EXPORT_COSTS.get(fmt.lower(), EXPORT_COSTS['mp3']) for fmt in formats)
+    scale = audio_info['channels'] / 2.0 * audio_info['sample_rate'] / 44100.0
+    return audio_info['duration'] * scale * per_second
+
+def select_queue(input_path, effects_chain, output_format, audio_info=None):
+    """
+    Queue for an effects task on the input at input_path (None if routing is disabled).
+    audio_info is the probed header metadata, if any.
+    """
+    config = current_app.config
+    if not config.get('TASK_ROUTING_ENABLED'):
+        return None
+    try:
+        info = audio_info if audio_info and audio_info.get('duration') else _size_estimate(input_path)
+        cost = estimate_cost(info, effects_chain, output_format)
+    except Exception as e:
+        logger.warning(f"Could not estimate the cost of {input_path}, using the long queue: {e}")
+        return config['TASK_QUEUE_LONG']
+    queue = config['TASK_QUEUE_SHORT'] if cost <= config['TASK_ROUTING_SHORT_MAX_COST_SECONDS'] else config['TASK_QUEUE_LONG']
+    logger.info(f"Routing {os.path.basename(input_path)} ({info['duration']:.1f}s, estimated {cost:.2f}s of work) to '{queue}'")
+    return queue
+
+def bulk_queue():
+    """Queue for batch items (None if routing is disabled)."""
+    config = current_app.config
+    return config['TASK_QUEUE_LONG'] if config.get('TASK_ROUTING_ENABLED') else None
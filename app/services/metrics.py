@@ -0,0 +1,179 @@
+"""
+Prometheus metrics for the web app and the Celery workers.
+
+    ams_decode_seconds{pipeline}          decoding an input (in_memory, streaming)
+    ams_effect_seconds{effect}            running one plan step over a whole file
+    ams_export_seconds{format}            encoding the output
+    ams_task_queue_wait_seconds{task,queue} dispatch to start of a task
+    ams_task_peak_rss_bytes{task}         peak resident memory of the worker process during a task
+    ams_cache_requests_total{cache,result} result/stage cache hits and misses
+    ams_rejected_uploads_total{reason}    uploads refused by validation
+    ams_warmup_seconds{step}              process warm-up steps at startup (see warmup.py)
+
+The Flask app serves them on /metrics; a worker serves them on METRICS_WORKER_PORT
+from its main process. Both run several processes (gunicorn workers, Celery
+prefork children), so with METRICS_MULTIPROC_DIR set every process writes its
+samples to that folder and the endpoint aggregates them (prometheus_client's
+multiprocess mode). Give the web app and the workers separate folders, and empty
+a folder before its service starts.
+
+prometheus_client is optional: without it (or with METRICS_ENABLED off) every
+function here is a no-op.
+"""
+import os
+import time
+import resource
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+RSS_BUCKETS = tuple(2 ** k * 1024 * 1024 for k in range(5, 15)) # 32 MB .. 16 GB
+
+_metrics = {}
+_state = {'multiprocess': False}
+
+
+def init_app(app):
+    """Defines the metrics and hooks the Celery signals. Safe to call more than once."""
+    config = app.config
+    if _metrics or not config.get('METRICS_ENABLED', True):
+        return
+    multiproc_dir = config.get('METRICS_MULTIPROC_DIR')
+    if multiproc_dir:
+        # Must be set before prometheus_client is imported (it picks its value class at import).
+        os.makedirs(multiproc_dir, exist_ok=True)
+        os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', multiproc_dir)
+    try:
+        from prometheus_client import Counter, Histogram
+    except ImportError:
+        logger.info("prometheus_client is not installed; metrics are disabled.")
+        return
+    _state['multiprocess'] = 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+    _metrics.update(
+        decode=Histogram('ams_decode_seconds', 'Time to decode an input file.', ['pipeline'], buckets=DURATION_BUCKETS),
+        effect=Histogram('ams_effect_seconds', 'Time to run one plan step (effect) over a file.', ['effect'], buckets=DURATION_BUCKETS),
+        export=Histogram('ams_export_seconds', 'Time to encode the output file.', ['format'], buckets=DURATION_BUCKETS),
+        queue_wait=Histogram('ams_task_queue_wait_seconds', 'Time from task dispatch to task start.', ['task', 'queue'], buckets=DURATION_BUCKETS),
+        peak_rss=Histogram('ams_task_peak_rss_bytes', 'Peak resident memory of the worker process during a task.', ['task'], buckets=RSS_BUCKETS),
+        cache=Counter('ams_cache_requests', 'Cache lookups by cache and result.', ['cache', 'result']),
+        rejected=Counter('ams_rejected_uploads', 'Uploads rejected by validation, by reason.', ['reason']),
+        warmup=Histogram('ams_warmup_seconds', 'Time of each process warm-up step.', ['step'], buckets=DURATION_BUCKETS),
+        preview=Histogram('ams_preview_seconds', 'Time to render a synchronous preview clip.', ['format'], buckets=DURATION_BUCKETS),
+    )
+    _connect_celery_signals(config)
+
+def is_enabled():
+    return bool(_metrics)
+
+
+# --- Recording ---
+
+@contextmanager
+def _timer(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _metrics:
+            _metrics[name].labels(**labels).observe(time.perf_counter() - start)
+
+def time_decode(pipeline='in_memory'):
+    return _timer('decode', pipeline=pipeline)
+
+def time_effect(effect):
+    return _timer('effect', effect=effect)
+
+def time_export(output_format):
+    return _timer('export', format=output_format.lower())
+
+def observe(name, seconds, **labels):
+    """Records a duration measured by the caller (e.g. accumulated over the blocks of a stream)."""
+    if _metrics:
+        _metrics[name].labels(**labels).observe(seconds)
+
+def count_cache(cache, hit):
+    if _metrics:
+        _metrics['cache'].labels(cache=cache, result='hit' if hit else 'miss').inc()
+
+def count_rejected_upload(reason):
+    if _metrics:
+        _metrics['rejected'].labels(reason=reason).inc()
+
+
+# --- Exposition ---
+
+def _registry():
+    from prometheus_client import CollectorRegistry, REGISTRY
+    if not _state['multiprocess']:
+        return REGISTRY
+    from prometheus_client import multiprocess
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+def render():
+    """Returns (body, content_type) of the metrics page, aggregated over all processes."""
+    from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+    return generate_latest(_registry()), CONTENT_TYPE_LATEST
+
+def start_http_server(port):
+    from prometheus_client import start_http_server as serve
+    try:
+        serve(port, registry=_registry())
+        logger.info(f"Serving worker metrics on port {port}.")
+    except OSError as e:
+        logger.warning(f"Could not serve worker metrics on port {port}: {e}")
+
+
+# --- Celery: queue wait and peak memory per task ---
+
+def reset_peak_rss():
+    """Resets the kernel's peak RSS counter of this process (Linux); False if not possible."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss_bytes():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    # Lifetime peak of the process (kilobytes on Linux).
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _connect_celery_signals(config):
+    from celery import signals
+
+    def add_dispatch_time(headers=None, **kwargs):
+        if headers is not None:
+            headers.setdefault('dispatched_at', time.time())
+
+    def task_started(task=None, **kwargs):
+        dispatched_at = task.request.get('dispatched_at')
+        if dispatched_at:
+            queue = (task.request.delivery_info or {}).get('routing_key') or 'default'
+            observe('queue_wait', max(0.0, time.time() - float(dispatched_at)), task=task.name, queue=queue)
+        reset_peak_rss()
+
+    def task_finished(task=None, **kwargs):
+        observe('peak_rss', peak_rss_bytes(), task=task.name)
+
+    def worker_started(**kwargs):
+        port = config.get('METRICS_WORKER_PORT')
+        if port:
+            start_http_server(port)
+
+    # weak=False: the handlers are closures that would otherwise be garbage collected.
+    signals.before_task_publish.connect(add_dispatch_time, weak=False)
+    signals.task_prerun.connect(task_started, weak=False)
+    signals.task_postrun.connect(task_finished, weak=False)
+    signals.worker_init.connect(worker_started, weak=False)
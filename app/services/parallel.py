@@ -0,0 +1,140 @@
+"""
+Intra-file parallelism for the block stages.
+
+A buffer is split into contiguous segments that are processed concurrently, each
+by its own fresh set of stages. Before its segment, each set of stages runs over
+the input frames just before the segment start (the warm-up). The warm-up is long
+enough for every stage's memory to fill: echo/reverb delay lines, the
+convolution tail, and the IIR filter transients. So each segment's output
+matches the serial run up to float rounding and the segments join without seams.
+
+Segments run in threads: sosfilt, the FFTs and the NumPy ufuncs release the GIL,
+so the buffer is shared and processed in place instead of being pickled to
+worker processes.
+"""
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from . import dsp_engine
+
+logger = logging.getLogger(__name__)
+
+# A segment is at least this long and at least SEGMENT_WARMUP_RATIO times the
+# warm-up, so the warm-up overhead stays bounded.
+MIN_SEGMENT_FRAMES = 4 * dsp_engine.BLOCK_FRAMES
+SEGMENT_WARMUP_RATIO = 4
+
+_executors = {}
+_executors_lock = threading.Lock()
+_worker = {'concurrency': None} # Processes of the Celery worker this process belongs to (set on worker_init)
+
+
+def init_app(app):
+    """Records the Celery worker's concurrency when a worker starts (prefork children inherit it)."""
+    from celery import signals
+    signals.worker_init.connect(_worker_started, weak=False)
+
+def _worker_started(sender=None, **kwargs):
+    _worker['concurrency'] = getattr(sender, 'concurrency', None)
+
+def resolve_workers(workers):
+    """
+    Configured thread count per job. 0 or None shares the host's CPUs among the worker's
+    processes: cpu_count // concurrency, at least 1. With Celery's default concurrency (one
+    process per CPU) that is 1, so a busy host never runs more DSP threads than cores.
+    """
+    if workers:
+        return max(1, int(workers))
+    cpus = os.cpu_count() or 1
+    return max(1, cpus // (_worker['concurrency'] or cpus))
+
+def get_executor(workers):
+    """Process-wide thread pool of the given size."""
+    with _executors_lock:
+        if workers not in _executors:
+            _executors[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dsp-segment')
+        return _executors[workers]
+
+def warmup_frames(stages):
+    """Input frames a fresh chain of stages needs before its output is exact (memories add up in a cascade)."""
+    return sum(stage.memory_frames() for stage in stages)
+
+def segment_frames(warmup, min_frames=MIN_SEGMENT_FRAMES):
+    return max(min_frames, SEGMENT_WARMUP_RATIO * warmup)
+
+def input_tail(history, samples, frames):
+    """The last `frames` input frames of history followed by samples (copied), for the next call's history."""
+    if frames <= 0:
+        return None
+    if history is None or samples.shape[1] >= frames:
+        return samples[:, -frames:].copy()
+    return np.concatenate((history, samples), axis=1)[:, -frames:].copy()
+
+def _preceding_input(samples, history, start, frames):
+    """Copy of up to `frames` input frames right before samples[:, start], reaching back into history."""
+    own = samples[:, max(0, start - frames):start]
+    missing = frames - own.shape[1]
+    if missing > 0 and history is not None and history.shape[1]:
+        return np.concatenate((history[:, -missing:], own), axis=1)
+    return own.copy()
+
+def _run_blocks(stages, samples, on_block=None):
+    for start in range(0, samples.shape[1], dsp_engine.BLOCK_FRAMES):
+        block = samples[:, start:start + dsp_engine.BLOCK_FRAMES]
+        for stage in stages:
+            stage.process(block)
+        if on_block:
+            on_block(block.shape[1])
+
+def _run_segment(stages, warm_input, segment, on_block=None):
+    if warm_input is not None and warm_input.shape[1]:
+        _run_blocks(stages, warm_input)
+    _run_blocks(stages, segment, on_block)
+
+def process_parallel(build_stages, samples, workers, history=None, progress_func=None):
+    """
+    Runs the stages returned by build_stages() over samples, in place, split into
+    up to `workers` segments. build_stages must return a fresh stage list per call.
+    history holds the input frames right before samples (for consecutive windows of
+    a stream). None means samples is the start of the signal, so the first segment
+    starts cold exactly like a serial run.
+    progress_func, if given, is called with the processed fraction (from the segment threads).
+    """
+    stages = build_stages()
+    if not stages or samples.shape[1] == 0:
+        return samples
+    warmup = warmup_frames(stages)
+    frame_count = samples.shape[1]
+    count = max(1, min(workers, frame_count // segment_frames(warmup)))
+    bounds = [(frame_count * k // count, frame_count * (k + 1) // count) for k in range(count)]
+
+    on_block = None
+    if progress_func:
+        done = [0]
+        done_lock = threading.Lock()
+
+        def on_block(frames):
+            with done_lock:
+                done[0] += frames
+                fraction = done[0] / float(frame_count)
+            progress_func(fraction)
+
+    # Warm-up inputs are copied before any segment overwrites its part of the buffer.
+    warm_inputs = [_preceding_input(samples, history, start, warmup) for start, _ in bounds]
+    if count == 1:
+        _run_segment(stages, warm_inputs[0], samples, on_block)
+        return samples
+
+    logger.info(f"Processing {frame_count} frames in {count} parallel segments (warm-up {warmup} frames each).")
+    executor = get_executor(workers)
+    stage_sets = [stages] + [build_stages() for _ in range(count - 1)]
+    futures = [
+        executor.submit(_run_segment, stage_set, warm_input, samples[:, start:end], on_block)
+        for stage_set, warm_input, (start, end) in zip(stage_sets, warm_inputs, bounds)
+    ]
+    for future in futures:
+        future.result()
+    return samples
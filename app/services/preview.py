@@ -0,0 +1,170 @@
+"""
+Low-latency previews: the effects chain applied to a short window of an input,
+synchronously in the request (no queue).
+
+Only the window is decoded: ffmpeg seeks to it before decoding and resamples to
+the preview sample rate. The window is preceded by a pre-roll as long as the
+stages' memory (echo/reverb delay lines and tails, filter transients;
+parallel.warmup_frames), so it matches the same slice of the full render; the
+pre-roll is cut off after processing. Only a chain whose memory exceeds
+PREVIEW_MAX_PREROLL_SECONDS, a safety bound, gets an approximate preview. The
+result is encoded with the 'fast' encoder profile.
+
+The effects are CPU-bound. Under gevent workers (gunicorn.conf.py) run_blocking
+runs them in the hub's thread pool, so the worker's other connections are not
+stalled while they run. Decoding and encoding stay in the request's greenlet:
+they wait on ffmpeg subprocesses, which gevent already makes cooperative (and
+which cannot be started from a pool thread).
+
+Preview sources are kept in PREVIEW_FOLDER for PREVIEW_SOURCE_TTL_SECONDS after
+their last use, so moving a slider does not mean uploading the file again.
+"""
+import os
+import re
+import sys
+import time
+import tempfile
+import logging
+import subprocess
+import numpy as np
+from flask import current_app
+from pydub import AudioSegment
+
+from . import dsp_engine, chain_planner, parallel, encoders, metrics
+
+logger = logging.getLogger(__name__)
+
+# Minimum pre-roll, for the effects whose memory is not reported by a stage (resampler, phase vocoder).
+MIN_PREROLL_SECONDS = 0.1
+# Decoded past the window and cut off: ffmpeg's resampler flushes its last frames against silence.
+POSTROLL_SECONDS = 0.05
+SOURCE_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+MIMETYPES = {'mp3': 'audio/mpeg', 'ogg': 'audio/ogg', 'wav': 'audio/wav'}
+
+
+# --- Sources ---
+
+def _folder():
+    folder = current_app.config['PREVIEW_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+def save_source(path, source_id, ext):
+    """Moves an uploaded file into the preview folder (and drops expired sources). Returns its new path."""
+    sweep_sources()
+    source_path = os.path.join(_folder(), f"{source_id}.{ext}")
+    os.replace(path, source_path)
+    return source_path
+
+def source_path(source_id):
+    """Path of a preview source (its last use is refreshed), or None if unknown or expired."""
+    if not SOURCE_ID_PATTERN.match(source_id or ''):
+        return None
+    folder = _folder()
+    for ext in current_app.config['ALLOWED_EXTENSIONS']:
+        path = os.path.join(folder, f"{source_id}.{ext}")
+        if os.path.exists(path):
+            os.utime(path)
+            return path
+    return None
+
+def sweep_sources():
+    max_age = current_app.config['PREVIEW_SOURCE_TTL_SECONDS']
+    cutoff = time.time() - max_age
+    for entry in os.scandir(_folder()):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError as e:
+            logger.warning(f"Could not remove expired preview source {entry.path}: {e}")
+
+
+# --- Rendering ---
+
+def _gevent_patched():
+    if 'gevent' not in sys.modules:
+        return False
+    from gevent import monkey
+    return monkey.is_module_patched('socket')
+
+def run_blocking(func, *args, **kwargs):
+    """
+    Calls func(*args, **kwargs) in the app context. Under gevent it runs in a
+    thread of the hub's pool while this greenlet waits; otherwise it runs inline.
+    """
+    if not _gevent_patched():
+        return func(*args, **kwargs)
+    import gevent
+    app = current_app._get_current_object()
+    def call():
+        with app.app_context():
+            return func(*args, **kwargs)
+    return gevent.get_hub().threadpool.apply(call)
+
+def preroll_frames(plan, frame_rate, channels, max_seconds=None):
+    """Input frames to decode before the window so that the stages have warmed up (at most max_seconds, if given)."""
+    stage_steps = []
+    for step in plan.steps:
+        if step.kind == 'whole_buffer':
+            break
+        stage_steps.append(step)
+    frames = parallel.warmup_frames(chain_planner.build_stages(stage_steps, frame_rate, channels))
+    frames += int(MIN_PREROLL_SECONDS * frame_rate)
+    if max_seconds and frames > max_seconds * frame_rate:
+        logger.warning(f"Preview pre-roll of {frames / float(frame_rate):.1f}s capped at {max_seconds:g}s: "
+                       f"the preview will not exactly match the full render.")
+        frames = int(max_seconds * frame_rate)
+    return frames
+
+def _apply_plan(plan, samples, frame_rate, preroll_s, duration_s, input_frames):
+    """Runs the plan, keeps the window (cuts the pre-roll and post-roll off) and converts to 16-bit PCM bytes."""
+    for step in plan.steps:
+        with metrics.time_effect(step.label):
+            samples = step.run(samples, frame_rate)
+    # Whole-buffer effects change the length (speed); the window scales with it.
+    scale = samples.shape[1] / float(input_frames)
+    skip = int(round(preroll_s * frame_rate * scale))
+    end = skip + int(round(duration_s * frame_rate * scale))
+    samples = np.ascontiguousarray(samples[:, skip:end])
+    return dsp_engine.array_to_pcm_bytes(samples, 2, gain=plan.output_gain)
+
+def decode_window(input_path, start_s, duration_s, frame_rate, channels):
+    """Decodes duration_s seconds from start_s (seeking, not decoding the part before). Returns float32 (channels, frames)."""
+    result = subprocess.run(
+        [AudioSegment.converter, '-v', 'error', '-nostdin', '-ss', f"{start_s:.6f}", '-t', f"{duration_s:.6f}", '-i', input_path,
+         '-f', 'f32le', '-acodec', 'pcm_f32le', '-ac', str(channels), '-ar', str(frame_rate), '-'],
+        capture_output=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg decoding failed: {result.stderr.decode(errors='replace').strip()}")
+    interleaved = np.frombuffer(result.stdout, dtype=np.float32)
+    frame_count = interleaved.size // channels
+    samples = np.empty((channels, frame_count), dtype=np.float32)
+    samples[...] = interleaved[:frame_count * channels].reshape(frame_count, channels).T
+    return samples
+
+def render_preview(input_path, effects_chain, start_s, duration_s, frame_rate, channels, output_format='mp3', max_preroll_s=None):
+    """
+    Applies effects_chain to [start_s, start_s + duration_s) of the input, decoded at
+    frame_rate with the given channel count. Returns the encoded clip as bytes.
+    max_preroll_s bounds the pre-roll (None: the chain's whole memory).
+    """
+    plan = chain_planner.compile_chain(effects_chain or [])
+    preroll = preroll_frames(plan, frame_rate, channels, max_preroll_s)
+    preroll_s = min(start_s, preroll / float(frame_rate))
+
+    with metrics.time_decode('preview'):
+        samples = decode_window(input_path, start_s - preroll_s, preroll_s + duration_s + POSTROLL_SECONDS, frame_rate, channels)
+    input_frames = samples.shape[1]
+    if input_frames == 0:
+        raise ValueError("The preview window is past the end of the file.")
+
+    pcm = run_blocking(_apply_plan, plan, samples, frame_rate, preroll_s, duration_s, input_frames)
+    fd, output_path = tempfile.mkstemp(suffix=f".{output_format}", dir=_folder())
+    os.close(fd)
+    try:
+        encoders.export_pcm(pcm, frame_rate, channels, 2, [(output_format, output_path)], profile='fast')
+        with open(output_path, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(output_path)
@@ -0,0 +1,178 @@
+"""
+Push-based task progress over Redis pub/sub.
+
+The worker publishes every state change of a task on the channel
+<prefix><task_id>, and /events/<task_id> relays those messages to the browser as
+Server-Sent Events. ProgressReporter also throttles the PROGRESS updates written
+to the Celery result backend. Those updates now only serve the /status polling
+fallback and late subscribers.
+
+ProgressReporter also takes the writes off the processing thread: DSP code can
+report as often as it likes (every block), and the Redis round trips happen on
+a background thread at a bounded rate.
+"""
+import json
+import time
+import logging
+import threading
+import redis
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'ams:progress:'
+TERMINAL_STATES = ('SUCCESS', 'FAILURE')
+
+_clients = {}
+
+
+def _client(redis_url):
+    if redis_url not in _clients:
+        _clients[redis_url] = redis.Redis.from_url(redis_url, decode_responses=True)
+    return _clients[redis_url]
+
+def channel_name(task_id):
+    return f"{CHANNEL_PREFIX}{task_id}"
+
+
+class ProgressReporter:
+    """
+    task_update_meta_func for a Celery task: records the state in the result
+    backend and publishes it on the task's channel.
+
+    PROGRESS updates are coalesced: the caller (the DSP thread) only replaces the
+    pending update, and a background thread writes it once min_interval seconds
+    have passed since the previous write and progress has moved by at least
+    min_step percent. Updates in between are superseded by newer ones, so a task
+    writes at most 100 / min_step PROGRESS updates, however long its chain.
+    Other states (SUCCESS, FAILURE) are written synchronously and replace any
+    pending update. extra_meta is merged into every update.
+    """
+    def __init__(self, task, redis_url, min_interval=0.5, min_step=2, extra_meta=None):
+        self.task = task
+        # task.request is thread-local: the writer thread needs the id passed explicitly.
+        self.task_id = task.request.id
+        self.redis_url = redis_url
+        self.min_interval = min_interval
+        self.min_step = min_step
+        self.extra_meta = extra_meta or {}
+        self.state = None # Last state written
+        self.sent = 0
+        self.coalesced = 0
+        self._last_sent = None
+        self._last_progress = None
+        self._pending = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._writer = None
+        self._publish_failed = False
+
+    def __call__(self, state, meta):
+        if state != 'PROGRESS':
+            self.close()
+            self._write(state, meta)
+            return
+        with self._condition:
+            if self._closed:
+                return
+            if self._pending is not None:
+                self.coalesced += 1
+            self._pending = meta
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name='progress-reporter', daemon=True)
+                self._writer.start()
+            self._condition.notify()
+
+    def report(self, progress, status):
+        """Shorthand for a PROGRESS update."""
+        self('PROGRESS', {'status': status, 'progress': int(progress)})
+
+    def close(self):
+        """Stops the writer thread; a pending PROGRESS update is dropped."""
+        with self._condition:
+            self._closed = True
+            if self._pending is not None:
+                self.coalesced += 1
+                self._pending = None
+            self._condition.notify()
+        if self._writer is not None and self._writer is not threading.current_thread():
+            self._writer.join()
+
+    def _due_in(self, meta):
+        """Seconds until meta may be written (0: now), or None if it does not advance enough."""
+        if self._last_sent is None:
+            return 0
+        progress = meta.get('progress')
+        if progress is not None and self._last_progress is not None and progress - self._last_progress < self.min_step:
+            return None
+        return max(0.0, self._last_sent + self.min_interval - time.monotonic())
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed:
+                    due = None if self._pending is None else self._due_in(self._pending)
+                    if due == 0:
+                        break
+                    self._condition.wait(due)
+                if self._closed:
+                    return
+                meta, self._pending = self._pending, None
+            try:
+                self._write('PROGRESS', meta)
+            except Exception as e:
+                logger.warning(f"Could not record progress of task {self.task_id}: {e}")
+
+    def _write(self, state, meta):
+        meta = dict(meta, **self.extra_meta)
+        self._last_sent = time.monotonic()
+        self._last_progress = meta.get('progress')
+        self.state = state
+        self.task.update_state(task_id=self.task_id, state=state, meta=meta)
+        self.publish(state, meta)
+        self.sent += 1
+
+    def publish(self, state, meta):
+        if not self.redis_url or self._publish_failed:
+            return
+        try:
+            _client(self.redis_url).publish(channel_name(self.task_id), json.dumps({'state': state, 'meta': meta}))
+        except Exception as e:
+            # Polling still works from the result backend; do not retry on every update.
+            self._publish_failed = True
+            logger.warning(f"Could not publish progress of task {self.task_id}: {e}")
+
+
+class Subscription:
+    """
+    Subscription to one task's channel. Subscribe before reading the current
+    state from the result backend, so no update falls between the two.
+    """
+    def __init__(self, redis_url, task_id):
+        self.pubsub = _client(redis_url).pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(channel_name(task_id))
+
+    def events(self, keepalive_seconds=15, max_seconds=3600):
+        """
+        Yields {'state', 'meta'} dicts as they are published, or None when no message
+        arrived within keepalive_seconds. Stops after a terminal state or max_seconds.
+        """
+        deadline = time.monotonic() + max_seconds
+        while time.monotonic() < deadline:
+            message = self.pubsub.get_message(timeout=keepalive_seconds)
+            if message is None:
+                yield None
+                continue
+            try:
+                event = json.loads(message['data'])
+            except (TypeError, ValueError):
+                logger.warning(f"Ignoring malformed progress message: {message!r}")
+                continue
+            yield event
+            if event.get('state') in TERMINAL_STATES:
+                return
+
+    def close(self):
+        try:
+            self.pubsub.close()
+        except Exception as e:
+            logger.debug(f"Error closing progress subscription: {e}")
@@ -0,0 +1,236 @@
+"""
+Content-addressed cache of processed results.
+
+An entry is keyed on the SHA-256 of the uploaded bytes plus the canonicalized
+effects chain, the output format(s) and the encoder profile, and points at a result in the blob store
+(processed/<result_filename>) produced by an earlier task. Entries are registered when the task is dispatched
+(so identical in-flight requests share one task) and completed by the worker.
+
+Index layout in Redis:
+    <prefix>entry:<key>   hash  task_id, result_filename (comma-separated for several formats), size,
+                                created (when the task was dispatched)
+    <prefix>lru           zset  key -> last use timestamp
+    <prefix>files         hash  result_filename -> key (files the cache owns)
+    <prefix>bytes         int   total size of completed entries
+
+Eviction is by age (last use) and by total size, least recently used first.
+An entry whose task is still reported in flight after RESULT_CACHE_IN_FLIGHT_TIMEOUT_SECONDS
+is treated as lost (worker killed, PENDING result expired) and dropped on lookup.
+cleanup_old_files_task runs the eviction and skips files the cache still owns
+(see file_registry).
+"""
+import time
+import hashlib
+import logging
+import redis
+from flask import current_app
+
+from .chain_planner import canonicalize_chain
+from .blob_store import get_blob_store, processed_key
+from . import metrics, file_registry
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+EVICT_BATCH_SIZE = 100
+
+_clients = {}
+
+
+def _client():
+    url = current_app.config['RESULT_CACHE_REDIS_URL']
+    if url not in _clients:
+        _clients[url] = redis.Redis.from_url(url, decode_responses=True)
+    return _clients[url]
+
+def _prefix():
+    return current_app.config.get('RESULT_CACHE_KEY_PREFIX', 'ams:cache:')
+
+def is_enabled():
+    return bool(current_app.config.get('RESULT_CACHE_ENABLED'))
+
+
+# --- Keys ---
+
+def hash_stream(file_stream):
+    """SHA-256 hex digest of a seekable stream. The stream is rewound afterwards."""
+    digest = hashlib.sha256()
+    file_stream.seek(0)
+    for chunk in iter(lambda: file_stream.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    file_stream.seek(0)
+    return digest.hexdigest()
+
+def make_key(content_digest, effects_chain, output_format, encoder_profile=None):
+    """output_format is one format or a list of formats (one entry covers the whole set, in any order)."""
+    formats = [output_format] if isinstance(output_format, str) else output_format
+    material = f"{content_digest}|{canonicalize_chain(effects_chain)}|{','.join(sorted(fmt.lower() for fmt in formats))}"
+    if encoder_profile:
+        material += f"|{encoder_profile}"
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+# --- Lookup / registration ---
+
+def _filenames(entry):
+    # Secure filenames never contain commas.
+    return entry['result_filename'].split(',')
+
+def lookup(key):
+    """
+    Returns the cache entry for a key, or None on a miss.
+    The returned dict has 'task_id', 'result_filename' (the first output),
+    'result_filenames' (all outputs) and 'ready' (every output stored).
+    A hit refreshes the entry's last-use time and the blob's mtime, so neither the
+    cache eviction nor the age-based cleanup removes a result that is still in use.
+    Entries whose task failed or whose file disappeared are dropped.
+    """
+    r = _client()
+    prefix = _prefix()
+    entry = r.hgetall(f"{prefix}entry:{key}")
+    if not entry:
+        metrics.count_cache('result', hit=False)
+        return None
+
+    store = get_blob_store(current_app.config)
+    filenames = _filenames(entry)
+    output_keys = [processed_key(name) for name in filenames]
+    ready = all(store.exists(output_key) for output_key in output_keys)
+    if not ready:
+        state = current_app.extensions['celery'].AsyncResult(entry['task_id']).state
+        age = time.time() - float(entry.get('created') or 0)
+        if state not in ('PENDING', 'STARTED', 'PROGRESS', 'RETRY'):
+            logger.info(f"Result cache: dropping stale entry {key} (task state {state}, file missing).")
+            remove(key)
+            metrics.count_cache('result', hit=False)
+            return None
+        if age > current_app.config['RESULT_CACHE_IN_FLIGHT_TIMEOUT_SECONDS']:
+            logger.info(f"Result cache: dropping entry {key}, task {entry['task_id']} still {state} after {age:.0f} s (lost).")
+            remove(key)
+            metrics.count_cache('result', hit=False)
+            return None
+
+    metrics.count_cache('result', hit=True)
+    if ready:
+        # Only a stored result counts as used: an in-flight entry must still age out if its task is lost.
+        r.zadd(f"{prefix}lru", {key: time.time()})
+        for output_key in output_keys:
+            try:
+                store.touch(output_key)
+            except Exception as e:
+                logger.warning(f"Result cache: could not touch '{output_key}': {e}")
+            file_registry.touch(output_key, extend=True)
+    return {'task_id': entry['task_id'], 'result_filename': filenames[0], 'result_filenames': filenames, 'ready': ready}
+
+def register(key, task_id, result_filename):
+    """Records a dispatched task as the producer of the result for a key (one filename or a list, one per format)."""
+    filenames = [result_filename] if isinstance(result_filename, str) else list(result_filename)
+    r = _client()
+    prefix = _prefix()
+    now = time.time()
+    pipe = r.pipeline()
+    pipe.hset(f"{prefix}entry:{key}", mapping={
+        'task_id': task_id, 'result_filename': ','.join(filenames), 'size': 0, 'created': now
+    })
+    pipe.zadd(f"{prefix}lru", {key: now})
+    for filename in filenames:
+        pipe.hset(f"{prefix}files", filename, key)
+    pipe.execute()
+
+def complete(key, size, task_id=None, result_filename=None):
+    """
+    Called by the worker once the output is stored: records its size and enforces the size budget.
+    An entry that is gone (dropped as lost, or never registered) is recreated from task_id and
+    result_filename when they are given.
+    """
+    r = _client()
+    prefix = _prefix()
+    entry_key = f"{prefix}entry:{key}"
+    if not r.exists(entry_key):
+        if task_id is None or result_filename is None:
+            return
+        register(key, task_id, result_filename)
+    pipe = r.pipeline()
+    pipe.hset(entry_key, 'size', size)
+    pipe.incrby(f"{prefix}bytes", size)
+    pipe.execute()
+    total = int(r.get(f"{prefix}bytes") or 0)
+    if total > current_app.config['RESULT_CACHE_MAX_BYTES']:
+        evict()
+
+def remove(key, delete_file=True):
+    """Drops an entry (and by default its output file)."""
+    r = _client()
+    prefix = _prefix()
+    entry_key = f"{prefix}entry:{key}"
+    entry = r.hgetall(entry_key)
+    pipe = r.pipeline()
+    pipe.delete(entry_key)
+    pipe.zrem(f"{prefix}lru", key)
+    if entry:
+        pipe.hdel(f"{prefix}files", *_filenames(entry))
+        size = int(entry.get('size') or 0)
+        if size:
+            pipe.decrby(f"{prefix}bytes", size)
+    pipe.execute()
+    if entry and delete_file and int(entry.get('size') or 0):
+        store = get_blob_store(current_app.config)
+        for filename in _filenames(entry):
+            output_key = processed_key(filename)
+            try:
+                if store.delete(output_key):
+                    logger.info(f"Result cache: evicted '{output_key}'")
+            except Exception as e:
+                logger.error(f"Result cache: could not delete '{output_key}': {e}")
+                continue
+            file_registry.forget(output_key)
+
+
+# --- Eviction ---
+
+def evict(max_bytes=None, max_age_seconds=None):
+    """
+    Removes entries unused for longer than max_age_seconds, then the least recently
+    used completed entries until the total size fits in max_bytes (in-flight entries
+    are skipped). Returns the number removed.
+    """
+    config = current_app.config
+    if max_bytes is None:
+        max_bytes = config['RESULT_CACHE_MAX_BYTES']
+    if max_age_seconds is None:
+        max_age_seconds = config['RESULT_CACHE_MAX_AGE_DAYS'] * 24 * 60 * 60
+    r = _client()
+    prefix = _prefix()
+    removed = 0
+
+    for key in r.zrangebyscore(f"{prefix}lru", '-inf', time.time() - max_age_seconds):
+        remove(key)
+        removed += 1
+
+    # In-flight entries (size 0) hold no bytes: evicting them would only re-run their task.
+    skipped = 0
+    while int(r.get(f"{prefix}bytes") or 0) > max_bytes:
+        oldest = r.zrange(f"{prefix}lru", skipped, skipped + EVICT_BATCH_SIZE - 1)
+        if not oldest:
+            break
+        for key in oldest:
+            if int(r.get(f"{prefix}bytes") or 0) <= max_bytes:
+                break
+            size = r.hget(f"{prefix}entry:{key}", 'size')
+            if size is not None and not int(size):
+                skipped += 1
+                continue
+            remove(key)
+            removed += 1
+
+    if removed:
+        logger.info(f"Result cache: evicted {removed} entries.")
+    return removed
+
+def owner(result_filename):
+    """Key of the cache entry that owns a processed result, or None."""
+    return _client().hget(f"{_prefix()}files", result_filename)
+
+def referenced_filenames():
+    """Names of the processed results that the cache still owns."""
+    return set(_client().hkeys(f"{_prefix()}files"))
@@ -0,0 +1,241 @@
+"""
+Prefix cache of intermediate processing stages.
+
+After decoding and after every step of the execution plan, the float32 buffer is
+stored under a key derived from the input digest and the signature of the plan
+prefix that produced it (chain_planner.ExecutionPlan.prefix_signatures). A later
+request for the same input whose plan shares a prefix starts from the longest
+cached stage instead of decoding and re-running the shared steps.
+
+Two tiers, both LRU with a byte budget:
+    memory  per-process OrderedDict of array copies
+    disk    .npz files in STAGE_CACHE_FOLDER, shared by the worker processes
+
+The final step is not stored: the result cache already covers the full chain.
+Each process tracks the disk tier's usage incrementally and re-lists the folder
+only every DISK_RESCAN_SECONDS (to see the other processes' files), so the disk
+budget is approximate between rescans.
+
+Hit/miss counters are kept per process and, when a Redis client is given,
+aggregated in a Redis hash for monitoring.
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+STATS_KEY = 'ams:stage_cache:stats'
+STAT_NAMES = ('hits', 'memory_hits', 'disk_hits', 'misses', 'stores', 'evictions')
+DISK_RESCAN_SECONDS = 300
+
+
+def stage_key(input_digest, prefix_signature):
+    """Key of the buffer produced by running the plan prefix described by prefix_signature on the input."""
+    material = f"{input_digest}|{prefix_signature}"
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class StageCache:
+    def __init__(self, folder, memory_budget_bytes, disk_budget_bytes, max_entry_bytes, redis_client=None):
+        self.folder = folder
+        self.memory_budget_bytes = memory_budget_bytes
+        self.disk_budget_bytes = disk_budget_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.redis_client = redis_client
+        self._memory = OrderedDict() # key -> (samples, frame_rate, sample_width)
+        self._memory_bytes = 0
+        self._disk = OrderedDict() # key -> file size, least recently used first
+        self._disk_bytes = 0
+        self._disk_scanned_at = None
+        self._lock = threading.Lock()
+        self.stats = dict.fromkeys(STAT_NAMES, 0)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def _count(self, name):
+        self.stats[name] += 1
+        if self.redis_client is not None:
+            try:
+                self.redis_client.hincrby(STATS_KEY, name, 1)
+            except Exception as e:
+                logger.debug(f"Stage cache: could not publish counter '{name}': {e}")
+
+    def _disk_path(self, key):
+        return os.path.join(self.folder, f"{key}.npz")
+
+    # --- Lookup ---
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is not None:
+            self._count('memory_hits')
+            samples, frame_rate, sample_width = entry
+            return samples.copy(), frame_rate, sample_width
+
+        if not self.folder:
+            return None
+        path = self._disk_path(key)
+        try:
+            with np.load(path) as data:
+                samples = data['samples']
+                frame_rate = int(data['frame_rate'])
+                sample_width = int(data['sample_width'])
+            os.utime(path, None)
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            return None
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+        self._count('disk_hits')
+        self._remember(key, samples, frame_rate, sample_width)
+        return samples, frame_rate, sample_width
+
+    def longest_prefix(self, input_digest, prefix_signatures):
+        """
+        prefix_signatures[k] describes the buffer after the first k plan steps.
+        Returns (prefix_length, samples, frame_rate, sample_width) for the longest
+        cached prefix (prefix_length 0 is the decoded input), or None.
+        The returned array is a private copy the caller may modify in place.
+        """
+        step_count = len(prefix_signatures) - 1
+        for length in range(step_count, -1, -1):
+            found = self._get(stage_key(input_digest, prefix_signatures[length]))
+            if found is not None:
+                self._count('hits')
+                metrics.count_cache('stage', hit=True)
+                logger.info(f"Stage cache hit: reusing {length}/{step_count} processed steps.")
+                return (length,) + found
+        self._count('misses')
+        metrics.count_cache('stage', hit=False)
+        return None
+
+    # --- Store ---
+
+    def _remember(self, key, samples, frame_rate, sample_width):
+        """Adds a copy of the array to the memory tier, evicting LRU entries to fit."""
+        size = samples.nbytes
+        if size > self.memory_budget_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return
+            while self._memory and self._memory_bytes + size > self.memory_budget_bytes:
+                _, (old, _, _) = self._memory.popitem(last=False)
+                self._memory_bytes -= old.nbytes
+                self._count('evictions')
+            self._memory[key] = (samples.copy(), frame_rate, sample_width)
+            self._memory_bytes += size
+
+    def store(self, input_digest, prefix_signature, samples, frame_rate, sample_width):
+        """Stores the buffer produced by a plan prefix (copied; the caller keeps ownership)."""
+        if samples.nbytes > self.max_entry_bytes:
+            return
+        key = stage_key(input_digest, prefix_signature)
+        self._remember(key, samples, frame_rate, sample_width)
+        self._count('stores')
+        if not self.folder or samples.nbytes > self.disk_budget_bytes:
+            return
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            return
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, samples=samples, frame_rate=frame_rate, sample_width=sample_width)
+                size = f.tell()
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Stage cache: could not write '{path}': {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._add_disk_entry(key, size)
+
+    def _scan_disk(self):
+        """Rebuilds the disk index from the folder (picks up the files of the other processes)."""
+        entries = []
+        for entry in os.scandir(self.folder):
+            if not entry.name.endswith('.npz'):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, entry.name[:-len('.npz')], st.st_size))
+        self._disk = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self._disk_bytes = sum(self._disk.values())
+        self._disk_scanned_at = time.monotonic()
+
+    def _add_disk_entry(self, key, size):
+        """Records a written stage file and deletes least recently used ones until the folder fits its budget."""
+        with self._lock:
+            if self._disk_scanned_at is None or time.monotonic() - self._disk_scanned_at > DISK_RESCAN_SECONDS:
+                self._scan_disk()
+            if key not in self._disk:
+                self._disk[key] = size
+                self._disk_bytes += size
+            evicted = []
+            while self._disk and self._disk_bytes > self.disk_budget_bytes:
+                old_key, old_size = self._disk.popitem(last=False)
+                self._disk_bytes -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._disk_path(old_key))
+                self._count('evictions')
+            except FileNotFoundError:
+                pass
+
+    def shared_stats(self):
+        """Counters aggregated across worker processes (falls back to this process)."""
+        if self.redis_client is not None:
+            try:
+                raw = self.redis_client.hgetall(STATS_KEY)
+                return {name: int(raw.get(name, 0)) for name in STAT_NAMES}
+            except Exception as e:
+                logger.warning(f"Stage cache: could not read shared counters: {e}")
+        return dict(self.stats)
+
+
+_instance = None
+
+def get_stage_cache(config):
+    """Process-wide StageCache built from the app config, or None when disabled."""
+    global _instance
+    if not config.get('STAGE_CACHE_ENABLED'):
+        return None
+    if _instance is None:
+        redis_client = None
+        if config.get('RESULT_CACHE_REDIS_URL'):
+            import redis
+            redis_client = redis.Redis.from_url(config['RESULT_CACHE_REDIS_URL'], decode_responses=True)
+        _instance = StageCache(
+            folder=config.get('STAGE_CACHE_FOLDER'),
+            memory_budget_bytes=config['STAGE_CACHE_MEMORY_BYTES'],
+            disk_budget_bytes=config['STAGE_CACHE_DISK_BYTES'],
+            max_entry_bytes=config['STAGE_CACHE_MAX_ENTRY_BYTES'],
+            redis_client=redis_client,
+        )
+    return _instance
+
+def read_stats(config):
+    """Aggregated counters for the monitoring endpoint (readable from the web process)."""
+    cache = get_stage_cache(config)
+    if cache is None:
+        return {'enabled': False}
+    stats = cache.shared_stats()
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = round(stats['hits'] / float(lookups), 4) if lookups else None
+    stats['enabled'] = True
+    return stats
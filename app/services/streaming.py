@@ -0,0 +1,203 @@
+"""
+Bounded-memory streaming pipeline for long inputs.
+
+The input is decoded by an ffmpeg subprocess into float32 PCM on a pipe, read in
+fixed-size blocks, pushed through the stateful stages from dsp_engine, and fed
+to a second ffmpeg subprocess that encodes the output incrementally. Peak memory
+depends on the block size and the longest delay line, not on the input duration.
+"""
+import os
+import time
+import logging
+import subprocess
+import numpy as np
+
+from . import dsp_engine, chain_planner, parallel, metrics, encoders
+from ..utils.file_validator import ffprobe_metadata
+
+logger = logging.getLogger(__name__)
+
+def probe_audio(input_path):
+    """
+    Reads duration, channels, sample rate and sample width from the container
+    header with ffprobe. Returns a dict or None if the file could not be probed.
+    """
+    try:
+        info = ffprobe_metadata(input_path)
+    except Exception as e:
+        logger.warning(f"Could not probe '{input_path}': {e}")
+        return None
+    if info is None:
+        logger.warning(f"Could not probe '{input_path}': ffprobe is not installed.")
+        return None
+    info['duration'] = info['duration'] or 0.0
+    return info
+
+def is_streamable(effects_chain):
+    """True if every step of the compiled chain can run block by block (no-op whole-buffer effects are dropped)."""
+    return chain_planner.compile_chain(effects_chain).is_streamable
+
+def should_stream(input_path, effects_chain, min_duration_s=None, min_bytes=None, audio_info=None):
+    """
+    Decides whether the input is large enough for the streaming pipeline.
+    The file size is checked first; the duration is only probed if needed.
+    """
+    if min_duration_s is None and min_bytes is None:
+        return False
+    if not is_streamable(effects_chain):
+        logger.info("Effects chain contains whole-buffer effects; streaming pipeline not used.")
+        return False
+    if min_bytes is not None and os.path.getsize(input_path) >= min_bytes:
+        return True
+    if min_duration_s is not None:
+        info = audio_info or probe_audio(input_path)
+        if info and info['duration'] >= min_duration_s:
+            return True
+    return False
+
+def stream_audio_effects(
+    input_path,
+    output_path,
+    output_format="wav",
+    effects_chain=None,
+    audio_info=None,
+    block_frames=dsp_engine.BLOCK_FRAMES,
+    progress_func=None,
+    workers=1,
+    encoder_profile=None,
+    encoder_threads=None
+    ):
+    """
+    Runs the effects chain over the input block by block between ffmpeg pipes.
+    output_path/output_format may be equal-length lists: every block is then
+    written to one encoder per format.
+    With workers > 1 the input is read in windows of one segment per worker and
+    each window is processed with parallel.process_parallel.
+    progress_func, if given, is called with the processed fraction (0.0 to 1.0).
+    encoder_profile/encoder_threads select the encoder settings (see encoders.py).
+    Raises RuntimeError if either ffmpeg process fails.
+    """
+    if effects_chain is None: effects_chain = []
+    info = audio_info or probe_audio(input_path)
+    if not info:
+        raise RuntimeError(f"Could not read audio parameters of '{input_path}'.")
+    channels, frame_rate = info['channels'], info['sample_rate']
+    expected_frames = int(info['duration'] * frame_rate) or None
+    outputs = encoders.as_outputs(output_path, output_format)
+    logger.info(f"Streaming effects: Input='{input_path}', Output={[path for _, path in outputs]}, "
+                f"Formats={[fmt for fmt, _ in outputs]}, "
+                f"Channels={channels}, SR={frame_rate}Hz, Block={block_frames} frames")
+
+    plan = chain_planner.compile_chain(effects_chain)
+    logger.info(plan.describe())
+    if not plan.is_streamable:
+        raise RuntimeError("Effects chain contains whole-buffer effects and cannot be streamed.")
+    labelled_stages = chain_planner.build_labelled_stages(plan.steps, frame_rate, channels)
+    stages = [stage for _, stage in labelled_stages]
+    output_gain = np.float32(plan.output_gain)
+    read_frames = block_frames
+    use_parallel = workers > 1 and bool(stages)
+    if use_parallel:
+        warmup = parallel.warmup_frames(stages)
+        read_frames = workers * parallel.segment_frames(warmup, min_frames=block_frames)
+        logger.info(f"Parallel streaming: {workers} segments per {read_frames}-frame window, warm-up {warmup} frames.")
+    history = None
+
+    decoder = encoders.spawn_ffmpeg(
+        ['-v', 'error', '-nostdin', '-i', input_path,
+         '-f', 'f32le', '-acodec', 'pcm_f32le', '-ac', str(channels), '-ar', str(frame_rate), '-'],
+        stdout=subprocess.PIPE
+    )
+    input_args = ['-f', 'f32le', '-ar', str(frame_rate), '-ac', str(channels)]
+    encoder_procs = [
+        (fmt, encoders.open_encoder(fmt, path, input_args, info['sample_width'], encoder_profile, encoder_threads))
+        for fmt, path in outputs
+    ]
+    active_encoders = list(encoder_procs)
+
+    # Preallocated buffers: interleaved bytes from/to ffmpeg and the planar work block.
+    frame_bytes = channels * 4
+    raw = bytearray(read_frames * frame_bytes)
+    raw_view = memoryview(raw)
+    planar = np.empty((channels, read_frames), dtype=np.float32)
+    upper = np.float32(np.nextafter(np.float32(1.0), np.float32(0.0)))
+    processed_frames = 0
+    # Seconds spent waiting for the decoder, in each stage and feeding the encoder (for metrics).
+    decode_seconds = 0.0
+    encode_seconds = dict.fromkeys((fmt for fmt, _ in outputs), 0.0)
+    labels = [label for label, _ in labelled_stages]
+    parallel_label = '+'.join(labels) # Stages of a parallel window run together.
+    effect_seconds = dict.fromkeys([parallel_label] if use_parallel else labels, 0.0)
+    try:
+        while True:
+            filled = 0
+            started = time.perf_counter()
+            while filled < len(raw):
+                count = decoder.stdout.readinto(raw_view[filled:])
+                if not count:
+                    break
+                filled += count
+            decode_seconds += time.perf_counter() - started
+            frame_count = filled // frame_bytes
+            if frame_count == 0:
+                break
+
+            interleaved = np.frombuffer(raw, dtype=np.float32, count=frame_count * channels).reshape(frame_count, channels)
+            block = planar[:, :frame_count]
+            block[...] = interleaved.T
+            if use_parallel:
+                started = time.perf_counter()
+                next_history = parallel.input_tail(history, block, warmup)
+                parallel.process_parallel(lambda: plan.build_stages(frame_rate, channels), block, workers, history=history)
+                history = next_history
+                effect_seconds[parallel_label] += time.perf_counter() - started
+            else:
+                for label, stage in labelled_stages:
+                    started = time.perf_counter()
+                    stage.process(block)
+                    effect_seconds[label] += time.perf_counter() - started
+            if output_gain != 1.0:
+                block *= output_gain
+            np.clip(block, -1.0, upper, out=block)
+            interleaved_out = np.ascontiguousarray(block.T) # Serialized once for all encoders.
+            for fmt, encoder in list(active_encoders):
+                started = time.perf_counter()
+                try:
+                    encoder.stdin.write(interleaved_out)
+                except BrokenPipeError:
+                    active_encoders.remove((fmt, encoder)) # The encoder exited; its error is reported below.
+                encode_seconds[fmt] += time.perf_counter() - started
+            if not active_encoders:
+                break
+
+            processed_frames += frame_count
+            if progress_func and expected_frames:
+                progress_func(min(1.0, processed_frames / float(expected_frames)))
+            if filled < len(raw):
+                break
+    finally:
+        decoder.stdout.close()
+        decode_err = encoders.finish_ffmpeg(decoder)
+        encode_errors = []
+        for fmt, encoder in encoder_procs:
+            started = time.perf_counter()
+            try:
+                encoder.stdin.close()
+            except BrokenPipeError:
+                pass
+            encode_err = encoders.finish_ffmpeg(encoder)
+            encode_seconds[fmt] += time.perf_counter() - started
+            if encoder.returncode != 0:
+                encode_errors.append(f"{fmt}: {encode_err.strip()}" if len(encoder_procs) > 1 else encode_err.strip())
+
+    if encode_errors:
+        raise RuntimeError(f"ffmpeg encoding failed: {'; '.join(encode_errors)}")
+    if decoder.returncode != 0:
+        raise RuntimeError(f"ffmpeg decoding failed: {decode_err.strip()}")
+    metrics.observe('decode', decode_seconds, pipeline='streaming')
+    for label, seconds in effect_seconds.items():
+        metrics.observe('effect', seconds, effect=label)
+    for fmt, seconds in encode_seconds.items():
+        metrics.observe('export', seconds, format=fmt.lower())
+    logger.info(f"Streaming effects complete: {processed_frames} frames ({processed_frames/float(frame_rate):.2f}s).")
+    return processed_frames
@@ -0,0 +1,142 @@
+"""
+Process warm-up, so the first request or task after a deploy or autoscale event
+does not pay one-off initialization costs.
+
+Worker processes (Celery worker_init, and worker_process_init in every prefork
+child) resolve the ffmpeg/ffprobe binaries once, precompute the Butterworth
+designs for the common cutoffs and sample rates (dsp_engine.butterworth_sos
+cache) and run every effect once on a short silent buffer. That loads the lazy
+parts of scipy and librosa (whose first time_stretch call compiles numba code
+for more than a second).
+
+The web app opens the libmagic handle used by is_allowed_file and resolves the
+ffprobe binary at startup.
+
+Each process logs a startup report with the time of every step; the times are
+also recorded as ams_warmup_seconds{step}.
+"""
+import os
+import time
+import logging
+import subprocess
+import importlib.util
+import numpy as np
+from pydub import AudioSegment
+
+from . import dsp_engine, metrics
+
+logger = logging.getLogger(__name__)
+
+WARMUP_FRAMES = 4096
+# Effect configs that exercise every DSP code path (none of them is a no-op).
+WARMUP_EFFECTS = [
+    {'name': 'high_pass_filter'},
+    {'name': 'echo'},
+    {'name': 'reverb', 'mode': 'taps'},
+    {'name': 'reverb', 'mode': 'convolution'},
+    {'name': 'speed_pitch', 'factor': 1.5, 'mode': 'resample'},
+    {'name': 'speed_pitch', 'factor': 1.5, 'mode': 'time_stretch'},
+]
+
+_state = {'pid': None, 'report': {}}
+
+
+def init_app(app):
+    """Warms up the web process now and hooks the worker warm-up into the Celery signals."""
+    config = app.config
+    if not config.get('WARMUP_ENABLED', True):
+        return
+    _connect_celery_signals(config)
+    run('web', [
+        ('magic', warm_validator),
+        ('ffmpeg', warm_ffmpeg),
+    ])
+
+def last_report():
+    """{step: seconds} of the last warm-up in this process."""
+    return dict(_state['report'])
+
+
+# --- Steps ---
+
+def warm_validator():
+    from ..utils import file_validator
+    detector = file_validator.get_mime_detector()
+    detector.from_buffer(b'RIFF\x24\x00\x00\x00WAVEfmt ')
+    file_validator.ffprobe_path()
+    return 'libmagic handle open'
+
+def warm_ffmpeg():
+    from ..utils import file_validator
+    # The app's probes (upload validation, streaming.probe_audio) share this per-process lookup.
+    prober = file_validator.ffprobe_path()
+    version = subprocess.run([AudioSegment.converter, '-version'], capture_output=True, timeout=10).stdout
+    first_line = (version.splitlines() or [b'ffmpeg not found'])[0].decode(errors='replace')
+    return f"{' '.join(first_line.split()[:3])}; prober {prober}"
+
+def warm_filters(sample_rates, orders):
+    designs = 0
+    for btype, name in (('highpass', 'high_pass_filter'), ('lowpass', 'low_pass_filter')):
+        cutoff_hz = float(dsp_engine.EFFECT_DEFAULTS[name]['cutoff_hz'])
+        for frame_rate in sample_rates:
+            for order in orders:
+                dsp_engine.butterworth_sos(btype, cutoff_hz, frame_rate, order)
+                designs += 1
+    return f"{designs} filter designs"
+
+def warm_dsp(sample_rate):
+    effects = WARMUP_EFFECTS
+    if importlib.util.find_spec('librosa') is None:
+        effects = [e for e in effects if e.get('mode') != 'time_stretch']
+    samples = np.zeros((2, WARMUP_FRAMES), dtype=np.float32)
+    for effect_config in effects:
+        dsp_engine.apply_effect(samples.copy(), sample_rate, effect_config)
+    return f"{len(effects)} effects"
+
+
+# --- Runner ---
+
+def run(role, steps):
+    """Runs (name, function) steps, logging failures without raising. Returns {step: seconds}."""
+    report, details = {}, []
+    started = time.perf_counter()
+    for name, step in steps:
+        step_started = time.perf_counter()
+        try:
+            detail = step()
+        except Exception as e:
+            logger.warning(f"Warm-up step '{name}' failed: {e}")
+            detail = 'failed'
+        report[name] = time.perf_counter() - step_started
+        metrics.observe('warmup', report[name], step=name)
+        details.append(f"{name} {report[name] * 1000:.0f} ms ({detail})")
+    _state['report'] = report
+    logger.info(f"Warm-up of {role} process {os.getpid()} took {(time.perf_counter() - started) * 1000:.0f} ms: {'; '.join(details)}")
+    return report
+
+def _parse_ints(value):
+    return [int(v) for v in str(value).split(',') if v.strip()]
+
+def warm_worker(config):
+    # Prefork children inherit the parent's warm state, but their own pid, so they still
+    # run the (then mostly cached) steps; anything done twice in one process is skipped.
+    if _state['pid'] == os.getpid():
+        return
+    _state['pid'] = os.getpid()
+    sample_rates = _parse_ints(config.get('WARMUP_SAMPLE_RATES', '44100,48000'))
+    orders = _parse_ints(config.get('WARMUP_FILTER_ORDERS', '1,2,4'))
+    run('worker', [
+        ('ffmpeg', warm_ffmpeg),
+        ('filters', lambda: warm_filters(sample_rates, orders)),
+        ('dsp', lambda: warm_dsp(sample_rates[0] if sample_rates else 44100)),
+    ])
+
+def _connect_celery_signals(config):
+    from celery import signals
+
+    def worker_started(**kwargs):
+        warm_worker(config)
+
+    # weak=False: the handlers are closures that would otherwise be garbage collected.
+    signals.worker_init.connect(worker_started, weak=False)
+    signals.worker_process_init.connect(worker_started, weak=False)
@@ -13,6 +13,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const errorDetailsContainer = document.getElementById('error-details-container');
 
     let currentTaskPollInterval = null;
+    let currentEventSource = null;
 
     // --- Effect Parameter UI Handlers ---
     function setupEffectParameterSlider(checkboxId, sliderId, valueDisplayId, unit = '', isFloat = false) {
@@ -114,56 +115,13 @@ document.addEventListener('DOMContentLoaded', function() {
             if (outputFormatSelect) {
                 formData.append('output_format', outputFormatSelect.value);
             }
-
-            // --- Collect Effect Parameters ---
-            const effects_chain = [];
-            // Gain
-            if (document.getElementById('enable_gain').checked) {
-                effects_chain.push({
-                    name: 'gain',
-                    gain_db: parseFloat(document.getElementById('gain_db').value)
-                });
-            }
-            // High-Pass Filter
-            if (document.getElementById('enable_high_pass_filter').checked) {
-                effects_chain.push({
-                    name: 'high_pass_filter',
-                    cutoff_hz: parseInt(document.getElementById('high_pass_cutoff_hz').value)
-                });
-            }
-            // Low-Pass Filter
-            if (document.getElementById('enable_low_pass_filter').checked) {
-                effects_chain.push({
-                    name: 'low_pass_filter',
-                    cutoff_hz: parseInt(document.getElementById('low_pass_cutoff_hz').value) // Changed from parseFloat
-                });
-            }
-            // Speed/Pitch
-            if (document.getElementById('enable_speed_pitch').checked) {
-                effects_chain.push({
-                    name: 'speed_pitch',
-                    factor: parseFloat(document.getElementById('speed_factor').value)
-                });
-            }
-            // Echo
-            if (document.getElementById('enable_echo').checked) {
-                effects_chain.push({
-                    name: 'echo',
-                    delay_ms: parseInt(document.getElementById('echo_delay_ms').value),
-                    decay_factor: parseFloat(document.getElementById('echo_decay_factor').value)
-                });
-            }
-            // Reverb
-            if (document.getElementById('enable_reverb').checked) {
-                effects_chain.push({
-                    name: 'reverb',
-                    wet_level: parseFloat(document.getElementById('reverb_wet_level').value),
-                    room_size: parseFloat(document.getElementById('reverb_room_size').value)
-                });
+            const encoderProfileSelect = document.getElementById('encoder_profile');
+            if (encoderProfileSelect) {
+                formData.append('encoder_profile', encoderProfileSelect.value);
             }
 
+            const effects_chain = collectEffectsChain();
             formData.append('effects_chain', JSON.stringify(effects_chain));
-            // --- End Collect Effect Parameters ---
 
             console.log("FormData entries:");
             for (let [key, value] of formData.entries()) {
@@ -198,11 +156,18 @@ document.addEventListener('DOMContentLoaded', function() {
             })
             .then(data => {
                 console.log("Data received from server:", data);
-                if (data.task_id && data.status_url) {
+                if (data.cached && data.state === 'SUCCESS' && data.download_url) {
+                    // Identical file + effects were already processed: no need to poll.
+                    updateStatusDisplay(data, fileInput.files[0].name);
+                    statusMessageDiv.textContent = data.message || 'Effects applied!';
+                    disableForm(false);
+                    displayDownloadLink(data.result_filename, data.download_url, fileInput.files[0].name);
+                    progressBarInner.classList.remove('progress-bar-animated', 'bg-primary'); progressBarInner.classList.add('bg-success');
+                } else if (data.task_id && data.status_url) {
                     statusMessageDiv.textContent = 'Upload complete! Applying audio effects...';
                     statusMessageDiv.className = 'alert alert-primary text-center';
                     updateProgressBar(5, 'Processing Queued');
-                    pollTaskStatus(data.task_id, fileInput.files[0].name);
+                    trackTaskProgress(data.task_id, fileInput.files[0].name);
                 } else if (data.error) {
                     handleError(data.error);
                 } else {
@@ -216,31 +181,165 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    // --- Collect Effect Parameters ---
+    function collectEffectsChain() {
+        const effects_chain = [];
+        // Gain
+        if (document.getElementById('enable_gain').checked) {
+            effects_chain.push({
+                name: 'gain',
+                gain_db: parseFloat(document.getElementById('gain_db').value)
+            });
+        }
+        // High-Pass Filter
+        if (document.getElementById('enable_high_pass_filter').checked) {
+            effects_chain.push({
+                name: 'high_pass_filter',
+                cutoff_hz: parseInt(document.getElementById('high_pass_cutoff_hz').value),
+                order: parseInt(document.getElementById('high_pass_order').value)
+            });
+        }
+        // Low-Pass Filter
+        if (document.getElementById('enable_low_pass_filter').checked) {
+            effects_chain.push({
+                name: 'low_pass_filter',
+                cutoff_hz: parseInt(document.getElementById('low_pass_cutoff_hz').value), // Changed from parseFloat
+                order: parseInt(document.getElementById('low_pass_order').value)
+            });
+        }
+        // Speed/Pitch
+        if (document.getElementById('enable_speed_pitch').checked) {
+            effects_chain.push({
+                name: 'speed_pitch',
+                factor: parseFloat(document.getElementById('speed_factor').value),
+                mode: document.getElementById('speed_mode').value
+            });
+        }
+        // Echo
+        if (document.getElementById('enable_echo').checked) {
+            effects_chain.push({
+                name: 'echo',
+                delay_ms: parseInt(document.getElementById('echo_delay_ms').value),
+                decay_factor: parseFloat(document.getElementById('echo_decay_factor').value)
+            });
+        }
+        // Reverb
+        if (document.getElementById('enable_reverb').checked) {
+            effects_chain.push({
+                name: 'reverb',
+                wet_level: parseFloat(document.getElementById('reverb_wet_level').value),
+                room_size: parseFloat(document.getElementById('reverb_room_size').value)
+            });
+        }
+        return effects_chain;
+    }
+
+    // Preview: the chain on a short window, rendered synchronously. The source id lets
+    // later previews of the same file skip the upload.
+    const previewButton = document.getElementById('preview-button');
+    const previewPlayer = document.getElementById('preview-player');
+    let previewSource = null;
+    if (fileInput) {
+        fileInput.addEventListener('change', function() { previewSource = null; });
+    }
+    if (previewButton && previewPlayer) {
+        previewButton.addEventListener('click', function() {
+            if (!fileInput.files || fileInput.files.length === 0) {
+                handleError("Please select an audio file to preview.", false, true);
+                return;
+            }
+            const formData = new FormData();
+            if (previewSource && previewSource.file === fileInput.files[0]) {
+                formData.append('source_id', previewSource.id);
+            } else {
+                formData.append('file', fileInput.files[0], fileInput.files[0].name);
+            }
+            formData.append('start', document.getElementById('preview_start').value || '0');
+            formData.append('duration', '10');
+            formData.append('format', 'mp3');
+            formData.append('effects_chain', JSON.stringify(collectEffectsChain()));
+
+            previewButton.disabled = true;
+            fetch('/preview', { method: 'POST', body: formData })
+            .then(response => {
+                if (response.status === 404 && previewSource) {
+                    previewSource = null; // Source expired on the server: upload again next time.
+                }
+                if (!response.ok) {
+                    return response.json().then(errData => { throw new Error(errData.error || `Server error: ${response.status}`); });
+                }
+                previewSource = { id: response.headers.get('X-Preview-Source'), file: fileInput.files[0] };
+                return response.blob();
+            })
+            .then(blob => {
+                if (previewPlayer.src) URL.revokeObjectURL(previewPlayer.src);
+                previewPlayer.src = URL.createObjectURL(blob);
+                previewPlayer.style.display = 'block';
+                previewPlayer.play();
+            })
+            .catch(error => handleError(`Preview failed: ${error.message}`, false, true))
+            .finally(() => { previewButton.disabled = false; });
+        });
+    }
+
+    // Progress is pushed over Server-Sent Events; polling /status is the fallback.
+    function trackTaskProgress(taskId, originalFileName = "your file") {
+        stopTracking();
+        if (!window.EventSource) { pollTaskStatus(taskId, originalFileName); return; }
+        const source = new EventSource(`/events/${taskId}`);
+        let receivedEvent = false;
+        currentEventSource = source;
+        source.onmessage = (event) => {
+            receivedEvent = true;
+            let data;
+            try { data = JSON.parse(event.data); } catch (e) { console.error('Invalid progress event:', event.data); return; }
+            if (handleTaskUpdate(data, originalFileName)) stopTracking();
+        };
+        source.onerror = () => {
+            // The browser reconnects a dropped stream by itself; fall back only if streaming never worked or was refused.
+            if (!receivedEvent || source.readyState === EventSource.CLOSED) {
+                console.warn('Progress stream unavailable, falling back to polling.');
+                stopTracking();
+                pollTaskStatus(taskId, originalFileName);
+            }
+        };
+    }
+
     function pollTaskStatus(taskId, originalFileName = "your file") {
         if (currentTaskPollInterval) { clearInterval(currentTaskPollInterval); }
         currentTaskPollInterval = setInterval(() => {
             fetch(`/status/${taskId}`).then(r => r.ok ? r.json() : Promise.reject(r)).then(data => {
-                const dFN = (data.info && data.info.original_filename) ? data.info.original_filename : originalFileName;
-                updateStatusDisplay(data, dFN);
-                if (data.state === 'SUCCESS' || data.state === 'FAILURE') {
-                    clearInterval(currentTaskPollInterval); currentTaskPollInterval = null; disableForm(false);
-                    if (data.state === 'SUCCESS' && data.download_url && data.result_filename) {
-                        displayDownloadLink(data.result_filename, data.download_url, dFN);
-                        progressBarInner.classList.remove('progress-bar-animated', 'bg-primary'); progressBarInner.classList.add('bg-success');
-                    } else if (data.state === 'FAILURE') {
-                        let eM = (data.info && (data.info.status_message || data.info.error_details)) || data.status_message || 'Processing failed.';
-                        if (dFN) eM = `Error processing ${dFN}: ${eM}`;
-                        handleError(eM, true);
-                        progressBarInner.classList.remove('progress-bar-animated', 'bg-primary'); progressBarInner.classList.add('bg-danger');
-                    }
-                }
+                if (handleTaskUpdate(data, originalFileName)) stopTracking();
             }).catch(err => { console.error('Polling error:', err); statusMessageDiv.textContent = `Error fetching status. Will retry.`; statusMessageDiv.className = 'alert alert-warning text-center'; });
         }, 2500);
     }
 
+    // Applies one status update (from the stream or a poll). Returns true once the task is finished.
+    function handleTaskUpdate(data, originalFileName) {
+        const dFN = (data.info && data.info.original_filename) ? data.info.original_filename : (data.original_filename || originalFileName);
+        updateStatusDisplay(data, dFN);
+        if (data.state !== 'SUCCESS' && data.state !== 'FAILURE') return false;
+        disableForm(false);
+        if (data.state === 'SUCCESS' && data.download_url && data.result_filename) {
+            displayDownloadLink(data.result_filename, data.download_url, dFN);
+            progressBarInner.classList.remove('progress-bar-animated', 'bg-primary'); progressBarInner.classList.add('bg-success');
+        } else if (data.state === 'FAILURE') {
+            let eM = (data.info && (data.info.status_message || data.info.error_details)) || data.status_message || 'Processing failed.';
+            if (dFN) eM = `Error processing ${dFN}: ${eM}`;
+            handleError(eM, true);
+            progressBarInner.classList.remove('progress-bar-animated', 'bg-primary'); progressBarInner.classList.add('bg-danger');
+        }
+        return true;
+    }
+
+    function stopTracking() {
+        if (currentEventSource) { currentEventSource.close(); currentEventSource = null; }
+        if (currentTaskPollInterval) { clearInterval(currentTaskPollInterval); currentTaskPollInterval = null; }
+    }
+
     function updateStatusDisplay(data, fileName) {
-        let sT = (data.info && data.info.status) ? data.info.status : `Task is ${data.state}`;
-        let p = (data.info && typeof data.info.progress !== 'undefined') ? data.info.progress : (data.state === 'SUCCESS' ? 100 : 0);
+        let sT = (data.info && data.info.status) ? data.info.status : (data.status || `Task is ${data.state}`);
+        let p = (data.info && typeof data.info.progress !== 'undefined') ? data.info.progress : (typeof data.progress !== 'undefined' ? data.progress : (data.state === 'SUCCESS' ? 100 : 0));
         if (fileName && (data.state === 'PROGRESS' || data.state === 'PENDING')) sT = `${sT} for "${fileName}"`;
         statusMessageDiv.textContent = sT; updateProgressBar(p, `${p}%`);
         progressBarInner.classList.remove('bg-success', 'bg-danger', 'bg-warning'); statusMessageDiv.classList.remove('alert-success', 'alert-danger', 'alert-warning', 'alert-primary');
@@ -265,13 +364,13 @@ document.addEventListener('DOMContentLoaded', function() {
     function handleError(errorMessage, isProcessingError = false, isUIMessage = false) {
         if (isUIMessage) { statusMessageDiv.textContent = errorMessage; statusMessageDiv.className = 'alert alert-warning text-center'; uploadProgressDiv.style.display = 'block'; errorDetailsContainer.style.display = 'none'; resultLinkContainer.style.display = 'none'; }
         else { statusMessageDiv.textContent = isProcessingError ? 'Effect Application Error' : 'Upload Error'; statusMessageDiv.className = 'alert alert-danger text-center'; updateProgressBar(0, 'Error'); progressBarInner.classList.add('bg-danger'); errorDetailsContainer.textContent = errorMessage; errorDetailsContainer.style.display = 'block'; resultLinkContainer.style.display = 'none'; }
-        if (currentTaskPollInterval) { clearInterval(currentTaskPollInterval); currentTaskPollInterval = null; } disableForm(false);
+        stopTracking(); disableForm(false);
     }
 
     function clearPreviousStatus() {
         uploadProgressDiv.style.display = 'none'; statusMessageDiv.textContent = ''; statusMessageDiv.className = 'alert alert-info text-center'; updateProgressBar(0, '0%'); progressBarInner.classList.remove('bg-success', 'bg-danger', 'bg-warning'); progressBarInner.classList.add('bg-primary', 'progress-bar-animated');
         resultLinkContainer.innerHTML = ''; resultLinkContainer.style.display = 'none'; errorDetailsContainer.innerHTML = ''; errorDetailsContainer.style.display = 'none';
-        if (currentTaskPollInterval) { clearInterval(currentTaskPollInterval); currentTaskPollInterval = null; }
+        stopTracking();
     }
 
     function disableForm(disabled, buttonTextOverride = null) {
@@ -282,6 +381,7 @@ document.addEventListener('DOMContentLoaded', function() {
         }
         if (fileInput) fileInput.disabled = disabled;
         const oFS = uploadForm.querySelector('#output_format'); if (oFS) oFS.disabled = disabled;
+        const ePS = uploadForm.querySelector('#encoder_profile'); if (ePS) ePS.disabled = disabled;
         document.querySelectorAll('.effect-card input, .effect-card select').forEach(el => el.disabled = disabled);
     }
 });
\ No newline at end of file
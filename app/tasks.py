@@ -6,70 +6,163 @@ from flask import current_app
 
 # Import the NEW core processing function for effects
 from app.services.audio_processor import apply_audio_effects_core 
+from app.services import result_cache
+from app.services import batches
+from app.services import file_registry
+from app.services.progress_events import ProgressReporter
+from app.services.stage_cache import get_stage_cache
+from app.services.parallel import resolve_workers
+from app.services.blob_store import get_blob_store, processed_key, UPLOADS, PROCESSED
+from app.utils.file_validator import enforce_audio_limits
 # The line that was previously here importing 'process_audio_file_core' MUST be removed.
 
 import logging
 logger = logging.getLogger(__name__) # Celery worker will configure this logger
 
 @shared_task(bind=True)
-def process_audio_task_effects(self, input_filepath, original_filename, output_filename_base, output_format, effects_chain):
+def process_audio_task_effects(self, input_key, original_filename, output_filename_base, output_format, effects_chain, cache_key=None, input_digest=None,
+                               encoder_profile=None, audio_info=None):
     """
     Celery task to apply a chain of audio effects.
+    input_key is the upload's blob store key; the result is stored as processed/<output filename>.
+    output_format may be a list of formats: the chain then runs once and the result
+    lists every output in 'result_filenames' ('result_filename' is the first one).
+    encoder_profile selects the export encoder settings (default: ENCODER_PROFILE).
+    audio_info is the header metadata probed at upload (the input is then not probed again).
     """
     logger.info(f"Celery effects task {self.request.id} started for {original_filename} with effects: {effects_chain}")
     
+    store = get_blob_store(current_app.config)
     output_folder = current_app.config['PROCESSED_FOLDER']
-    output_filepath = os.path.join(output_folder, f"{output_filename_base}.{output_format}")
+    output_formats = [output_format] if isinstance(output_format, str) else list(output_format)
+    output_filenames = [f"{output_filename_base}.{fmt}" for fmt in output_formats]
+    output_filepaths = [os.path.join(output_folder, filename) for filename in output_filenames]
+
+    # Records progress in the result backend (coalesced, written off this thread) and pushes it to /events subscribers.
+    update_celery_meta = ProgressReporter(
+        self,
+        redis_url=current_app.config.get('PROGRESS_REDIS_URL'),
+        min_interval=current_app.config.get('PROGRESS_MIN_INTERVAL_SECONDS', 0.5),
+        min_step=current_app.config.get('PROGRESS_MIN_STEP_PERCENT', 2),
+        extra_meta={'original_filename': original_filename}
+    )
+
+    def report_progress(state, meta):
+        # SUCCESS is only reported once the result is in the blob store (and downloadable).
+        if state != 'SUCCESS':
+            update_celery_meta(state, meta)
 
     try:
-        self.update_state(state='PROGRESS', meta={'status': 'Initializing effects processing...', 'progress': 1, 'original_filename': original_filename})
-        
-        def update_celery_meta(state, meta):
-            meta['original_filename'] = original_filename
-            self.update_state(state=state, meta=meta)
-
-        # Call the new core function for applying effects
-        success, result_or_error = apply_audio_effects_core(
-            input_path=input_filepath,
-            output_path=output_filepath,
-            output_format=output_format,
-            effects_chain=effects_chain,
-            task_update_meta_func=update_celery_meta
-        )
+        update_celery_meta(state='PROGRESS', meta={'status': 'Initializing effects processing...', 'progress': 1})
+
+        with store.local_copy(input_key) as input_filepath:
+            stage_cache = get_stage_cache(current_app.config)
+            if stage_cache is not None and input_digest is None:
+                with open(input_filepath, 'rb') as f:
+                    input_digest = result_cache.hash_stream(f)
+
+            # Call the new core function for applying effects
+            success, result_or_error = apply_audio_effects_core(
+                input_path=input_filepath,
+                output_path=output_filepaths,
+                output_format=output_formats,
+                effects_chain=effects_chain,
+                task_update_meta_func=report_progress,
+                stream_min_duration_s=current_app.config.get('STREAMING_MIN_DURATION_SECONDS'),
+                stream_min_bytes=current_app.config.get('STREAMING_MIN_FILE_SIZE'),
+                stream_block_frames=current_app.config.get('STREAMING_BLOCK_FRAMES'),
+                stage_cache=stage_cache,
+                input_digest=input_digest,
+                parallel_workers=resolve_workers(current_app.config.get('PARALLEL_WORKERS')),
+                parallel_min_duration_s=current_app.config.get('PARALLEL_MIN_DURATION_SECONDS'),
+                encoder_profile=encoder_profile or current_app.config.get('ENCODER_PROFILE'),
+                encoder_threads=current_app.config.get('ENCODER_THREADS'),
+                audio_info=audio_info,
+                audio_limits_func=enforce_audio_limits # Uploads without a header probe are only checked here
+            )
+
+        output_size = None
+        if success:
+            output_size = 0
+            for output_filename, output_filepath in zip(output_filenames, output_filepaths):
+                file_size = os.path.getsize(output_filepath)
+                output_size += file_size
+                output_digest = None
+                if file_registry.is_enabled():
+                    with open(output_filepath, 'rb') as f:
+                        output_digest = result_cache.hash_stream(f) # Download ETag
+                store.put_file(processed_key(output_filename), output_filepath)
+                file_registry.register(processed_key(output_filename), file_size, digest=output_digest)
+
+        if cache_key:
+            _update_result_cache(cache_key, output_size, self.request.id, output_filenames)
 
         if success:
             logger.info(f"Effects task {self.request.id} completed successfully. Output: {result_or_error}")
-            return {'status': 'Effects applied successfully!', 'progress': 100, 'result_filename': result_or_error, 'original_filename': original_filename}
+            update_celery_meta(state='SUCCESS', meta={'status': 'Effects applied!', 'progress': 100,
+                                                      'result_filename': result_or_error[0], 'result_filenames': result_or_error})
+            return {'status': 'Effects applied successfully!', 'progress': 100, 'result_filename': result_or_error[0],
+                    'result_filenames': result_or_error, 'original_filename': original_filename}
         else:
             logger.error(f"Effects task {self.request.id} failed for {original_filename}. Error: {result_or_error}")
-            if self.AsyncResult(self.request.id).state != 'FAILURE': # Ensure state is set if not already
-                 self.update_state(state='FAILURE', meta={'status': f'Effect processing error: {result_or_error}', 'progress': 0, 'original_filename': original_filename})
+            if update_celery_meta.state != 'FAILURE': # Ensure state is set if not already
+                 update_celery_meta(state='FAILURE', meta={'status': f'Effect processing error: {result_or_error}', 'progress': 0})
             return {'status': f'Error applying effects: {result_or_error}', 'progress': 0, 'original_filename': original_filename, 'error_details': result_or_error}
 
     except Exception as e:
         logger.critical(f"Critical error in Celery effects task {self.request.id} for {original_filename}: {e}", exc_info=True)
-        self.update_state(state='FAILURE', meta={'status': f'Critical task error: {str(e)}', 'progress': 0, 'original_filename': original_filename})
+        if cache_key:
+            _update_result_cache(cache_key, None)
+        update_celery_meta(state='FAILURE', meta={'status': f'Critical task error: {str(e)}', 'progress': 0})
         return {'status': f'Critical Error: {str(e)}', 'progress': 0, 'original_filename': original_filename, 'error_details': str(e)}
     finally:
+        update_celery_meta.close()
+        # A remote store leaves no scratch output behind on this node, even if the upload failed.
+        for output_filename, output_filepath in zip(output_filenames, output_filepaths):
+            if store.local_path(processed_key(output_filename)) is None and os.path.exists(output_filepath):
+                os.remove(output_filepath)
         # Clean up the original uploaded file
-        if os.path.exists(input_filepath):
-            try:
-                os.remove(input_filepath)
-                logger.info(f"Cleaned up uploaded file for effects task: {input_filepath}")
-            except OSError as e:
-                logger.error(f"Error cleaning up uploaded file {input_filepath} for effects task: {e}")
+        try:
+            if store.delete(input_key):
+                logger.info(f"Cleaned up uploaded file for effects task: {input_key}")
+            file_registry.forget(input_key)
+        except Exception as e:
+            logger.error(f"Error cleaning up uploaded file {input_key} for effects task: {e}")
+
+
+def _update_result_cache(cache_key, output_size, task_id=None, output_filenames=None):
+    """Completes (or, for a failed task, drops) the result cache entry of a task."""
+    try:
+        if output_size is not None:
+            result_cache.complete(cache_key, output_size, task_id, output_filenames)
+        else:
+            result_cache.remove(cache_key)
+    except Exception as e:
+        logger.warning(f"Could not update result cache entry {cache_key}: {e}")
+
+
+@shared_task(name='app.tasks.finalize_batch_task')
+def finalize_batch_task(results, batch_id, task_ids):
+    """Chord callback of a batch upload: records each task's output in the batch record."""
+    record = batches.store_results(batch_id, dict(zip(task_ids, results)))
+    failed = sum(1 for r in results if not (isinstance(r, dict) and r.get('result_filename')))
+    logger.info(f"Batch {batch_id} finished: {len(results) - failed} succeeded, {failed} failed.")
+    return {'batch_id': batch_id, 'completed': len(results) - failed, 'failed': failed, 'recorded': record is not None}
 
 
 @shared_task(name='app.tasks.cleanup_old_files_task') # Explicit name for beat schedule
 def cleanup_old_files_task(max_age_days=7): # Default value if not passed
     """
-    Celery Beat task to clean up old files from upload and processed directories.
+    Celery Beat task to clean up old uploads and results from the blob store,
+    and abandoned resumable uploads from this node's partial folder.
+    With the file registry (the default) only expired index entries are visited, so it
+    runs every CLEANUP_INTERVAL_SECONDS; without it the blob store is listed.
     """
-    upload_folder = current_app.config['UPLOAD_FOLDER']
-    processed_folder = current_app.config['PROCESSED_FOLDER']
+    config = current_app.config
+    partial_folder = config['UPLOAD_PARTIAL_FOLDER'] # Abandoned resumable uploads (node-local)
     
     try:
-        max_age_days_config = current_app.config.get('CLEANUP_MAX_FILE_AGE_DAYS', str(max_age_days))
+        max_age_days_config = config.get('CLEANUP_MAX_FILE_AGE_DAYS', str(max_age_days))
         max_age_days_int = int(max_age_days_config)
     except ValueError:
         logger.warning(
@@ -82,28 +175,72 @@ def cleanup_old_files_task(max_age_days=7): # Default value if not passed
     cutoff = now - (max_age_days_int * 24 * 60 * 60)
 
     logger.info(f"Running cleanup task. Deleting files older than {max_age_days_int} days.")
-    
+
+    # Let the result cache evict by its own age/size budget first, and keep the files it still owns.
+    if result_cache.is_enabled():
+        try:
+            result_cache.evict()
+        except Exception as e:
+            logger.error(f"Cleanup: Result cache eviction failed: {e}", exc_info=True)
+
     cleaned_count = 0
-    for folder_path in [upload_folder, processed_folder]:
-        if not os.path.isdir(folder_path):
-            logger.warning(f"Cleanup: Folder '{folder_path}' does not exist. Skipping.")
-            continue
+    if file_registry.is_enabled():
         try:
-            for filename in os.listdir(folder_path):
-                filepath = os.path.join(folder_path, filename)
-                if os.path.isfile(filepath): 
-                    try:
-                        file_modification_time = os.path.getmtime(filepath)
-                        if file_modification_time < cutoff:
-                            os.remove(filepath)
-                            logger.info(f"Cleanup: Deleted old file '{filepath}'")
-                            cleaned_count += 1
-                    except FileNotFoundError:
-                        logger.warning(f"Cleanup: File '{filepath}' not found during deletion attempt. Skipping.")
-                    except OSError as e:
-                        logger.error(f"Cleanup: Error deleting file '{filepath}': {e}")
+            cleaned_count += file_registry.delete_expired(config['CLEANUP_BATCH_SIZE'], config['CLEANUP_MAX_DELETES_PER_RUN'], now=now)
+            cleaned_count += file_registry.enforce_quota(config['FILE_STORE_MAX_BYTES'], config['CLEANUP_BATCH_SIZE'])
         except Exception as e:
-             logger.error(f"Cleanup: Error listing files in folder '{folder_path}': {e}", exc_info=True)
+            logger.error(f"Cleanup: File registry cleanup failed: {e}", exc_info=True)
+    else:
+        cleaned_count += _cleanup_by_listing(get_blob_store(config), cutoff)
+
+    if os.path.isdir(partial_folder):
+        for filename in os.listdir(partial_folder):
+            filepath = os.path.join(partial_folder, filename)
+            try:
+                if os.path.isfile(filepath) and os.path.getmtime(filepath) < cutoff:
+                    os.remove(filepath)
+                    logger.info(f"Cleanup: Deleted old file '{filepath}'")
+                    cleaned_count += 1
+            except FileNotFoundError:
+                logger.warning(f"Cleanup: File '{filepath}' not found during deletion attempt. Skipping.")
+            except OSError as e:
+                logger.error(f"Cleanup: Error deleting file '{filepath}': {e}")
 
     logger.info(f"Cleanup task finished. Deleted {cleaned_count} old files.")
     return f"Cleaned up {cleaned_count} files older than {max_age_days_int} days."
+
+def _cleanup_by_listing(store, cutoff):
+    """Deletes blobs older than cutoff by listing every file (used without the file registry)."""
+    cache_owned = set()
+    if result_cache.is_enabled():
+        try:
+            cache_owned = {processed_key(name) for name in result_cache.referenced_filenames()}
+        except Exception as e:
+            logger.error(f"Cleanup: Could not read the result cache's files: {e}", exc_info=True)
+
+    cleaned_count = 0
+    for namespace in [UPLOADS, PROCESSED]:
+        try:
+            for blob in store.list(namespace):
+                if blob.key in cache_owned or blob.mtime >= cutoff:
+                    continue
+                try:
+                    store.delete(blob.key)
+                    logger.info(f"Cleanup: Deleted old file '{blob.key}'")
+                    cleaned_count += 1
+                except Exception as e:
+                    logger.error(f"Cleanup: Error deleting file '{blob.key}': {e}")
+        except Exception as e:
+             logger.error(f"Cleanup: Error listing files in '{namespace}': {e}", exc_info=True)
+    return cleaned_count
+
+@shared_task(name='app.tasks.reconcile_file_registry_task')
+def reconcile_file_registry_task():
+    """
+    Celery Beat task that indexes files the registry does not know about (written while
+    Redis was unavailable, or before the registry was enabled) and drops stale entries.
+    """
+    if not file_registry.is_enabled():
+        return
+    registered, dropped = file_registry.reconcile()
+    return {'registered': registered, 'dropped': dropped}
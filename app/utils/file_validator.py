@@ -1,32 +1,54 @@
 import magic
 import os
+import json
+import time
+import shutil
+import struct
+import subprocess
+from functools import lru_cache
 from flask import current_app # Use current_app to access config
+from ..services import metrics
 
-def is_allowed_file(filename, file_stream):
+# One libmagic handle per process: opening it loads the magic database. python-magic
+# serializes calls on a handle with its own lock, so request threads can share it.
+_detectors = {}
+
+def get_mime_detector():
+    if 'mime' not in _detectors:
+        _detectors['mime'] = magic.Magic(mime=True)
+    return _detectors['mime']
+
+def is_allowed_file(filename, file_stream, header=None):
     """
     Checks if the file extension and MIME type are allowed.
-    file_stream should be the raw file stream (e.g., request.files['file'].stream)
+    file_stream should be the raw file stream (e.g., request.files['file'].stream).
+    header, if given, holds the first bytes of the file (already captured while it was
+    being written) and file_stream is not read.
     """
     config = current_app.config # Access config through current_app proxy
 
     # 1. Check extension
     if not ('.' in filename and filename.rsplit('.', 1)[1].lower() in config['ALLOWED_EXTENSIONS']):
         current_app.logger.warning(f"File validation failed: Disallowed extension for {filename}")
+        metrics.count_rejected_upload('extension')
         return False, "File extension not allowed."
 
     # 2. Check MIME type using python-magic
     try:
         # Read a small portion of the file to determine MIME type
         # Ensure the stream is at the beginning
-        file_stream.seek(0)
-        file_header = file_stream.read(2048) # Read first 2KB
-        file_stream.seek(0) # Reset stream position for further processing (like saving)
+        if header is not None:
+            file_header = header[:2048]
+        else:
+            file_stream.seek(0)
+            file_header = file_stream.read(2048) # Read first 2KB
+            file_stream.seek(0) # Reset stream position for further processing (like saving)
 
-        mime_detector = magic.Magic(mime=True)
-        actual_mime_type = mime_detector.from_buffer(file_header)
+        actual_mime_type = get_mime_detector().from_buffer(file_header)
 
         if actual_mime_type not in config['ALLOWED_MIME_TYPES']:
             current_app.logger.warning(f"File validation failed: Disallowed MIME type {actual_mime_type} for {filename}")
+            metrics.count_rejected_upload('mime_type')
             return False, f"File content type ({actual_mime_type}) not allowed."
         
         current_app.logger.info(f"File validation success for {filename}, MIME: {actual_mime_type}")
@@ -34,4 +56,248 @@ def is_allowed_file(filename, file_stream):
 
     except Exception as e:
         current_app.logger.error(f"Error during MIME type detection for {filename}: {e}", exc_info=True)
-        return False, "Could not verify file content type."
\ No newline at end of file
+        metrics.count_rejected_upload('unverified')
+        return False, "Could not verify file content type."
+
+# --- Header-only metadata probe ---
+# WAV, FLAC and Ogg (Vorbis/Opus/FLAC) headers are parsed here, reading a few hundred
+# bytes (plus the last Ogg page for its duration); other formats go to ffprobe.
+# The result has the same keys as streaming.probe_audio (which uses ffprobe_metadata), so the
+# worker can use it as is.
+
+OGG_TAIL_BYTES = 64 * 1024
+FFPROBE_TIMEOUT_SECONDS = 10
+
+def _metadata(duration, channels, sample_rate, bits):
+    if not channels or not sample_rate:
+        raise ValueError("Header declares no channels or no sample rate.")
+    return {
+        'duration': duration,
+        'channels': int(channels),
+        'sample_rate': int(sample_rate),
+        'sample_width': 2 if bits <= 16 else 4,
+    }
+
+def _file_size(f):
+    position = f.tell()
+    size = f.seek(0, os.SEEK_END)
+    f.seek(position)
+    return size
+
+def _probe_wav(f):
+    riff = f.read(12)
+    if len(riff) < 12 or riff[:4] not in (b'RIFF', b'RF64') or riff[8:12] != b'WAVE':
+        raise ValueError("Not a RIFF/WAVE file.")
+    fmt = None
+    ds64_data_size = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            raise ValueError("WAV file has no data chunk.")
+        chunk_id, chunk_size = chunk[:4], struct.unpack('<I', chunk[4:])[0]
+        if chunk_id == b'fmt ':
+            body = f.read(chunk_size)
+            if len(body) < 16:
+                raise ValueError("WAV fmt chunk is truncated.")
+            fmt = struct.unpack('<HHIIHH', body[:16])
+            f.seek(chunk_size % 2, os.SEEK_CUR)
+        elif chunk_id == b'ds64':
+            body = f.read(chunk_size)
+            ds64_data_size = struct.unpack('<Q', body[8:16])[0] if len(body) >= 16 else None
+            f.seek(chunk_size % 2, os.SEEK_CUR)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ValueError("WAV data chunk precedes the fmt chunk.")
+            _, channels, sample_rate, _, block_align, bits = fmt
+            if not block_align:
+                raise ValueError("WAV header declares a zero block size.")
+            available = _file_size(f) - f.tell()
+            data_size = ds64_data_size if chunk_size == 0xFFFFFFFF and ds64_data_size else chunk_size
+            # Streamed WAV writers leave the size at 0 or 0xFFFFFFFF; the data then runs to the end of the file.
+            if data_size in (0, 0xFFFFFFFF) or data_size > available:
+                data_size = available
+            duration = data_size // block_align / float(sample_rate) if sample_rate else 0.0
+            return _metadata(duration, channels, sample_rate, bits)
+        else:
+            f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+def _parse_streaminfo(block):
+    """(channels, sample_rate, bits, total_samples) from a 34-byte FLAC STREAMINFO block."""
+    if len(block) < 18:
+        raise ValueError("FLAC STREAMINFO block is truncated.")
+    packed = int.from_bytes(block[10:18], 'big')
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    bits = ((packed >> 36) & 0x1F) + 1
+    total_samples = packed & 0xFFFFFFFFF
+    return channels, sample_rate, bits, total_samples
+
+def _probe_flac(f):
+    head = f.read(10)
+    if head[:3] == b'ID3' and len(head) == 10:
+        # ID3v2 tag in front of the stream (size is syncsafe, header and optional footer excluded).
+        tag_size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+        f.seek(10 + tag_size + (10 if head[5] & 0x10 else 0))
+    else:
+        f.seek(0)
+    if f.read(4) != b'fLaC':
+        raise ValueError("Not a FLAC file.")
+    block_header = f.read(4)
+    if len(block_header) < 4 or block_header[0] & 0x7F != 0:
+        raise ValueError("FLAC file does not start with a STREAMINFO block.")
+    channels, sample_rate, bits, total_samples = _parse_streaminfo(f.read(34))
+    duration = total_samples / float(sample_rate) if total_samples and sample_rate else None
+    return _metadata(duration, channels, sample_rate, bits)
+
+def _last_ogg_granule(f):
+    size = _file_size(f)
+    f.seek(max(0, size - OGG_TAIL_BYTES))
+    tail = f.read(OGG_TAIL_BYTES)
+    position = tail.rfind(b'OggS')
+    while position != -1:
+        if position + 14 <= len(tail):
+            granule = struct.unpack('<q', tail[position + 6:position + 14])[0]
+            if granule >= 0:
+                return granule
+        position = tail.rfind(b'OggS', 0, position)
+    return None
+
+def _probe_ogg(f):
+    page = f.read(27)
+    if len(page) < 27 or page[:4] != b'OggS':
+        raise ValueError("Not an Ogg file.")
+    segments = f.read(page[26])
+    packet = f.read(sum(segments))
+    if packet[:7] == b'\x01vorbis' and len(packet) >= 16:
+        channels = packet[11]
+        sample_rate = struct.unpack('<I', packet[12:16])[0]
+        granule_rate, pre_skip = sample_rate, 0
+    elif packet[:8] == b'OpusHead' and len(packet) >= 12:
+        # Opus always decodes at 48 kHz; the granule position counts 48 kHz samples.
+        channels = packet[9]
+        sample_rate = granule_rate = 48000
+        pre_skip = struct.unpack('<H', packet[10:12])[0]
+    elif packet[:5] == b'\x7fFLAC' and packet[9:13] == b'fLaC':
+        channels, sample_rate, bits, _ = _parse_streaminfo(packet[17:51])
+        granule_rate, pre_skip = sample_rate, 0
+        granule = _last_ogg_granule(f)
+        duration = granule / float(granule_rate) if granule and granule_rate else None
+        return _metadata(duration, channels, sample_rate, bits)
+    else:
+        raise ValueError("Ogg stream is not Vorbis, Opus or FLAC.")
+    granule = _last_ogg_granule(f)
+    duration = max(0, granule - pre_skip) / float(granule_rate) if granule and granule_rate else None
+    return _metadata(duration, channels, sample_rate, 16)
+
+NATIVE_PROBES = {'wav': _probe_wav, 'flac': _probe_flac, 'ogg': _probe_ogg}
+
+@lru_cache(maxsize=None)
+def ffprobe_path():
+    """Path of the ffprobe (or avprobe) binary, looked up once per process; None if not installed."""
+    return shutil.which('ffprobe') or shutil.which('avprobe')
+
+def ffprobe_metadata(path):
+    """Metadata from ffprobe (reads the container header); None if ffprobe is not installed."""
+    prober = ffprobe_path()
+    if not prober:
+        return None
+    result = subprocess.run(
+        [prober, '-v', 'error', '-select_streams', 'a:0', '-of', 'json',
+         '-show_entries', 'stream=channels,sample_rate,bits_per_sample,bits_per_raw_sample,duration:format=duration', path],
+        capture_output=True, timeout=FFPROBE_TIMEOUT_SECONDS
+    )
+    info = json.loads(result.stdout or b'{}') if result.returncode == 0 else {}
+    streams = info.get('streams') or []
+    if not streams:
+        raise ValueError("No audio stream found.")
+    stream = streams[0]
+    duration = stream.get('duration') or info.get('format', {}).get('duration')
+    bits = int(stream.get('bits_per_sample') or stream.get('bits_per_raw_sample') or 16)
+    return _metadata(float(duration) if duration else None, stream.get('channels'), int(stream.get('sample_rate') or 0), bits)
+
+def probe_metadata(filename, path=None, stream=None):
+    """
+    Reads duration, channels, sample rate and sample width from the header of the
+    upload at path (or in the seekable stream, left at position 0).
+    Returns a dict (duration is None if the header does not say), or None if the
+    format needs ffprobe and ffprobe (or a path) is not available.
+    Raises ValueError if the header cannot be parsed.
+    """
+    ext = filename.rsplit('.', 1)[-1].lower()
+    probe = NATIVE_PROBES.get(ext)
+    metadata = None
+    if probe:
+        try:
+            if path:
+                with open(path, 'rb') as f:
+                    metadata = probe(f)
+            elif stream is not None:
+                stream.seek(0)
+                metadata = probe(stream)
+        except (struct.error, IndexError) as e:
+            raise ValueError(f"Truncated header: {e}")
+        finally:
+            if stream is not None:
+                stream.seek(0)
+        if metadata is None or metadata['duration'] is not None:
+            return metadata
+    if path:
+        try:
+            return ffprobe_metadata(path) or metadata
+        except (subprocess.SubprocessError, json.JSONDecodeError) as e:
+            raise ValueError(f"ffprobe failed: {e}")
+    return metadata
+
+def audio_limits_error(metadata):
+    """
+    Checks metadata against the AUDIO_* limits. Returns (reason, message) for the first
+    limit exceeded (reason is the rejected-upload metric label), or None. An unknown
+    duration passes.
+    """
+    config = current_app.config
+    max_duration = config.get('AUDIO_MAX_DURATION_SECONDS')
+    if max_duration and metadata['duration'] and metadata['duration'] > max_duration:
+        return 'duration', f"Audio is too long ({metadata['duration']:.0f}s; the limit is {max_duration}s)."
+    min_rate, max_rate = config.get('AUDIO_MIN_SAMPLE_RATE'), config.get('AUDIO_MAX_SAMPLE_RATE')
+    if (min_rate and metadata['sample_rate'] < min_rate) or (max_rate and metadata['sample_rate'] > max_rate):
+        return 'sample_rate', f"Sample rate {metadata['sample_rate']} Hz is not supported ({min_rate}-{max_rate} Hz)."
+    max_channels = config.get('AUDIO_MAX_CHANNELS')
+    if max_channels and metadata['channels'] > max_channels:
+        return 'channels', f"Too many channels ({metadata['channels']}; the limit is {max_channels})."
+    return None
+
+def enforce_audio_limits(metadata):
+    """Worker-side check of the AUDIO_* limits on decoded or probed metadata. Raises ValueError if one is exceeded."""
+    error = audio_limits_error(metadata)
+    if error:
+        metrics.count_rejected_upload(error[0])
+        raise ValueError(error[1])
+
+def check_audio_metadata(filename, path=None, stream=None):
+    """
+    Probes the upload's header and applies the AUDIO_* limits.
+    Returns (is_valid, message, metadata); metadata is None if it could not be read
+    without a full decode (the worker then probes or decodes the file and applies
+    the limits itself, see enforce_audio_limits).
+    """
+    started = time.perf_counter()
+    try:
+        metadata = probe_metadata(filename, path=path, stream=stream)
+    except ValueError as e:
+        current_app.logger.warning(f"File validation failed: unreadable audio header for {filename}: {e}")
+        metrics.count_rejected_upload('corrupt')
+        return False, "The file is not a readable audio file.", None
+    if metadata is None:
+        current_app.logger.info(f"No header probe for {filename}; the worker applies the limits once it has decoded the file.")
+        return True, "File is valid.", None
+
+    error = audio_limits_error(metadata)
+    if error:
+        metrics.count_rejected_upload(error[0])
+        return False, error[1], metadata
+
+    current_app.logger.info(f"Probed {filename} in {(time.perf_counter() - started) * 1000:.1f} ms: {metadata}")
+    if metadata['duration'] is None:
+        current_app.logger.info(f"No duration in the header of {filename}; the worker applies the duration limit once it has decoded the file.")
+        return True, "File is valid.", None
+    return True, "File is valid.", metadata
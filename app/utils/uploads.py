@@ -0,0 +1,195 @@
+"""
+Upload handling without extra copies.
+
+StreamingUploadRequest is installed as the app's request class. Werkzeug writes
+each multipart file part into its stream factory while it parses the body; with
+this class, a part whose extension is allowed is written straight to its final
+path in UPLOAD_FOLDER. The part is SHA-256 hashed and its first bytes are kept
+for MIME sniffing while it is written, so the route needs no file.save() and no
+second read. Files a route does not claim are removed when the request ends.
+
+Large files can also be sent in pieces (resumable uploads). A session is a
+<id>.part file plus a <id>.json sidecar in UPLOAD_PARTIAL_FOLDER. Chunks are
+appended at the current offset, so an interrupted client asks for the offset
+and continues from there. Each chunk is a short request, so no sync worker is
+held for the whole transfer. A chunk is written under an exclusive lock on the
+.part file, so a retried or duplicated PUT cannot append the same range twice.
+"""
+import os
+import json
+import time
+import fcntl
+import uuid
+import hashlib
+import shutil
+from flask import current_app, g
+from flask.wrappers import Request
+from werkzeug.utils import secure_filename
+
+HEADER_BYTES = 2048 # Bytes kept for MIME sniffing (what is_allowed_file reads)
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def allowed_extension(filename):
+    filename = secure_filename(filename or '')
+    if '.' not in filename:
+        return None
+    ext = filename.rsplit('.', 1)[1].lower()
+    return ext if ext in current_app.config['ALLOWED_EXTENSIONS'] else None
+
+
+class StreamedUploadFile:
+    """
+    Writable/readable file at its final upload path that hashes and keeps the
+    header of everything written to it. Call claim() to take ownership of the file.
+    """
+    def __init__(self, folder, ext):
+        self.unique_id = uuid.uuid4().hex
+        self.path = os.path.join(folder, f"{self.unique_id}_input.{ext}")
+        self.header = b''
+        self.size = 0
+        self.claimed = False
+        self._sha256 = hashlib.sha256()
+        self._file = open(self.path, 'w+b')
+
+    def write(self, data):
+        if len(self.header) < HEADER_BYTES:
+            self.header += bytes(data[:HEADER_BYTES - len(self.header)])
+        self._sha256.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def readline(self, *args):
+        return self._file.readline(*args)
+
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def claim(self):
+        """Closes the file and returns its path; it is no longer removed at the end of the request."""
+        self.close()
+        self.claimed = True
+        return self.path
+
+    def discard(self):
+        self.close()
+        if not self.claimed and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class StreamingUploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        ext = allowed_extension(filename)
+        if ext is None:
+            # Rejected by validation anyway; let Werkzeug spool it as usual.
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        stream = StreamedUploadFile(current_app.config['UPLOAD_FOLDER'], ext)
+        g.setdefault('streamed_uploads', []).append(stream)
+        return stream
+
+def discard_unclaimed_uploads(exc=None):
+    """teardown_request handler: deletes streamed files no route claimed (rejected or failed uploads)."""
+    for stream in g.pop('streamed_uploads', []):
+        try:
+            stream.discard()
+        except OSError as e:
+            current_app.logger.error(f"Could not remove unclaimed upload '{stream.path}': {e}")
+
+
+# --- Resumable (chunked) uploads ---
+
+def _session_paths(upload_id):
+    folder = current_app.config['UPLOAD_PARTIAL_FOLDER']
+    return os.path.join(folder, f"{upload_id}.part"), os.path.join(folder, f"{upload_id}.json")
+
+def create_session(filename, size):
+    """Starts a resumable upload of `size` bytes. Returns the session dict."""
+    upload_id = uuid.uuid4().hex
+    part_path, meta_path = _session_paths(upload_id)
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    session = {'upload_id': upload_id, 'filename': secure_filename(filename), 'size': int(size), 'created': time.time()}
+    open(part_path, 'wb').close()
+    with open(meta_path, 'w') as f:
+        json.dump(session, f)
+    return session
+
+def load_session(upload_id):
+    """Session dict with the current 'offset', or None if the id is unknown."""
+    if not upload_id.isalnum():
+        return None
+    part_path, meta_path = _session_paths(upload_id)
+    try:
+        with open(meta_path) as f:
+            session = json.load(f)
+        session['offset'] = os.path.getsize(part_path)
+    except (FileNotFoundError, ValueError):
+        return None
+    return session
+
+def append_chunk(session, start, stream, length):
+    """
+    Appends `length` bytes from stream at offset `start`, which must equal the
+    current offset. Returns the new offset, or raises ValueError on an offset mismatch
+    or while another chunk of the same upload is being written.
+    """
+    if start + length > session['size']:
+        raise ValueError("Chunk extends past the declared upload size.")
+    part_path, _ = _session_paths(session['upload_id'])
+    written = 0
+    with open(part_path, 'ab') as f:
+        try:
+            # Not blocking: under gevent, waiting here would stall the worker (and the holder may be in it).
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise ValueError("Another chunk of this upload is being written.")
+        # Under the lock, the file size is the offset (session['offset'] may be stale).
+        session['offset'] = os.fstat(f.fileno()).st_size
+        if start != session['offset']:
+            raise ValueError(f"Chunk starts at {start}, expected {session['offset']}.")
+        while written < length:
+            data = stream.read(min(COPY_CHUNK_SIZE, length - written))
+            if not data:
+                break
+            f.write(data)
+            written += len(data)
+    session['offset'] = start + written
+    return session['offset']
+
+def read_header(session):
+    part_path, _ = _session_paths(session['upload_id'])
+    with open(part_path, 'rb') as f:
+        return f.read(HEADER_BYTES)
+
+def finish_session(session, ext):
+    """
+    Moves the completed file to its final upload path and hashes it.
+    Returns (unique_id, input_filepath, sha256 hex digest).
+    """
+    part_path, meta_path = _session_paths(session['upload_id'])
+    unique_id = session['upload_id']
+    input_filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], f"{unique_id}_input.{ext}")
+    digest = hashlib.sha256()
+    with open(part_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    shutil.move(part_path, input_filepath)
+    os.remove(meta_path)
+    return unique_id, input_filepath, digest.hexdigest()
+
+def abort_session(session):
+    for path in _session_paths(session['upload_id']):
+        if os.path.exists(path):
+            os.remove(path)
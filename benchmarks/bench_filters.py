@@ -0,0 +1,54 @@
+"""
+Benchmark: pydub's single-pole high/low-pass filters vs. the Butterworth SOS
+stages in app/services/dsp_engine.py.
+
+Run from the repository root:
+    python -m benchmarks.bench_filters --seconds 30 --orders 1 2 4
+"""
+import time
+import argparse
+import numpy as np
+from pydub.effects import high_pass_filter as pydub_high_pass
+from pydub.effects import low_pass_filter as pydub_low_pass
+
+from app.services import dsp_engine
+
+
+def _synthetic_stereo(seconds, frame_rate):
+    rng = np.random.default_rng(0)
+    return (0.25 * rng.standard_normal((2, int(seconds * frame_rate)))).astype(np.float32)
+
+def _best_of(repeats, func):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=10.0, help='Length of the synthetic input.')
+    parser.add_argument('--frame-rate', type=int, default=44100)
+    parser.add_argument('--orders', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--skip-pydub', action='store_true', help='Skip the (slow) pydub baseline.')
+    args = parser.parse_args()
+
+    samples = _synthetic_stereo(args.seconds, args.frame_rate)
+    segment = dsp_engine.array_to_segment(samples.copy(), args.frame_rate, 2)
+    print(f"Input: {args.seconds:.1f}s stereo @ {args.frame_rate} Hz")
+    print(f"{'filter':<10} {'implementation':<22} {'seconds':>9} {'x realtime':>11}")
+
+    for name, btype, cutoff, pydub_func in (('high-pass', 'high_pass_filter', 200, pydub_high_pass),
+                                           ('low-pass', 'low_pass_filter', 3000, pydub_low_pass)):
+        if not args.skip_pydub:
+            elapsed = _best_of(1, lambda: pydub_func(segment, cutoff))
+            print(f"{name:<10} {'pydub (1st order)':<22} {elapsed:>9.3f} {args.seconds / elapsed:>11.1f}")
+        for order in args.orders:
+            config = {'name': btype, 'cutoff_hz': cutoff, 'order': order}
+            elapsed = _best_of(args.repeats, lambda: dsp_engine.apply_effect(samples.copy(), args.frame_rate, config))
+            print(f"{name:<10} {f'sosfilt (order {order})':<22} {elapsed:>9.3f} {args.seconds / elapsed:>11.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""
+Benchmark suite: the pydub reference helpers (pydub_reference.py), the NumPy engine effects,
+full apply_audio_effects_core chains (in-memory and streaming) and every export
+format under every encoder profile, on synthetic fixtures.
+
+Each case records the best wall time over --repeats runs, the throughput
+(audio seconds processed per wall second) and the peak RSS of the process during
+the case (exact on Linux, where the peak is reset before each case; elsewhere the
+process-lifetime peak). Results are written as JSON; with --baseline, cases whose
+throughput dropped by more than --tolerance are flagged and the exit status is 1.
+
+Run from the repository root:
+    python -m benchmarks.bench_suite --output bench.json
+    python -m benchmarks.bench_suite --preset full --output new.json --baseline bench.json
+    python -m benchmarks.bench_suite --groups chain export --durations 60 --channels 2
+"""
+import os
+import sys
+import json
+import time
+import wave
+import shutil
+import argparse
+import platform
+import tempfile
+import numpy as np
+import scipy
+from pydub import AudioSegment
+
+from app.services import audio_processor, dsp_engine, streaming, chain_planner, encoders
+from benchmarks import pydub_reference
+from app.services.metrics import reset_peak_rss, peak_rss_bytes
+
+PRESETS = {
+    'quick': {'durations': [10], 'kinds': ['sine', 'noise'], 'channels': [1, 2], 'rates': [44100]},
+    'full': {'durations': [10, 60, 600, 3600], 'kinds': ['sine', 'noise'], 'channels': [1, 2], 'rates': [44100, 48000]},
+}
+GROUPS = ('helper', 'engine', 'chain', 'export')
+EXPORT_FORMATS = ('wav', 'mp3', 'm4a', 'ogg', 'flac')
+
+# (helper name, keyword arguments) for the pydub reference helpers in pydub_reference.py
+HELPER_CASES = (
+    ('apply_gain', {'gain_db': -6}),
+    ('apply_high_pass_filter', {'cutoff_hz': 200}),
+    ('apply_low_pass_filter', {'cutoff_hz': 3000}),
+    ('apply_speed_pitch', {'factor': 1.25}),
+    ('apply_echo', {'delay_ms': 250, 'decay_factor': 0.5}),
+    ('apply_reverb_simple', {'wet_level': 0.3, 'room_size': 0.5}),
+)
+ENGINE_CASES = (
+    {'name': 'gain', 'gain_db': -6},
+    {'name': 'high_pass_filter', 'cutoff_hz': 200},
+    {'name': 'low_pass_filter', 'cutoff_hz': 3000},
+    {'name': 'speed_pitch', 'factor': 1.25},
+    {'name': 'echo', 'delay_ms': 250, 'decay_factor': 0.5},
+    {'name': 'reverb', 'wet_level': 0.3, 'room_size': 0.5},
+)
+CHAINS = {
+    'gain': [{'name': 'gain', 'gain_db': -3}],
+    'band_pass': [{'name': 'high_pass_filter', 'cutoff_hz': 300}, {'name': 'low_pass_filter', 'cutoff_hz': 3400}],
+    'lofi_radio': [{'name': 'high_pass_filter', 'cutoff_hz': 300}, {'name': 'low_pass_filter', 'cutoff_hz': 3400},
+                   {'name': 'gain', 'gain_db': -3}, {'name': 'echo', 'delay_ms': 120, 'decay_factor': 0.3}],
+    'cathedral': [{'name': 'reverb', 'wet_level': 0.5, 'room_size': 0.9}, {'name': 'echo', 'delay_ms': 400, 'decay_factor': 0.4}],
+    'chipmunk': [{'name': 'speed_pitch', 'factor': 1.5}, {'name': 'gain', 'gain_db': 2}],
+}
+
+
+# --- Fixtures ---
+
+def fixture_name(kind, channels, rate, seconds):
+    return f"{kind}-{channels}ch-{rate}hz-{seconds}s"
+
+def write_fixture(path, kind, channels, rate, seconds, chunk_seconds=60):
+    """Writes a deterministic 16-bit WAV fixture in chunks (a 60 min file never sits in memory at once)."""
+    rng = np.random.default_rng(0)
+    frequencies = 220.0 * (1 + np.arange(channels)) # One tone per channel
+    total = int(seconds * rate)
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        for start in range(0, total, chunk_seconds * rate):
+            count = min(chunk_seconds * rate, total - start)
+            if kind == 'sine':
+                t = (start + np.arange(count)) / float(rate)
+                block = 0.5 * np.sin(2 * np.pi * frequencies[:, None] * t)
+            else:
+                block = np.clip(0.25 * rng.standard_normal((channels, count)), -1.0, 1.0)
+            wav.writeframes((block.T * 32767).astype('<i2').tobytes())
+
+def ensure_fixtures(folder, args):
+    """Creates the missing fixtures of the selected matrix. Returns [(name, path, info)]."""
+    os.makedirs(folder, exist_ok=True)
+    fixtures = []
+    for seconds in args.durations:
+        for kind in args.kinds:
+            for channels in args.channels:
+                for rate in args.rates:
+                    name = fixture_name(kind, channels, rate, seconds)
+                    path = os.path.join(folder, f"{name}.wav")
+                    if not os.path.exists(path):
+                        print(f"Generating fixture {name}...", file=sys.stderr)
+                        write_fixture(path, kind, channels, rate, seconds)
+                    info = {'channels': channels, 'sample_rate': rate, 'duration': float(seconds), 'sample_width': 2}
+                    fixtures.append((name, path, info))
+    return fixtures
+
+
+# --- Measurement ---
+
+def _current_rss_bytes():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def measure(func, repeats, setup=None):
+    """
+    Runs func(setup()) `repeats` times (setup is not timed).
+    Returns (best wall seconds, peak RSS bytes, peak RSS growth over the start, peak_exact).
+    """
+    rss_before = _current_rss_bytes()
+    exact = reset_peak_rss()
+    best = float('inf')
+    for _ in range(repeats):
+        argument = setup() if setup else None
+        start = time.perf_counter()
+        func(argument)
+        best = min(best, time.perf_counter() - start)
+        del argument
+    peak = peak_rss_bytes()
+    growth = peak - rss_before if exact and rss_before is not None else None
+    return best, peak, growth, exact
+
+def _result(group, name, fixture, info, measured):
+    wall, peak, growth, exact = measured
+    return {
+        'id': f"{group}:{name}:{fixture}",
+        'group': group,
+        'name': name,
+        'fixture': fixture,
+        'audio_seconds': info['duration'],
+        'wall_seconds': round(wall, 6),
+        'throughput': round(info['duration'] / wall, 3) if wall > 0 else None,
+        'peak_rss_bytes': peak,
+        'peak_rss_growth_bytes': growth,
+        'peak_rss_exact': exact,
+    }
+
+
+# --- Cases ---
+
+def bench_helpers(fixture, path, info, args):
+    segment = AudioSegment.from_file(path)
+    for helper_name, kwargs in HELPER_CASES:
+        helper = getattr(pydub_reference, helper_name)
+        yield _result('helper', helper_name, fixture, info, measure(lambda _: helper(segment, **kwargs), args.repeats))
+
+def bench_engine(fixture, path, info, args):
+    samples, frame_rate, _ = dsp_engine.decode_file(path)
+    for config in ENGINE_CASES:
+        measured = measure(lambda buf: dsp_engine.apply_effect(buf, frame_rate, config), args.repeats, setup=samples.copy)
+        yield _result('engine', config['name'], fixture, info, measured)
+
+def bench_chains(fixture, path, info, args, out_folder):
+    output_path = os.path.join(out_folder, 'chain_output.wav')
+    for chain_name, chain in CHAINS.items():
+        def run_in_memory(_):
+            success, error = audio_processor.apply_audio_effects_core(path, output_path, 'wav', chain)
+            if not success:
+                raise RuntimeError(error)
+        yield _result('chain', f"{chain_name}/in_memory", fixture, info, measure(run_in_memory, args.repeats))
+        if chain_planner.compile_chain(chain).is_streamable:
+            run_streaming = lambda _: streaming.stream_audio_effects(path, output_path, 'wav', chain, audio_info=info)
+            yield _result('chain', f"{chain_name}/streaming", fixture, info, measure(run_streaming, args.repeats))
+
+def bench_exports(fixture, path, info, args, out_folder):
+    samples, frame_rate, sample_width = dsp_engine.decode_file(path)
+    channels = samples.shape[0]
+    for output_format in args.formats:
+        output_path = os.path.join(out_folder, f"export_output.{output_format}")
+        for profile in args.profiles:
+            def run(buf):
+                pcm = dsp_engine.array_to_pcm_bytes(buf, sample_width)
+                encoders.export_pcm(pcm, frame_rate, channels, sample_width, [(output_format, output_path)], profile=profile)
+            yield _result('export', f"{output_format}/{profile}", fixture, info, measure(run, args.repeats, setup=samples.copy))
+
+
+# --- Baseline comparison ---
+
+def compare(results, baseline, tolerance):
+    """Returns [(id, baseline throughput, new throughput, relative change)] for the cases that regressed."""
+    previous = {r['id']: r for r in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        old = previous.get(result['id'])
+        if not old or not old.get('throughput') or not result.get('throughput'):
+            continue
+        change = result['throughput'] / old['throughput'] - 1.0
+        if change < -tolerance:
+            regressions.append((result['id'], old['throughput'], result['throughput'], change))
+    return regressions
+
+def environment():
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='quick', help='Fixture matrix (overridden per axis by the options below).')
+    parser.add_argument('--durations', type=int, nargs='+', help='Fixture lengths in seconds.')
+    parser.add_argument('--kinds', nargs='+', choices=['sine', 'noise'])
+    parser.add_argument('--channels', type=int, nargs='+', choices=[1, 2])
+    parser.add_argument('--rates', type=int, nargs='+', help='Sample rates, e.g. 44100 48000.')
+    parser.add_argument('--groups', nargs='+', choices=GROUPS, default=list(GROUPS))
+    parser.add_argument('--formats', nargs='+', choices=EXPORT_FORMATS, default=list(EXPORT_FORMATS))
+    parser.add_argument('--profiles', nargs='+', choices=list(encoders.ENCODER_PROFILES), default=list(encoders.ENCODER_PROFILES))
+    parser.add_argument('--helper-max-seconds', type=int, default=600,
+                        help='Skip the (slow, in-memory pydub) reference helpers on longer fixtures.')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--fixture-dir', default=os.path.join(tempfile.gettempdir(), 'ams_bench_fixtures'),
+                        help='Fixtures are generated once and reused from here.')
+    parser.add_argument('--output', help='Write the JSON results to this file (default: stdout).')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed relative throughput drop (default 0.10).')
+    args = parser.parse_args()
+    for axis, values in PRESETS[args.preset].items():
+        if getattr(args, axis) is None:
+            setattr(args, axis, values)
+
+    fixtures = ensure_fixtures(args.fixture_dir, args)
+    out_folder = tempfile.mkdtemp(prefix='ams_bench_')
+    results = []
+    try:
+        for fixture, path, info in fixtures:
+            cases = []
+            if 'helper' in args.groups and info['duration'] <= args.helper_max_seconds:
+                cases.append(bench_helpers(fixture, path, info, args))
+            if 'engine' in args.groups:
+                cases.append(bench_engine(fixture, path, info, args))
+            if 'chain' in args.groups:
+                cases.append(bench_chains(fixture, path, info, args, out_folder))
+            if 'export' in args.groups:
+                cases.append(bench_exports(fixture, path, info, args, out_folder))
+            for case_results in cases:
+                for result in case_results:
+                    results.append(result)
+                    print(f"{result['id']:<60} {result['wall_seconds']:>9.3f}s {result['throughput']:>9.1f}x "
+                          f"{result['peak_rss_bytes'] / 2 ** 20:>8.0f} MB", file=sys.stderr)
+    finally:
+        shutil.rmtree(out_folder, ignore_errors=True)
+
+    report = {'environment': environment(), 'repeats': args.repeats, 'results': results}
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        report['baseline'] = args.baseline
+        report['regressions'] = [{'id': case_id, 'baseline_throughput': old, 'throughput': new, 'change': round(change, 4)}
+                                 for case_id, old, new, change in regressions]
+        for case_id, old, new, change in regressions:
+            print(f"REGRESSION {case_id}: {old:.1f}x -> {new:.1f}x ({change:+.1%})", file=sys.stderr)
+        if not regressions:
+            print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}.", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
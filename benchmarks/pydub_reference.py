@@ -0,0 +1,153 @@
+"""
+Pydub reference implementations of the effects, as they were before the NumPy
+engine (app/services/dsp_engine.py). Kept for benchmarking (bench_suite's
+'helper' group, bench_filters) and for checking the engine against them.
+"""
+import math
+import logging
+from pydub import AudioSegment
+from pydub.effects import low_pass_filter as pydub_low_pass
+from pydub.effects import high_pass_filter as pydub_high_pass
+
+logger = logging.getLogger(__name__)
+
+
+def apply_gain(audio_segment, gain_db):
+    """Applies a gain change in dB."""
+    logger.info(f"Applying gain of {gain_db} dB.")
+    if not isinstance(gain_db, (int, float)):
+        logger.warning(f"Invalid gain_db type: {gain_db}. Must be a number. Skipping gain.")
+        return audio_segment
+    return audio_segment + float(gain_db)
+
+def apply_high_pass_filter(audio_segment, cutoff_hz):
+    """Applies a high-pass filter using Pydub's built-in."""
+    logger.info(f"Applying high-pass filter effect with cutoff {cutoff_hz} Hz.")
+    if not isinstance(cutoff_hz, (int, float)) or cutoff_hz <= 0:
+        logger.warning(f"Invalid high-pass cutoff frequency: {cutoff_hz}. Must be positive. Skipping filter.")
+        return audio_segment
+    # Pydub's high_pass_filter expects int
+    if cutoff_hz >= audio_segment.frame_rate / 2: # Check against Nyquist
+        logger.warning(f"High-pass cutoff {int(cutoff_hz)}Hz is too high for sample rate {audio_segment.frame_rate}Hz. Skipping filter.")
+        return audio_segment
+    return pydub_high_pass(audio_segment, int(cutoff_hz))
+
+def apply_low_pass_filter(audio_segment, cutoff_hz):
+    """Applies a low-pass filter using Pydub's built-in."""
+    logger.info(f"Applying low-pass filter with cutoff {cutoff_hz} Hz.")
+    if not isinstance(cutoff_hz, (int, float)) or cutoff_hz <= 0:
+        logger.warning(f"Invalid low-pass cutoff frequency: {cutoff_hz}. Must be positive. Skipping filter.")
+        return audio_segment
+    # Pydub's low_pass_filter expects int
+    if cutoff_hz >= audio_segment.frame_rate / 2: # Check against Nyquist
+        logger.warning(f"Low-pass cutoff {int(cutoff_hz)}Hz is too high for sample rate {audio_segment.frame_rate}Hz. Skipping filter.")
+        return audio_segment
+    return pydub_low_pass(audio_segment, int(cutoff_hz))
+
+def apply_speed_pitch(audio_segment, factor):
+    """Changes speed and pitch."""
+    logger.info(f"Applying speed/pitch change with factor {factor}.")
+    if not isinstance(factor, (int, float)):
+        logger.warning(f"Invalid speed factor type: {factor}. Must be a number. Skipping effect.")
+        return audio_segment
+    if factor == 1.0: 
+        logger.info("Speed factor is 1.0, no change applied.")
+        return audio_segment
+    if factor <= 0:
+        logger.warning(f"Speed factor must be positive. Value was {factor}. Skipping effect.")
+        return audio_segment
+    try:
+        # Pydub's speedup changes both speed and pitch.
+        return audio_segment.speedup(playback_speed=float(factor), chunk_size=150, crossfade=100)
+    except Exception as e:
+        logger.error(f"Error during Pydub speedup with factor {factor}: {e}", exc_info=True)
+        return audio_segment
+
+def apply_echo(audio_segment, delay_ms, decay_factor):
+    """Applies a simple echo."""
+    logger.info(f"Applying echo with delay {delay_ms}ms and decay {decay_factor}.")
+    if not isinstance(delay_ms, (int, float)) or delay_ms <= 0:
+        logger.warning(f"Invalid echo delay_ms: {delay_ms}. Skipping.")
+        return audio_segment
+    if not isinstance(decay_factor, (int, float)) or not (0 < decay_factor < 1): # Decay factor should be between 0 and 1 (exclusive of 0)
+        logger.warning(f"Invalid echo decay_factor: {decay_factor}. Must be between 0 (exclusive) and 1 (exclusive). Skipping.")
+        return audio_segment
+
+    output_audio = audio_segment
+    if len(audio_segment) > 0:
+        # dB = 20 * log10(amplitude_ratio)
+        db_reduction = 20 * math.log10(decay_factor) # Use math.log10
+        
+        delay_segment = AudioSegment.silent(duration=int(delay_ms), frame_rate=audio_segment.frame_rate)
+        echoed_sound = audio_segment + db_reduction # Attenuate the segment for the echo
+        
+        full_echo_segment = delay_segment + echoed_sound
+        output_audio = output_audio.overlay(full_echo_segment)
+    else:
+        logger.warning("Cannot apply echo to empty audio segment.")
+    return output_audio
+
+def apply_reverb_simple(audio_segment, wet_level=0.3, room_size=0.5):
+    """
+    Applies a very simple algorithmic reverb by mixing multiple delayed, attenuated copies.
+    This is a basic reverb and won't sound like professional studio reverb.
+    wet_level: How much of the reverberated signal to mix (0.0 to 1.0).
+    room_size: Affects delay times and decay (0.0 to 1.0).
+    """
+    logger.info(f"Applying simple reverb with wet_level: {wet_level}, room_size: {room_size}")
+    if not (0 <= wet_level <= 1 and 0 <= room_size <= 1):
+        logger.warning("Invalid reverb parameters (wet_level/room_size out of 0-1 range). Skipping effect.")
+        return audio_segment
+    if wet_level == 0:
+        logger.info("Reverb wet_level is 0. Skipping reverb effect.")
+        return audio_segment
+    if len(audio_segment) == 0:
+        logger.warning("Cannot apply reverb to empty audio segment.")
+        return audio_segment
+
+    dry_signal = audio_segment
+    # Initialize wet_signal as silent, with the same duration as the dry signal
+    # This ensures overlay works correctly if dry_signal is shorter than some echos.
+    wet_signal = AudioSegment.silent(duration=len(dry_signal), frame_rate=dry_signal.frame_rate)
+
+    # Define some delay taps based on room_size (these are just examples)
+    # These delays are short and aim for a dense early reflection feel + some tail
+    base_delays_ms = [23, 37, 53, 71, 97, 131, 173, 223] # Prime-ish numbers often used
+    delays = [int(d * (0.5 + room_size * 1.5)) for d in base_delays_ms] # Scale delays
+    
+    # Define decay for each tap (more decay for longer delays, influenced by room_size)
+    base_decays = [0.7, 0.65, 0.6, 0.55, 0.5, 0.45, 0.4, 0.35]
+    decays = [d * (1.0 - room_size * 0.5) for d in base_decays] # Larger room_size = slower decay (less attenuation)
+
+    for i in range(len(delays)):
+        delay_ms = delays[i]
+        decay_factor = max(0.01, decays[i]) # Ensure decay_factor is not zero for log
+
+        if delay_ms > 0:
+            # Create echo tap: silence for delay, then the attenuated original sound
+            attenuated_tap_sound = dry_signal + (20 * math.log10(decay_factor))
+            echo_tap = AudioSegment.silent(duration=delay_ms, frame_rate=dry_signal.frame_rate) + attenuated_tap_sound
+            
+            # Mix this tap into the wet_signal. Overlay will extend wet_signal if needed.
+            wet_signal = wet_signal.overlay(echo_tap)
+
+    if len(wet_signal) == 0: return dry_signal
+
+    # Mix dry and wet signals based on wet_level
+    # A simple approach: scale dry by (1-wet_level) and wet by wet_level, then combine.
+    # Pydub handles gain in dB.
+    # Dry part: gain based on (1 - wet_level)
+    # Wet part: gain based on wet_level
+    
+    # To avoid issues with log(0), add a small epsilon if wet_level is 0 or 1
+    # However, if wet_level is 0, we returned early. If 1, dry_gain_db would be -infinity.
+    
+    dry_gain_db = -120.0 # Effectively silent if wet_level is 1.0
+    if wet_level < 1.0:
+        dry_gain_db = 20 * math.log10(1.0 - wet_level + 1e-6) # Add epsilon
+
+    wet_gain_db = 20 * math.log10(wet_level + 1e-6)
+
+    mixed_audio = (dry_signal + dry_gain_db).overlay(wet_signal + wet_gain_db)
+    
+    return mixed_audio
@@ -0,0 +1,208 @@
+"""
+Load test: concurrent slow uploads against the web app under gunicorn, per worker class.
+
+For each worker class (sync, gevent) a gunicorn server is started with
+gunicorn.conf.py and the same number of worker processes. --clients uploaders then
+each POST a WAV of --size-mb to /upload, throttled to --rate-kbps (a slow link),
+while a prober polls /status. Reported per worker class: how long the whole wave
+took, how many uploads were served concurrently (upload responses received within
+the time of one upload), upload latency, /status latency and failures.
+
+The server runs with an in-memory Celery broker and without the Redis-backed
+caches, so the test needs no Redis and measures ingestion only: the dispatched
+tasks are never consumed.
+
+Run from the repository root (needs gunicorn, and gevent for the async run):
+    python -m benchmarks.upload_load --clients 32 --size-mb 2 --rate-kbps 512 --workers 2
+"""
+import io
+import os
+import sys
+import json
+import time
+import wave
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+import statistics
+import uuid
+
+WORKER_CLASSES = ('sync', 'gevent')
+BOUNDARY = 'ams-load-test-boundary'
+SEND_BUFFER_BYTES = 32 * 1024
+
+
+def _wav_bytes(size_bytes, frame_rate=44100):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(frame_rate)
+        w.writeframes(b'\x00' * (max(4, size_bytes - 44) // 4 * 4))
+    return buffer.getvalue()
+
+def _multipart_body(wav):
+    effects_chain = json.dumps([{'name': 'gain', 'gain_db': -3}])
+    head = (
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"output_format\"\r\n\r\nmp3\r\n"
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"effects_chain\"\r\n\r\n{effects_chain}\r\n"
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"load.wav\"\r\n"
+        f"Content-Type: audio/wav\r\n\r\n"
+    ).encode()
+    return head + wav + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _start_server(worker_class, workers, port, scratch):
+    env = dict(os.environ,
+               WEB_WORKER_CLASS=worker_class, WEB_WORKERS=str(workers), WEB_BIND=f"127.0.0.1:{port}",
+               UPLOAD_FOLDER_REL=os.path.join(scratch, 'uploads'), PROCESSED_FOLDER_REL=os.path.join(scratch, 'processed'),
+               CELERY_BROKER_URL='memory://', CELERY_RESULT_BACKEND='cache+memory://',
+               RESULT_CACHE_ENABLED='False', STAGE_CACHE_ENABLED='False', FILE_REGISTRY_ENABLED='False',
+               TASK_ROUTING_ENABLED='False', METRICS_ENABLED='False')
+    log = open(os.path.join(scratch, f"gunicorn_{worker_class}.log"), 'wb')
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'], env=env, stdout=log, stderr=log)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            connection.request('GET', '/status/warmup')
+            connection.getresponse().read()
+            return server
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError(f"gunicorn exited, see {log.name}")
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"gunicorn did not start within 60 s, see {log.name}")
+
+def _upload(port, body, rate_bytes, chunk_bytes, timeout):
+    """Sends the body at rate_bytes per second. Returns (seconds, status)."""
+    started = time.monotonic()
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        connection.connect()
+        # Like a slow link, keep few bytes in flight: loopback buffers would otherwise take a
+        # whole upload before the server reads any of it.
+        connection.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_BYTES)
+        connection.putrequest('POST', '/upload')
+        connection.putheader('Content-Type', f"multipart/form-data; boundary={BOUNDARY}")
+        connection.putheader('Content-Length', str(len(body)))
+        connection.putheader('Accept', 'application/json')
+        connection.endheaders()
+        next_send = time.monotonic()
+        for offset in range(0, len(body), chunk_bytes):
+            connection.send(body[offset:offset + chunk_bytes])
+            # Pace from whichever is later, the schedule or the end of a send() that blocked: a link
+            # cannot catch up on time the server spent not reading, so waiting is not banked.
+            next_send = max(next_send, time.monotonic()) + chunk_bytes / float(rate_bytes)
+            time.sleep(max(0, next_send - time.monotonic()))
+        response = connection.getresponse()
+        response.read()
+        return time.monotonic() - started, response.status
+    except OSError as e:
+        return time.monotonic() - started, f"error: {e.__class__.__name__}"
+    finally:
+        connection.close()
+
+def _probe_status(port, stop, latencies):
+    task_id = uuid.uuid4()
+    while not stop.is_set():
+        started = time.monotonic()
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            connection.request('GET', f"/status/{task_id}")
+            connection.getresponse().read()
+            connection.close()
+            latencies.append(time.monotonic() - started)
+        except OSError:
+            latencies.append(float('inf'))
+        stop.wait(0.2)
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else None
+
+def run_case(worker_class, args, body, scratch):
+    port = _free_port()
+    server = _start_server(worker_class, args.workers, port, scratch)
+    try:
+        rate_bytes = args.rate_kbps * 1024
+        results = [None] * args.clients
+        def client(i):
+            results[i] = _upload(port, body, rate_bytes, args.chunk_kb * 1024, args.timeout)
+        stop, status_latencies = threading.Event(), []
+        prober = threading.Thread(target=_probe_status, args=(port, stop, status_latencies))
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+        started = time.monotonic()
+        prober.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.monotonic() - started
+        stop.set()
+        prober.join()
+    finally:
+        server.terminate()
+        server.wait(30)
+
+    single = len(body) / float(rate_bytes)
+    seconds = [s for s, status in results if status == 202]
+    failures = [status for _, status in results if status != 202]
+    return {
+        'worker_class': worker_class,
+        'workers': args.workers,
+        'clients': args.clients,
+        'upload_bytes': len(body),
+        'single_upload_seconds': round(single, 2),
+        'wall_seconds': round(wall, 2),
+        'accepted': len(seconds),
+        'failed': len(failures),
+        'failures': sorted(set(map(str, failures))),
+        # Uploads answered within 1.5x the time one upload takes at the link rate: served concurrently.
+        'concurrent_uploads': sum(1 for s in seconds if s <= 1.5 * single),
+        'upload_p50_seconds': round(statistics.median(seconds), 2) if seconds else None,
+        'upload_max_seconds': round(max(seconds), 2) if seconds else None,
+        'status_p50_ms': round(_percentile(status_latencies, 0.5) * 1000, 1) if status_latencies else None,
+        'status_p95_ms': round(_percentile(status_latencies, 0.95) * 1000, 1) if status_latencies else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--worker-classes', nargs='+', choices=WORKER_CLASSES, default=list(WORKER_CLASSES))
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes (same for every class).')
+    parser.add_argument('--clients', type=int, default=32, help='Concurrent uploaders.')
+    parser.add_argument('--size-mb', type=float, default=2)
+    parser.add_argument('--rate-kbps', type=int, default=512, help='Upload rate per client, KiB/s.')
+    parser.add_argument('--chunk-kb', type=int, default=64)
+    parser.add_argument('--timeout', type=float, default=600, help='Client socket timeout in seconds.')
+    parser.add_argument('--output', help='Write the JSON results to this file (default: stdout).')
+    args = parser.parse_args()
+
+    body = _multipart_body(_wav_bytes(int(args.size_mb * 1024 * 1024)))
+    report = {'cases': []}
+    with tempfile.TemporaryDirectory(prefix='ams_upload_load_') as scratch:
+        for worker_class in args.worker_classes:
+            print(f"Running {args.clients} uploads against {args.workers} {worker_class} workers...", file=sys.stderr)
+            case = run_case(worker_class, args, body, scratch)
+            report['cases'].append(case)
+            print(f"{worker_class:<8} wall {case['wall_seconds']:>7.1f}s  accepted {case['accepted']:>4}/{case['clients']:<4} "
+                  f"concurrent {case['concurrent_uploads']:>4}  upload p50 {case['upload_p50_seconds']}s max {case['upload_max_seconds']}s  "
+                  f"/status p50 {case['status_p50_ms']} ms p95 {case['status_p95_ms']} ms", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
@@ -23,6 +23,14 @@ celery_app = flask_app.extensions["celery"]
 # Ensure your tasks.py file is imported somewhere or Celery's autodiscover_tasks is used.
 # celery_app.autodiscover_tasks(['app']) # if your tasks are in 'app.tasks' module
 
+# Effects tasks are routed by estimated cost (app/services/job_routing.py) to two queues.
+# Run one worker pool per queue so short interactive jobs never wait behind long ones:
+# CELERY_WORKER_PREFETCH_MULTIPLIER=4 celery -A celery_worker.celery_app worker -Q audio_short -c 4 -n short@%h -l INFO
+# CELERY_WORKER_PREFETCH_MULTIPLIER=1 celery -A celery_worker.celery_app worker -Q audio_long,celery -c 2 -O fair -n long@%h -l INFO
+# The long pool prefetches one task per process (-O fair), so a queued hour-long file
+# is not held by a busy process while another one is idle. The 'celery' queue carries
+# the cleanup and batch bookkeeping tasks. A worker started without -Q consumes all three queues.
+
 # The command to run will typically be:
 # celery -A celery_worker.celery_app worker -l INFO -B
 # The -B flag runs the beat scheduler embedded in the worker, useful for development.
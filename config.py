@@ -1,6 +1,7 @@
 import os
 from dotenv import load_dotenv
 from datetime import timedelta
+from kombu import Queue
 
 # Load environment variables from .env file
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -14,17 +15,44 @@ class Config:
     CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL') or 'redis://localhost:6379/0'
     CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND') or 'redis://localhost:6379/0'
     # CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True # For Celery 5+
+    # Set per worker pool (see celery_worker.py): e.g. 4 for the short-job pool, 1 for the long-job pool.
+    CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.environ.get('CELERY_WORKER_PREFETCH_MULTIPLIER', 4))
+    # Hard limit per task (the worker process is killed after it); 0 disables it.
+    CELERY_TASK_TIME_LIMIT = int(os.environ.get('CELERY_TASK_TIME_LIMIT', 60 * 60)) or None
 
     # File Paths
     UPLOAD_FOLDER = os.path.join(basedir, os.environ.get('UPLOAD_FOLDER_REL', 'uploads'))
     PROCESSED_FOLDER = os.path.join(basedir, os.environ.get('PROCESSED_FOLDER_REL', 'processed_audio'))
     
+    # Shared storage for uploads and results: 'local' (the folders above, single host or
+    # shared mount) or 's3' (any S3-compatible service; web and workers need no shared disk).
+    BLOB_STORE_BACKEND = os.environ.get('BLOB_STORE_BACKEND', 'local').lower()
+    S3_BUCKET = os.environ.get('S3_BUCKET')
+    S3_PREFIX = os.environ.get('S3_PREFIX', '')
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') # e.g. http://minio:9000
+    S3_REGION = os.environ.get('S3_REGION')
+    S3_ACCESS_KEY_ID = os.environ.get('S3_ACCESS_KEY_ID')
+    S3_SECRET_ACCESS_KEY = os.environ.get('S3_SECRET_ACCESS_KEY')
+    
+    # Download serving (/download, /play). To let the reverse proxy stream the bytes, set either
+    # DOWNLOAD_ACCEL_REDIRECT_PREFIX to an nginx 'internal' location serving the processed files
+    # (e.g. /protected/processed/, aliased to PROCESSED_FOLDER or proxied to the bucket), or
+    # DOWNLOAD_X_SENDFILE for Apache/lighttpd (local backend). The proxy then also handles Range
+    # and conditional requests, with its own ETags.
+    DOWNLOAD_ACCEL_REDIRECT_PREFIX = os.environ.get('DOWNLOAD_ACCEL_REDIRECT_PREFIX')
+    DOWNLOAD_X_SENDFILE = os.environ.get('DOWNLOAD_X_SENDFILE', 'False').lower() in ('true', '1', 't')
+    DOWNLOAD_CACHE_MAX_AGE_SECONDS = int(os.environ.get('DOWNLOAD_CACHE_MAX_AGE_SECONDS', 3600))
+
     # Logging
     LOG_FILE = os.path.join(basedir, os.environ.get('LOG_FILE_PATH', 'logs/app.log'))
     LOG_LEVEL = 'DEBUG' if FLASK_DEBUG else 'INFO'
 
     # File Upload Configuration
     MAX_CONTENT_LENGTH = 300 * 1024 * 1024  # 300 MB
+    # Resumable uploads: each chunk is one request (bounded by MAX_CONTENT_LENGTH), the whole file by this limit.
+    # Same as a single upload by default: the workers process either kind the same way.
+    UPLOAD_PARTIAL_FOLDER = os.path.join(UPLOAD_FOLDER, 'partial')
+    CHUNKED_UPLOAD_MAX_BYTES = int(os.environ.get('CHUNKED_UPLOAD_MAX_MB', MAX_CONTENT_LENGTH // (1024 * 1024))) * 1024 * 1024
     ALLOWED_EXTENSIONS = {'wav', 'mp3', 'm4a', 'ogg', 'flac'}
     ALLOWED_MIME_TYPES = {
         'audio/wav', 'audio/wave', 'audio/x-wav', 'audio/vnd.wave',
@@ -33,18 +61,114 @@ class Config:
         'audio/ogg',
         'audio/flac', 'audio/x-flac'
     }
+    # Limits checked against the file header before a task is queued (0 disables a limit).
+    AUDIO_MAX_DURATION_SECONDS = int(os.environ.get('AUDIO_MAX_DURATION_SECONDS', 6 * 60 * 60)) # 6 hours
+    AUDIO_MIN_SAMPLE_RATE = int(os.environ.get('AUDIO_MIN_SAMPLE_RATE', 8000))
+    AUDIO_MAX_SAMPLE_RATE = int(os.environ.get('AUDIO_MAX_SAMPLE_RATE', 192000))
+    AUDIO_MAX_CHANNELS = int(os.environ.get('AUDIO_MAX_CHANNELS', 8))
+
+    # Streaming (bounded-memory) processing for long inputs
+    STREAMING_MIN_DURATION_SECONDS = int(os.environ.get('STREAMING_MIN_DURATION_SECONDS', 20 * 60)) # 20 minutes
+    STREAMING_MIN_FILE_SIZE = int(os.environ.get('STREAMING_MIN_FILE_SIZE_MB', 100)) * 1024 * 1024
+    STREAMING_BLOCK_FRAMES = int(os.environ.get('STREAMING_BLOCK_FRAMES', 65536))
+
+    # Intra-file parallelism: block stages of one long input split across threads.
+    # Threads per job. Celery already runs one process per CPU by default, so 1 keeps a busy host at one
+    # DSP thread per core (NumPy/SciPy BLAS pools come on top). 0 = cpu_count // worker concurrency,
+    # for pools with fewer processes than cores (e.g. the long queue's -c 2, see celery_worker.py).
+    PARALLEL_WORKERS = int(os.environ.get('PARALLEL_WORKERS', 1))
+    PARALLEL_MIN_DURATION_SECONDS = int(os.environ.get('PARALLEL_MIN_DURATION_SECONDS', 5 * 60))
+
+    # Export encoder settings: a profile from encoders.ENCODER_PROFILES (fast, balanced, archival),
+    # selectable per request with the 'encoder_profile' form field. ENCODER_THREADS sets the
+    # encoders' ffmpeg thread count (unset = ffmpeg decides).
+    ENCODER_PROFILE = os.environ.get('ENCODER_PROFILE', 'balanced').lower()
+    ENCODER_THREADS = int(os.environ['ENCODER_THREADS']) if os.environ.get('ENCODER_THREADS') else None
+
+    # Synchronous previews (POST /preview): the chain on a short window, at a reduced sample rate.
+    PREVIEW_FOLDER = os.path.join(UPLOAD_FOLDER, 'preview')
+    PREVIEW_SAMPLE_RATE = int(os.environ.get('PREVIEW_SAMPLE_RATE', 22050)) # 0 = the input's own rate
+    PREVIEW_DEFAULT_SECONDS = float(os.environ.get('PREVIEW_DEFAULT_SECONDS', 10))
+    PREVIEW_MAX_SECONDS = float(os.environ.get('PREVIEW_MAX_SECONDS', 30))
+    # The pre-roll is the chain's memory (reverb tails reach 10 s); this only bounds chains with extreme echo delays.
+    PREVIEW_MAX_PREROLL_SECONDS = float(os.environ.get('PREVIEW_MAX_PREROLL_SECONDS', 30))
+    PREVIEW_SOURCE_TTL_SECONDS = int(os.environ.get('PREVIEW_SOURCE_TTL_MINUTES', 30)) * 60
+
+    # Queue routing by estimated job cost (see app/services/job_routing.py). Each queue needs its own workers.
+    TASK_ROUTING_ENABLED = os.environ.get('TASK_ROUTING_ENABLED', 'True').lower() in ('true', '1', 't')
+    TASK_QUEUE_SHORT = os.environ.get('TASK_QUEUE_SHORT', 'audio_short')
+    TASK_QUEUE_LONG = os.environ.get('TASK_QUEUE_LONG', 'audio_long')
+    TASK_ROUTING_SHORT_MAX_COST_SECONDS = float(os.environ.get('TASK_ROUTING_SHORT_MAX_COST_SECONDS', 10))
+    # A worker started without -Q consumes all of these.
+    CELERY_TASK_QUEUES = (Queue('celery'), Queue(TASK_QUEUE_SHORT), Queue(TASK_QUEUE_LONG))
+
+    # Result cache (upload digest + effects chain + output format -> processed file)
+    RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', 'True').lower() in ('true', '1', 't')
+    RESULT_CACHE_REDIS_URL = os.environ.get('RESULT_CACHE_REDIS_URL') or CELERY_RESULT_BACKEND
+    RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_MB', 2048)) * 1024 * 1024
+    RESULT_CACHE_MAX_AGE_DAYS = int(os.environ.get('RESULT_CACHE_MAX_AGE_DAYS', 7))
+    # An entry whose task is still PENDING/PROGRESS after this long is treated as lost (queue wait + time limit).
+    RESULT_CACHE_IN_FLIGHT_TIMEOUT_SECONDS = int(os.environ.get('RESULT_CACHE_IN_FLIGHT_TIMEOUT_SECONDS', 2 * 60 * 60))
+
+    # Intermediate-stage cache (decoded audio after each effect, keyed by input digest + chain prefix).
+    # Opt-in: every task then writes uncompressed buffers to disk; worth it when users re-run chain variations.
+    STAGE_CACHE_ENABLED = os.environ.get('STAGE_CACHE_ENABLED', 'False').lower() in ('true', '1', 't')
+    STAGE_CACHE_FOLDER = os.path.join(basedir, os.environ.get('STAGE_CACHE_FOLDER_REL', 'stage_cache'))
+    STAGE_CACHE_MEMORY_BYTES = int(os.environ.get('STAGE_CACHE_MEMORY_MB', 512)) * 1024 * 1024
+    STAGE_CACHE_DISK_BYTES = int(os.environ.get('STAGE_CACHE_DISK_MB', 4096)) * 1024 * 1024
+    STAGE_CACHE_MAX_ENTRY_BYTES = int(os.environ.get('STAGE_CACHE_MAX_ENTRY_MB', 256)) * 1024 * 1024
+
+    # Push-based progress (/events/<task_id>, Server-Sent Events over Redis pub/sub)
+    PROGRESS_REDIS_URL = os.environ.get('PROGRESS_REDIS_URL') or CELERY_RESULT_BACKEND
+    PROGRESS_MIN_INTERVAL_SECONDS = float(os.environ.get('PROGRESS_MIN_INTERVAL_SECONDS', 0.5))
+    # Smallest progress change worth a write: at most 100 / this PROGRESS writes per task.
+    PROGRESS_MIN_STEP_PERCENT = float(os.environ.get('PROGRESS_MIN_STEP_PERCENT', 2))
+    PROGRESS_STREAM_KEEPALIVE_SECONDS = int(os.environ.get('PROGRESS_STREAM_KEEPALIVE_SECONDS', 15))
+    PROGRESS_STREAM_MAX_SECONDS = int(os.environ.get('PROGRESS_STREAM_MAX_SECONDS', 60 * 60))
+
+    # Batch uploads (/batch/upload)
+    BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 500))
+    BATCH_MAX_EXTRACTED_BYTES = int(os.environ.get('BATCH_MAX_EXTRACTED_MB', 2048)) * 1024 * 1024
+    BATCH_REDIS_URL = os.environ.get('BATCH_REDIS_URL') or CELERY_RESULT_BACKEND
+    BATCH_RECORD_TTL_SECONDS = int(os.environ.get('BATCH_RECORD_TTL_HOURS', 48)) * 60 * 60
+
+    # Prometheus metrics (/metrics on the web app, METRICS_WORKER_PORT on each worker host)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() in ('true', '1', 't')
+    # Multiprocess mode for gunicorn/prefork; use one folder per service and empty it on service start.
+    METRICS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('METRICS_MULTIPROC_DIR')
+    METRICS_WORKER_PORT = int(os.environ.get('METRICS_WORKER_PORT', 9808)) # 0 disables the worker endpoint
+
+    # Warm-up at process start (app/services/warmup.py): Butterworth designs are precomputed
+    # for the default cutoffs at these sample rates and filter orders.
+    WARMUP_ENABLED = os.environ.get('WARMUP_ENABLED', 'True').lower() in ('true', '1', 't')
+    WARMUP_SAMPLE_RATES = os.environ.get('WARMUP_SAMPLE_RATES', '44100,48000')
+    WARMUP_FILTER_ORDERS = os.environ.get('WARMUP_FILTER_ORDERS', '1,2,4')
 
     # Cleanup Task Configuration (Celery Beat)
+    CLEANUP_MAX_FILE_AGE_DAYS = int(os.environ.get('CLEANUP_MAX_FILE_AGE_DAYS', 7))
+    # File registry (app/services/file_registry.py): stored files indexed by expiry in Redis, so
+    # cleanup only visits expired files and can run often. Without it cleanup lists the whole store.
+    FILE_REGISTRY_ENABLED = os.environ.get('FILE_REGISTRY_ENABLED', 'True').lower() in ('true', '1', 't')
+    FILE_REGISTRY_REDIS_URL = os.environ.get('FILE_REGISTRY_REDIS_URL') or CELERY_RESULT_BACKEND
+    FILE_STORE_MAX_BYTES = int(os.environ.get('FILE_STORE_MAX_MB', 20480)) * 1024 * 1024 # Processed results, LRU evicted; 0 = no quota
+    CLEANUP_INTERVAL_SECONDS = int(os.environ.get('CLEANUP_INTERVAL_SECONDS', 300 if FILE_REGISTRY_ENABLED else 24 * 60 * 60))
+    CLEANUP_BATCH_SIZE = int(os.environ.get('CLEANUP_BATCH_SIZE', 500))
+    CLEANUP_MAX_DELETES_PER_RUN = int(os.environ.get('CLEANUP_MAX_DELETES_PER_RUN', 20000))
     CELERY_BEAT_SCHEDULE = {
         'cleanup-old-files': {
             'task': 'app.tasks.cleanup_old_files_task',
-            'schedule': timedelta(days=1), # Default, can be overridden by cron from .env
+            'schedule': timedelta(seconds=CLEANUP_INTERVAL_SECONDS), # Default, can be overridden by cron from .env
             # For more specific cron-like scheduling:
             # 'schedule': crontab(
             # minute=os.environ.get('CLEANUP_SCHEDULE_CRON_MINUTE', '0'),
             # hour=os.environ.get('CLEANUP_SCHEDULE_CRON_HOUR', '3')
             # ),
-            'args': (int(os.environ.get('CLEANUP_MAX_FILE_AGE_DAYS', 7)),)
+            'args': (CLEANUP_MAX_FILE_AGE_DAYS,)
+        },
+        # Indexes files the registry missed (lists the whole store, so rarely).
+        'reconcile-file-registry': {
+            'task': 'app.tasks.reconcile_file_registry_task',
+            'schedule': timedelta(hours=int(os.environ.get('FILE_REGISTRY_RECONCILE_HOURS', 24))),
         },
     }
     # For cron from .env to work, you'd import from celery.schedules.crontab
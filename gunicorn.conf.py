@@ -0,0 +1,40 @@
+"""
+gunicorn settings for the web app. Run from the repository root:
+    gunicorn -c gunicorn.conf.py
+
+Uploads are written to disk while they are received (app/utils/uploads.py,
+StreamingUploadRequest), so a slow client only holds its connection. With the
+gevent worker class (the default when gevent is installed) every connection is a
+greenlet instead of a worker: one worker process serves up to
+WEB_WORKER_CONNECTIONS concurrent uploads, /status polls and /events streams,
+and a 300 MB upload on a slow link no longer takes a worker out of rotation.
+gunicorn patches the standard library before the app is imported, so redis,
+boto3 and the ffmpeg/ffprobe subprocesses all yield while they wait.
+
+Set WEB_WORKER_CLASS=sync for one request per worker process (e.g. to compare
+with benchmarks/upload_load.py). The Celery workers are unaffected.
+"""
+import os
+import importlib.util
+
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('WEB_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_WORKERS', 2 * (os.cpu_count() or 1) + 1))
+worker_class = os.environ.get('WEB_WORKER_CLASS') or ('gevent' if importlib.util.find_spec('gevent') else 'sync')
+worker_connections = int(os.environ.get('WEB_WORKER_CONNECTIONS', 1000))
+# A sync worker is killed when one request runs longer than this (a slow upload does);
+# an async worker only when its event loop stops responding.
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 60))
+keepalive = int(os.environ.get('WEB_KEEPALIVE', 5))
+accesslog = os.environ.get('WEB_ACCESS_LOG') # e.g. '-' for stdout
+
+
+def child_exit(server, worker):
+    # Metrics multiprocess mode: drop the live gauges of a worker that exited.
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        try:
+            from prometheus_client import multiprocess
+            multiprocess.mark_process_dead(worker.pid)
+        except ImportError:
+            pass
@@ -0,0 +1,75 @@
+"""
+Shared fixtures. Redis is replaced by fakeredis and Celery runs tasks eagerly, so
+the suite needs neither a Redis server nor a worker (ffmpeg and libmagic are
+still required, as for the app itself).
+
+The app is created once per session: routes register on current_app when
+app.routes is first imported, so a second create_app() would have none.
+"""
+import io
+import numpy as np
+import pytest
+import fakeredis
+import redis
+
+from config import Config
+
+_redis_server = fakeredis.FakeServer()
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('ams')
+    patch = pytest.MonkeyPatch()
+    patch.setattr(redis.Redis, 'from_url', classmethod(lambda cls, url, **kwargs: fakeredis.FakeRedis(server=_redis_server, **kwargs)))
+
+    class TestConfig(Config):
+        TESTING = True
+        UPLOAD_FOLDER = str(folder / 'uploads')
+        UPLOAD_PARTIAL_FOLDER = str(folder / 'uploads' / 'partial')
+        PREVIEW_FOLDER = str(folder / 'uploads' / 'preview')
+        PROCESSED_FOLDER = str(folder / 'processed')
+        STAGE_CACHE_FOLDER = str(folder / 'stage_cache')
+        CELERY_BROKER_URL = 'memory://'
+        CELERY_RESULT_BACKEND = 'cache+memory://'
+        CELERY_TASK_ALWAYS_EAGER = True
+        CELERY_TASK_STORE_EAGER_RESULT = True
+        METRICS_ENABLED = False
+        WARMUP_ENABLED = False
+        TASK_ROUTING_ENABLED = False
+
+    from app import create_app
+    yield create_app(TestConfig)
+    patch.undo()
+
+@pytest.fixture(autouse=True)
+def _flush_redis():
+    yield
+    fakeredis.FakeRedis(server=_redis_server).flushall()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def app_context(app):
+    with app.app_context():
+        yield app
+
+
+def noise(channels=2, seconds=1.0, frame_rate=44100, level=0.1, seed=0):
+    """Reproducible float32 (channels, frames) white noise."""
+    frames = int(seconds * frame_rate)
+    return (np.random.default_rng(seed).standard_normal((channels, frames)) * level).astype(np.float32)
+
+def wav_bytes(samples, frame_rate=44100):
+    """16-bit WAV file contents for a float32 (channels, frames) array."""
+    from app.services import dsp_engine
+    buffer = io.BytesIO()
+    dsp_engine.array_to_segment(samples.copy(), frame_rate, 2).export(buffer, format='wav')
+    return buffer.getvalue()
+
+def pcm16(segment_or_bytes):
+    """Interleaved 16-bit samples (as int) of a pydub segment or of raw PCM bytes."""
+    raw = getattr(segment_or_bytes, 'raw_data', segment_or_bytes)
+    return np.frombuffer(raw, dtype=np.int16).astype(np.int64)
@@ -0,0 +1,98 @@
+import os
+import pytest
+
+pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+from app.services import blob_store
+from app.services.blob_store import S3BlobStore, BlobReader
+
+BUCKET = 'ams-test'
+DATA = bytes(range(256)) * 100
+
+
+@pytest.fixture
+def s3(monkeypatch, tmp_path):
+    for name, value in {'AWS_ACCESS_KEY_ID': 'test', 'AWS_SECRET_ACCESS_KEY': 'test', 'AWS_DEFAULT_REGION': 'us-east-1'}.items():
+        monkeypatch.setenv(name, value)
+    with moto.mock_aws():
+        store = S3BlobStore(BUCKET, prefix='t/', scratch_folders={blob_store.UPLOADS: str(tmp_path), blob_store.PROCESSED: str(tmp_path)},
+                            region_name='us-east-1')
+        store.client.create_bucket(Bucket=BUCKET)
+        yield store
+
+def _put(store, key, data=DATA):
+    path = os.path.join(store.scratch_folders[blob_store.PROCESSED], 'scratch')
+    with open(path, 'wb') as f:
+        f.write(data)
+    store.put_file(key, path)
+    assert not os.path.exists(path)
+
+
+def test_put_and_read(s3):
+    _put(s3, 'processed/a.wav')
+    assert b''.join(s3.open_read('processed/a.wav')) == DATA
+    assert b''.join(s3.open_read('processed/a.wav', 100, 50)) == DATA[100:150]
+    assert b''.join(s3.open_read('processed/a.wav', len(DATA) - 10)) == DATA[-10:]
+    info = s3.stat('processed/a.wav')
+    assert info.key == 'processed/a.wav' and info.size == len(DATA)
+    assert s3.client.head_object(Bucket=BUCKET, Key='t/processed/a.wav')['ContentLength'] == len(DATA)
+
+def test_local_copy_is_removed_afterwards(s3):
+    _put(s3, 'uploads/a_input.wav')
+    with s3.local_copy('uploads/a_input.wav') as path:
+        with open(path, 'rb') as f:
+            assert f.read() == DATA
+    assert not os.path.exists(path)
+
+def test_missing_blob(s3):
+    assert s3.stat('processed/nope.wav') is None
+    assert not s3.exists('processed/nope.wav')
+
+def test_blob_reader_fetches_from_its_seek_position(s3):
+    _put(s3, 'processed/a.wav')
+    reader = BlobReader(s3, 'processed/a.wav')
+    reader.seek(1000)
+    assert b''.join(reader) == DATA[1000:]
+    assert reader.tell() == len(DATA)
+    with pytest.raises(ValueError):
+        reader.seek(0)
+    reader.close()
+
+def test_touch_keeps_headers_and_metadata(s3):
+    s3.client.put_object(Bucket=BUCKET, Key='t/processed/a.mp3', Body=DATA, ContentType='audio/mpeg',
+                         CacheControl='private', Metadata={'original': 'song.wav'})
+    before = s3.stat('processed/a.mp3').mtime
+    s3.touch('processed/a.mp3')
+    head = s3.client.head_object(Bucket=BUCKET, Key='t/processed/a.mp3')
+    assert head['ContentType'] == 'audio/mpeg'
+    assert head['CacheControl'] == 'private'
+    assert head['Metadata'] == {'original': 'song.wav'}
+    assert s3.stat('processed/a.mp3').mtime >= before
+    assert b''.join(s3.open_read('processed/a.mp3')) == DATA
+
+def test_list_and_delete(s3):
+    _put(s3, 'processed/a.wav')
+    _put(s3, 'processed/b.wav', DATA[:10])
+    _put(s3, 'uploads/c_input.wav')
+    s3.client.put_object(Bucket=BUCKET, Key='t/processed/nested/d.wav', Body=b'x') # not a blob of this store
+    s3.client.put_object(Bucket=BUCKET, Key='other/processed/e.wav', Body=b'x')
+    assert sorted((b.key, b.size) for b in s3.list('processed')) == [('processed/a.wav', len(DATA)), ('processed/b.wav', 10)]
+    assert s3.delete('processed/a.wav')
+    assert [b.key for b in s3.list('processed')] == ['processed/b.wav']
+    assert [b.key for b in s3.list('uploads')] == ['uploads/c_input.wav']
+
+def test_keys_cannot_leave_their_namespace(s3):
+    for key in ('processed/../uploads/a.wav', 'processed/', 'processed/..'):
+        with pytest.raises(ValueError):
+            s3.stat(key)
+
+def test_ranged_download_from_s3(app, client, s3, monkeypatch):
+    # The route streams S3 blobs through a BlobReader: only the requested range is fetched.
+    monkeypatch.setitem(app.config, 'BLOB_STORE_BACKEND', 's3')
+    monkeypatch.setattr(blob_store, '_instances', {'s3': s3})
+    _put(s3, 'processed/effects_a.wav')
+    response = client.get('/download/effects_a.wav', headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.data == DATA[100:200]
+    assert client.get('/download/effects_a.wav').data == DATA
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from scipy.signal import fftconvolve
+
+from app.services import dsp_engine
+from .conftest import noise
+
+FRAME_RATE = 44100
+
+
+@pytest.mark.parametrize('ir_frames', [100, 5000, 40000])
+@pytest.mark.parametrize('block_sizes', [[dsp_engine.BLOCK_FRAMES], [1000, 7777, 3, 65536]])
+def test_partitioned_convolver_matches_direct_convolution(ir_frames, block_sizes):
+    rng = np.random.default_rng(1)
+    ir = (rng.standard_normal(ir_frames) * np.exp(-np.arange(ir_frames) / (ir_frames / 4.0)) * 0.05).astype(np.float32)
+    samples = noise(seconds=3, seed=2)
+    expected = np.stack([fftconvolve(channel, ir)[:samples.shape[1]] for channel in samples])
+
+    convolver = dsp_engine.PartitionedConvolver(ir, samples.shape[0])
+    start, i = 0, 0
+    while start < samples.shape[1]:
+        size = block_sizes[i % len(block_sizes)]
+        convolver.process(samples[:, start:start + size])
+        start += size
+        i += 1
+    assert np.abs(samples - expected).max() < 1e-5
+
+def test_run_stage_matches_one_call():
+    ir = dsp_engine.reverb_impulse_response(FRAME_RATE, 0.4, 0.5, 1.0)
+    samples = noise(seconds=4)
+    whole = samples.copy()
+    dsp_engine.PartitionedConvolver(ir, 2).process(whole)
+    dsp_engine.run_stage(dsp_engine.PartitionedConvolver(ir, 2), samples)
+    assert np.abs(samples - whole).max() < 1e-6
@@ -0,0 +1,101 @@
+import hashlib
+import uuid
+import pytest
+
+from app.services import file_registry
+from app.services.blob_store import processed_key
+
+DATA = bytes(range(256)) * 64
+DIGEST = hashlib.sha256(DATA).hexdigest()
+
+
+@pytest.fixture
+def result(app):
+    filename = f"effects_{uuid.uuid4().hex}_song.wav"
+    with open(f"{app.config['PROCESSED_FOLDER']}/{filename}", 'wb') as f:
+        f.write(DATA)
+    with app.app_context():
+        file_registry.register(processed_key(filename), len(DATA), digest=DIGEST)
+    return filename
+
+
+def test_full_download(client, result):
+    response = client.get(f'/download/{result}')
+    assert response.status_code == 200
+    assert response.data == DATA
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['ETag'] == f'"{DIGEST}"'
+    assert response.headers['Content-Disposition'] == f'attachment; filename="{result}"'
+
+@pytest.mark.parametrize('header, start, stop', [('bytes=10-19', 10, 20), ('bytes=16000-', 16000, len(DATA)), ('bytes=-5', len(DATA) - 5, len(DATA))])
+def test_range_request(client, result, header, start, stop):
+    response = client.get(f'/download/{result}', headers={'Range': header})
+    assert response.status_code == 206
+    assert response.data == DATA[start:stop]
+    assert response.headers['Content-Range'] == f'bytes {start}-{stop - 1}/{len(DATA)}'
+
+def test_unsatisfiable_range(client, result):
+    response = client.get(f'/download/{result}', headers={'Range': f'bytes={len(DATA) + 5}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(DATA)}'
+
+def test_if_none_match(client, result):
+    response = client.get(f'/download/{result}', headers={'If-None-Match': f'"{DIGEST}"'})
+    assert response.status_code == 304
+    assert response.data == b''
+
+def test_if_range_with_another_etag_sends_everything(client, result):
+    response = client.get(f'/download/{result}', headers={'Range': 'bytes=0-9', 'If-Range': '"other"'})
+    assert response.status_code == 200
+    assert response.data == DATA
+
+def test_head(client, result):
+    response = client.head(f'/download/{result}')
+    assert response.status_code == 200
+    assert response.content_length == len(DATA)
+    assert response.data == b''
+
+def test_play_is_inline(client, result):
+    response = client.get(f'/play/{result}', headers={'Range': 'bytes=0-99'})
+    assert response.status_code == 206
+    assert response.headers['Content-Disposition'].startswith('inline;')
+
+def test_weak_etag_without_registered_digest(app, client):
+    filename = f"effects_{uuid.uuid4().hex}_song.wav"
+    with open(f"{app.config['PROCESSED_FOLDER']}/{filename}", 'wb') as f:
+        f.write(DATA)
+    assert client.get(f'/download/{filename}').headers['ETag'].startswith('W/')
+
+def test_missing_result(client):
+    response = client.get('/play/nope.wav')
+    assert response.status_code == 404
+
+@pytest.mark.parametrize('method, headers', [('GET', {'If-None-Match': f'"{DIGEST}"'}), ('GET', {'Range': f'bytes={len(DATA) + 5}-'}),
+                                             ('HEAD', {})])
+def test_bodyless_responses_close_the_file(client, result, monkeypatch, method, headers):
+    # No body is sent, so nothing else would close the file.
+    from app import routes # registers on current_app: importable once the app exists
+    bodies = []
+    def wrap_file(environ, file):
+        bodies.append(file)
+        return routes_wrap_file(environ, file)
+    routes_wrap_file = routes.wrap_file
+    monkeypatch.setattr(routes, 'wrap_file', wrap_file)
+    client.open(f'/download/{result}', method=method, headers=headers)
+    assert len(bodies) == 1 and bodies[0].closed
+
+@pytest.mark.parametrize('setting, value, header', [('DOWNLOAD_ACCEL_REDIRECT_PREFIX', '/protected/', 'X-Accel-Redirect'),
+                                                     ('DOWNLOAD_X_SENDFILE', True, 'X-Sendfile')])
+def test_offloaded_download_keeps_the_validators(app, client, result, monkeypatch, setting, value, header):
+    monkeypatch.setitem(app.config, setting, value)
+    response = client.get(f'/download/{result}')
+    assert response.status_code == 200
+    assert response.data == b''
+    assert response.headers[header].endswith(result)
+    assert response.headers['ETag'] == f'"{DIGEST}"'
+    assert response.headers['Last-Modified']
+    assert 'max-age' in response.headers['Cache-Control']
+
+    response = client.get(f'/download/{result}', headers={'If-None-Match': f'"{DIGEST}"'})
+    assert response.status_code == 304
+    assert header not in response.headers
@@ -0,0 +1,52 @@
+import pytest
+
+from app.services import dsp_engine, encoders
+from .conftest import noise
+
+EXPECTED_ARGS = {
+    'fast': {
+        'mp3': ['-f', 'mp3', '-acodec', 'libmp3lame', '-b:a', '128k', '-compression_level', '9'],
+        'm4a': ['-f', 'ipod', '-acodec', 'aac', '-b:a', '128k', '-aac_coder', 'fast'],
+        'ogg': ['-f', 'ogg', '-acodec', 'libvorbis', '-q:a', '2'],
+        'flac': ['-f', 'flac', '-acodec', 'flac', '-compression_level', '0'],
+    },
+    'balanced': {
+        'mp3': ['-f', 'mp3', '-acodec', 'libmp3lame', '-b:a', '192k'],
+        'm4a': ['-f', 'ipod', '-acodec', 'aac', '-aac_coder', 'twoloop'],
+        'ogg': ['-f', 'ogg', '-acodec', 'libvorbis', '-q:a', '3'],
+        'flac': ['-f', 'flac', '-acodec', 'flac', '-compression_level', '5'],
+    },
+    'archival': {
+        'mp3': ['-f', 'mp3', '-acodec', 'libmp3lame', '-q:a', '0', '-compression_level', '0'],
+        'm4a': ['-f', 'ipod', '-acodec', 'aac', '-b:a', '320k'],
+        'ogg': ['-f', 'ogg', '-acodec', 'libvorbis', '-q:a', '8'],
+        'flac': ['-f', 'flac', '-acodec', 'flac', '-compression_level', '8'],
+    },
+}
+CASES = [(profile, fmt) for profile in EXPECTED_ARGS for fmt in EXPECTED_ARGS[profile]]
+
+
+@pytest.mark.parametrize('profile, output_format', CASES)
+def test_encoder_args(profile, output_format):
+    assert encoders.encoder_args(output_format, 2, profile) == EXPECTED_ARGS[profile][output_format]
+
+@pytest.mark.parametrize('output_format', ['mp3', 'm4a', 'ogg', 'flac'])
+def test_profiles_differ(output_format):
+    args = [tuple(encoders.encoder_args(output_format, 2, profile)) for profile in encoders.ENCODER_PROFILES]
+    assert len(set(args)) == len(args)
+
+def test_wav_ignores_the_profile():
+    for profile in encoders.ENCODER_PROFILES:
+        assert encoders.encoder_args('wav', 2, profile) == ['-f', 'wav', '-acodec', 'pcm_s16le']
+
+def test_threads_and_fallbacks():
+    assert encoders.encoder_args('ogg', 2, 'fast', threads=2) == EXPECTED_ARGS['fast']['ogg'] + ['-threads', '2']
+    assert encoders.encoder_args('MP3', 2, 'unknown') == EXPECTED_ARGS[encoders.DEFAULT_PROFILE]['mp3']
+    assert encoders.encoder_args('aiff', 4, 'fast') == ['-f', 'wav', '-acodec', 'pcm_s32le']
+
+@pytest.mark.parametrize('profile, output_format', CASES)
+def test_ffmpeg_accepts_the_profile(tmp_path, profile, output_format):
+    pcm = dsp_engine.array_to_pcm_bytes(noise(seconds=0.5), 2)
+    output_path = tmp_path / f"out.{output_format}"
+    encoders.export_pcm(pcm, 44100, 2, 2, [(output_format, str(output_path))], profile=profile)
+    assert output_path.stat().st_size > 0
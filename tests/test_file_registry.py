@@ -0,0 +1,77 @@
+import os
+import time
+import uuid
+import pytest
+
+from app.services import file_registry
+from app.services.blob_store import processed_key, upload_key
+
+
+@pytest.fixture
+def blob(app_context):
+    """Writes a local blob of `size` bytes and returns its key (not registered)."""
+    def write(namespace, size):
+        name = f"{uuid.uuid4().hex}.wav"
+        folder = app_context.config['PROCESSED_FOLDER' if namespace == 'processed' else 'UPLOAD_FOLDER']
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(b'\0' * size)
+        return processed_key(name) if namespace == 'processed' else upload_key(name)
+    return write
+
+def _exists(app, key):
+    folder = app.config['PROCESSED_FOLDER' if key.startswith('processed/') else 'UPLOAD_FOLDER']
+    return os.path.exists(os.path.join(folder, key.split('/', 1)[1]))
+
+
+def test_uploads_do_not_count_towards_the_quota(app_context, blob):
+    upload = blob('uploads', 100000)
+    result = blob('processed', 1000)
+    file_registry.register(upload, 100000)
+    file_registry.register(result, 1000)
+    assert file_registry.processed_bytes() == 1000
+    assert file_registry.enforce_quota(5000, batch_size=10) == 0
+    assert _exists(app_context, result) and _exists(app_context, upload)
+
+def test_quota_evicts_least_recently_used_results(app_context, blob):
+    now = time.time()
+    old, used, new = blob('processed', 1000), blob('processed', 1000), blob('processed', 1000)
+    file_registry.register(old, 1000, stored_at=now - 30)
+    file_registry.register(used, 1000, stored_at=now - 20)
+    file_registry.register(new, 1000, stored_at=now - 10)
+    file_registry.touch(used)
+    assert file_registry.enforce_quota(2000, batch_size=1) == 1
+    assert not _exists(app_context, old)
+    assert _exists(app_context, used) and _exists(app_context, new)
+    assert file_registry.processed_bytes() == 2000
+
+def test_reregistering_and_forgetting_keep_the_count(app_context, blob):
+    result = blob('processed', 1000)
+    file_registry.register(result, 1000)
+    file_registry.register(result, 1500)
+    assert file_registry.processed_bytes() == 1500
+    file_registry.forget(result, upload_key('gone.wav'))
+    assert file_registry.processed_bytes() == 0
+
+def test_delete_expired(app_context, blob):
+    now = time.time()
+    expired, fresh = blob('uploads', 10), blob('uploads', 10)
+    file_registry.register(expired, 10, stored_at=now - file_registry.max_age_seconds() - 1)
+    file_registry.register(fresh, 10, stored_at=now)
+    assert file_registry.delete_expired(batch_size=10, max_deletes=10) == 1
+    assert not _exists(app_context, expired) and _exists(app_context, fresh)
+
+def test_reconcile_registers_blobs_and_recounts(app_context, blob):
+    for folder in ('UPLOAD_FOLDER', 'PROCESSED_FOLDER'):
+        for name in os.listdir(app_context.config[folder]):
+            path = os.path.join(app_context.config[folder], name)
+            if os.path.isfile(path):
+                os.remove(path)
+    result = blob('processed', 700)
+    blob('uploads', 5000)
+    r = file_registry._client()
+    r.set(f"{file_registry._prefix()}processed_bytes", 123456) # drifted
+    registered, dropped = file_registry.reconcile()
+    assert (registered, dropped) == (2, 0)
+    assert file_registry.processed_bytes() == 700
+    assert r.hget(f"{file_registry._prefix()}sizes", result) == '700'
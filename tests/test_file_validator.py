@@ -0,0 +1,162 @@
+import io
+import struct
+import subprocess
+import wave
+import pytest
+
+from app.services import audio_processor
+from app.utils import file_validator
+from .conftest import noise, wav_bytes
+
+
+def _wav(channels=2, frame_rate=44100, sample_width=2, frames=44100):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as w:
+        w.setnchannels(channels)
+        w.setframerate(frame_rate)
+        w.setsampwidth(sample_width)
+        w.writeframes(b'\0' * frames * channels * sample_width)
+    return buffer.getvalue()
+
+def _encode(path, codec, seconds=1.5, frame_rate=48000):
+    # ffmpeg's own sine source; written to a file, so the FLAC muxer can fill in the sample count.
+    subprocess.run(['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate={frame_rate}:duration={seconds}',
+                    '-ac', '2', '-c:a', codec, str(path)], check=True)
+    return path.read_bytes()
+
+def _probe(filename, data):
+    return file_validator.probe_metadata(filename, stream=io.BytesIO(data))
+
+@pytest.fixture(scope='module')
+def flac(tmp_path_factory):
+    return _encode(tmp_path_factory.mktemp('flac') / 'a.flac', 'flac')
+
+@pytest.fixture(scope='module', params=['libvorbis', 'libopus'])
+def ogg(request, tmp_path_factory):
+    return _encode(tmp_path_factory.mktemp('ogg') / 'a.ogg', request.param)
+
+
+# --- WAV ---
+
+def test_wav_header():
+    assert _probe('a.wav', _wav(channels=1, frame_rate=22050, frames=44100)) == \
+        {'duration': 2.0, 'channels': 1, 'sample_rate': 22050, 'sample_width': 2}
+    assert _probe('a.wav', _wav(sample_width=3))['sample_width'] == 4
+
+def test_streamed_wav_without_data_size_runs_to_the_end():
+    data = bytearray(_wav(frames=44100))
+    data_offset = data.index(b'data')
+    data[data_offset + 4:data_offset + 8] = struct.pack('<I', 0xFFFFFFFF)
+    assert _probe('a.wav', bytes(data))['duration'] == pytest.approx(1.0)
+
+def test_wav_extra_chunks_are_skipped():
+    data = _wav()
+    fmt_end = data.index(b'data')
+    with_list = data[:fmt_end] + b'LIST' + struct.pack('<I', 5) + b'abcde\0' + data[fmt_end:]
+    assert _probe('a.wav', with_list)['duration'] == pytest.approx(1.0)
+
+@pytest.mark.parametrize('data', [
+    b'RIFF\0\0\0\0WAVE',  # no chunks at all
+    _wav()[:30],  # fmt chunk cut off
+    _wav()[:12] + b'data' + struct.pack('<I', 4) + b'\0' * 4,  # data before fmt
+    b'RIFX' + _wav()[4:],  # big-endian RIFF is not supported
+    b'\0' * 64,
+])
+def test_truncated_or_corrupt_wav_is_refused(data):
+    with pytest.raises(ValueError):
+        _probe('a.wav', data)
+
+def test_wav_with_zero_block_align_is_refused():
+    data = bytearray(_wav())
+    fmt_offset = data.index(b'fmt ') + 8
+    data[fmt_offset + 12:fmt_offset + 14] = b'\0\0'
+    with pytest.raises(ValueError, match='zero block size'):
+        _probe('a.wav', bytes(data))
+
+
+# --- FLAC ---
+
+def test_flac_header(flac):
+    metadata = _probe('a.flac', flac)
+    assert (metadata['channels'], metadata['sample_rate'], metadata['sample_width']) == (2, 48000, 2)
+    assert metadata['duration'] == pytest.approx(1.5)
+
+def test_flac_after_id3_tag(flac):
+    tag = b'ID3\x04\0\0' + bytes([0, 0, 0, 20]) + b'\0' * 20
+    assert _probe('a.flac', tag + flac)['duration'] == pytest.approx(1.5)
+
+@pytest.mark.parametrize('cut', [4, 8, 20])
+def test_truncated_flac_is_refused(flac, cut):
+    with pytest.raises(ValueError):
+        _probe('a.flac', flac[:cut])
+
+def test_corrupt_flac_is_refused(flac):
+    with pytest.raises(ValueError, match='Not a FLAC'):
+        _probe('a.flac', b'fLaX' + flac[4:])
+    # First metadata block must be STREAMINFO (type 0).
+    with pytest.raises(ValueError, match='STREAMINFO'):
+        _probe('a.flac', flac[:4] + bytes([flac[4] | 0x04]) + flac[5:])
+    # STREAMINFO declaring no sample rate.
+    with pytest.raises(ValueError, match='no sample rate'):
+        _probe('a.flac', flac[:18] + b'\0\0\0' + flac[21:])
+
+
+# --- Ogg ---
+
+def test_ogg_header(ogg):
+    metadata = _probe('a.ogg', ogg)
+    assert (metadata['channels'], metadata['sample_rate']) == (2, 48000)
+    assert metadata['duration'] == pytest.approx(1.5, abs=0.03)
+
+def test_ogg_without_end_pages_has_no_duration(ogg):
+    # Only the first pages: the granule found is from the headers (0), so the duration is unknown.
+    second_page = ogg.index(b'OggS', 4)
+    assert _probe('a.ogg', ogg[:second_page])['duration'] is None
+
+@pytest.mark.parametrize('data', [b'OggS\0\0', b'OggS' + b'\0' * 23, b'RIFF' + b'\0' * 60])
+def test_truncated_or_corrupt_ogg_is_refused(data):
+    with pytest.raises(ValueError):
+        _probe('a.ogg', data)
+
+def test_ogg_with_other_codec_is_refused(ogg):
+    packet_start = 27 + ogg[26]
+    with pytest.raises(ValueError, match='not Vorbis, Opus or FLAC'):
+        _probe('a.ogg', ogg[:packet_start] + b'\x80theora' + ogg[packet_start + 7:])
+
+
+# --- Limits ---
+
+@pytest.fixture
+def limits(app_context, monkeypatch):
+    monkeypatch.setitem(app_context.config, 'AUDIO_MAX_DURATION_SECONDS', 1)
+    monkeypatch.setitem(app_context.config, 'AUDIO_MAX_CHANNELS', 2)
+    return app_context.config
+
+@pytest.mark.parametrize('data, message', [
+    (_wav(frames=2 * 44100), 'too long'),
+    (_wav(channels=4, frames=1000), 'Too many channels'),
+    (_wav(frame_rate=4000, frames=1000), 'Sample rate 4000 Hz'),
+])
+def test_upload_over_the_limits_is_refused(limits, data, message):
+    is_valid, validation_msg, _ = file_validator.check_audio_metadata('a.wav', stream=io.BytesIO(data))
+    assert not is_valid and message in validation_msg
+
+def test_unprobed_upload_is_accepted_without_metadata(limits):
+    assert file_validator.check_audio_metadata('a.mp3', stream=io.BytesIO(b'\xff\xfb' + b'\0' * 100)) == (True, "File is valid.", None)
+
+def test_worker_applies_the_limits_after_decoding(limits, tmp_path):
+    # As for an upload the web could not probe: no audio_info, only the decode tells.
+    input_path = tmp_path / 'long.wav'
+    input_path.write_bytes(wav_bytes(noise(seconds=2)))
+    success, error = audio_processor.apply_audio_effects_core(str(input_path), str(tmp_path / 'out.wav'), 'wav', [],
+                                                              audio_limits_func=file_validator.enforce_audio_limits)
+    assert not success and 'too long' in error
+    assert not (tmp_path / 'out.wav').exists()
+
+def test_worker_applies_the_limits_before_streaming(limits, tmp_path):
+    input_path = tmp_path / 'long.wav'
+    input_path.write_bytes(wav_bytes(noise(seconds=2)))
+    audio_info = {'duration': 2.0, 'channels': 2, 'sample_rate': 44100, 'sample_width': 2}
+    success, error = audio_processor.apply_audio_effects_core(str(input_path), str(tmp_path / 'out.wav'), 'wav', [], stream_min_bytes=0,
+                                                              audio_info=audio_info, audio_limits_func=file_validator.enforce_audio_limits)
+    assert not success and 'too long' in error
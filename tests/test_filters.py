@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+from scipy.signal import sosfreqz
+
+from app.services import dsp_engine
+
+FRAME_RATE = 44100
+
+
+@pytest.mark.parametrize('name, cutoff_hz, passband_hz, stopband_hz', [
+    ('high_pass_filter', 1000, 10000, 50),
+    ('low_pass_filter', 1000, 50, 10000),
+])
+def test_filters_are_minus_3db_at_cutoff(name, cutoff_hz, passband_hz, stopband_hz):
+    # The engine uses Butterworth sections, not pydub's single-pole filters: check the response instead.
+    btype = 'highpass' if name == 'high_pass_filter' else 'lowpass'
+    sos = dsp_engine.butterworth_sos(btype, cutoff_hz, FRAME_RATE, 2)
+    _, response = sosfreqz(sos, worN=[cutoff_hz, passband_hz, stopband_hz], fs=FRAME_RATE)
+    gain_db = 20 * np.log10(np.abs(response))
+    assert gain_db[0] == pytest.approx(-3.01, abs=0.05)
+    assert gain_db[1] > -0.5
+    assert gain_db[2] < -20
@@ -0,0 +1,41 @@
+import pytest
+
+from app.services import job_routing
+
+STEREO = {'duration': 60.0, 'channels': 2, 'sample_rate': 44100}
+CHAIN = [{'name': 'high_pass_filter', 'cutoff_hz': 100}, {'name': 'reverb', 'wet_level': 0.3}]
+
+
+@pytest.fixture
+def routing(app_context, monkeypatch):
+    monkeypatch.setitem(app_context.config, 'TASK_ROUTING_ENABLED', True)
+    return app_context.config
+
+
+def test_cost_scales_with_duration_channels_and_rate():
+    cost = job_routing.estimate_cost(STEREO, CHAIN, 'wav')
+    assert job_routing.estimate_cost(dict(STEREO, duration=120.0), CHAIN, 'wav') == pytest.approx(2 * cost)
+    assert job_routing.estimate_cost(dict(STEREO, channels=1), CHAIN, 'wav') == pytest.approx(cost / 2)
+    assert job_routing.estimate_cost(dict(STEREO, sample_rate=88200), CHAIN, 'wav') == pytest.approx(2 * cost)
+
+def test_every_export_format_adds_its_cost():
+    wav = job_routing.estimate_cost(STEREO, CHAIN, 'wav')
+    both = job_routing.estimate_cost(STEREO, CHAIN, ['wav', 'mp3'])
+    assert both - wav == pytest.approx(60.0 * job_routing.EXPORT_COSTS['mp3'])
+
+def test_short_and_long_jobs_go_to_their_queues(routing, tmp_path):
+    input_path = tmp_path / 'a.wav'
+    input_path.write_bytes(b'\0' * 100)
+    assert job_routing.select_queue(str(input_path), CHAIN, 'wav', STEREO) == routing['TASK_QUEUE_SHORT']
+    hours = dict(STEREO, duration=3 * 60 * 60.0)
+    assert job_routing.select_queue(str(input_path), CHAIN, 'mp3', hours) == routing['TASK_QUEUE_LONG']
+
+def test_unprobed_input_is_estimated_from_its_size(routing, tmp_path):
+    input_path = tmp_path / 'a.wav'
+    # One hour of 16-bit stereo 44.1 kHz WAV.
+    input_path.write_bytes(b'\0' * (job_routing.ASSUMED_BYTES_PER_SECOND['wav'] * 60 * 60))
+    assert job_routing.select_queue(str(input_path), CHAIN, 'mp3') == routing['TASK_QUEUE_LONG']
+
+def test_routing_disabled(app_context, tmp_path):
+    assert job_routing.select_queue(str(tmp_path / 'a.wav'), CHAIN, 'wav', STEREO) is None
+    assert job_routing.bulk_queue() is None
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from celery import signals
+
+from app.services import chain_planner, parallel
+from .conftest import noise
+
+FRAME_RATE = 44100
+CHAIN = [
+    {'name': 'high_pass_filter', 'cutoff_hz': 120, 'order': 4},
+    {'name': 'echo', 'delay_ms': 300, 'decay_factor': 0.5},
+    {'name': 'reverb', 'wet_level': 0.3, 'mode': 'convolution', 'tail_seconds': 1.0},
+]
+
+
+@pytest.fixture
+def concurrency(monkeypatch):
+    monkeypatch.setattr(parallel, '_worker', {'concurrency': None})
+    monkeypatch.setattr(parallel.os, 'cpu_count', lambda: 8)
+    return parallel._worker
+
+
+def test_configured_workers_are_used_as_is(concurrency):
+    assert parallel.resolve_workers(3) == 3
+    assert parallel.resolve_workers('2') == 2
+
+@pytest.mark.parametrize('worker_concurrency, expected', [(None, 1), (8, 1), (16, 1), (2, 4), (1, 8)])
+def test_auto_workers_share_the_cpus_among_worker_processes(concurrency, worker_concurrency, expected):
+    concurrency['concurrency'] = worker_concurrency
+    assert parallel.resolve_workers(0) == expected
+    assert parallel.resolve_workers(None) == expected
+
+def test_worker_init_records_the_concurrency(app, concurrency):
+    class WorkController:
+        concurrency = 2
+    signals.worker_init.send(sender=WorkController())
+    assert parallel.resolve_workers(0) == 4
+
+def test_default_config_runs_one_thread_per_job(app):
+    assert parallel.resolve_workers(app.config['PARALLEL_WORKERS']) == 1
+
+@pytest.mark.parametrize('workers', [2, 3])
+def test_parallel_segments_match_the_serial_run(workers):
+    plan = chain_planner.compile_chain(CHAIN)
+    build_stages = lambda: chain_planner.build_stages(plan.steps, FRAME_RATE, 2)
+    samples = noise(seconds=20)
+    serial = samples.copy()
+    for stage in build_stages():
+        serial = stage.process(serial)
+    parallel.process_parallel(build_stages, samples, workers)
+    assert np.abs(samples - serial).max() < 1e-4
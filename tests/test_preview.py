@@ -0,0 +1,69 @@
+import io
+import json
+import wave
+import numpy as np
+import pytest
+
+from app.services import chain_planner, preview
+from .conftest import noise, wav_bytes, pcm16
+
+FRAME_RATE = 22050
+# Memory of about 9.5 s: longer than any fixed pre-roll short enough to be "cheap".
+LONG_TAIL_CHAIN = [
+    {'name': 'high_pass_filter', 'cutoff_hz': 80},
+    {'name': 'echo', 'delay_ms': 400, 'decay_factor': 0.6},
+    {'name': 'reverb', 'wet_level': 0.5, 'mode': 'convolution', 'tail_seconds': 9.0},
+]
+
+
+@pytest.fixture(scope='module')
+def source(tmp_path_factory):
+    path = tmp_path_factory.mktemp('preview') / 'source.wav'
+    path.write_bytes(wav_bytes(noise(seconds=30, frame_rate=44100, seed=3), 44100))
+    return str(path)
+
+def _full_render_slice(source, chain, start_s, duration_s):
+    plan = chain_planner.compile_chain(chain)
+    samples = preview.decode_window(source, 0, 30, FRAME_RATE, 2)
+    pcm = pcm16(preview._apply_plan(plan, samples, FRAME_RATE, 0, 30, samples.shape[1]))
+    start, end = int(start_s * FRAME_RATE) * 2, int((start_s + duration_s) * FRAME_RATE) * 2
+    return pcm[start:end]
+
+def _wav_pcm(data):
+    with wave.open(io.BytesIO(data)) as w:
+        assert (w.getframerate(), w.getnchannels()) == (FRAME_RATE, 2)
+        return pcm16(w.readframes(w.getnframes()))
+
+
+def test_preroll_covers_the_chain_memory():
+    plan = chain_planner.compile_chain(LONG_TAIL_CHAIN)
+    frames = preview.preroll_frames(plan, FRAME_RATE, 2)
+    assert frames > 9.4 * FRAME_RATE
+    assert preview.preroll_frames(plan, FRAME_RATE, 2, max_seconds=5) == 5 * FRAME_RATE
+
+def test_preview_matches_the_full_render(app_context, source):
+    expected = _full_render_slice(source, LONG_TAIL_CHAIN, 20.0, 3.0)
+    clip = _wav_pcm(preview.render_preview(source, LONG_TAIL_CHAIN, 20.0, 3.0, FRAME_RATE, 2, output_format='wav'))
+    assert len(clip) == len(expected)
+    assert np.abs(clip - expected).max() <= 2
+
+def test_capped_preroll_is_not_exact(app_context, source):
+    # What a fixed 5 s pre-roll gave: the tail of the reverb is missing.
+    expected = _full_render_slice(source, LONG_TAIL_CHAIN, 20.0, 3.0)
+    clip = _wav_pcm(preview.render_preview(source, LONG_TAIL_CHAIN, 20.0, 3.0, FRAME_RATE, 2, output_format='wav', max_preroll_s=5))
+    assert np.abs(clip - expected).max() > 50
+
+def test_preview_route(client, source):
+    with open(source, 'rb') as f:
+        data = f.read()
+    response = client.post('/preview', data={'effects_chain': json.dumps(LONG_TAIL_CHAIN), 'start': '12', 'duration': '2',
+                                             'format': 'wav', 'file': (io.BytesIO(data), 'source.wav')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.mimetype == 'audio/wav'
+    assert len(_wav_pcm(response.data)) == 2 * FRAME_RATE * 2
+
+@pytest.mark.parametrize('field, value', [('start', 'nan'), ('duration', 'inf'), ('duration', '0')])
+def test_preview_rejects_invalid_windows(client, source, field, value):
+    response = client.post('/preview', data={field: value, 'file': (io.BytesIO(b'RIFF'), 'a.wav')}, content_type='multipart/form-data')
+    assert response.status_code == 400
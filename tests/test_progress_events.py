@@ -0,0 +1,175 @@
+import json
+import time
+import threading
+import types
+import uuid
+import pytest
+
+from app.services import progress_events
+from app.services.progress_events import ProgressReporter
+
+REDIS_URL = 'redis://progress'
+
+
+class FakeTask:
+    """Records update_state calls like a bound Celery task."""
+    def __init__(self):
+        self.request = types.SimpleNamespace(id=uuid.uuid4().hex)
+        self.updates = []
+        self.lock = threading.Lock()
+
+    def update_state(self, task_id, state, meta):
+        with self.lock:
+            self.updates.append((task_id, state, meta))
+
+    def progress_writes(self):
+        with self.lock:
+            return [meta['progress'] for _, state, meta in self.updates if state == 'PROGRESS']
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+@pytest.fixture
+def task(app):
+    return FakeTask()
+
+@pytest.fixture
+def channel(task):
+    pubsub = progress_events._client(REDIS_URL).pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(progress_events.channel_name(task.request.id))
+    def messages(wait=0.3):
+        # get_message also returns None for the (ignored) subscribe confirmation: read for a while.
+        received = []
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline:
+            message = pubsub.get_message(timeout=0.05)
+            if message is not None:
+                received.append(json.loads(message['data']))
+        return received
+    yield messages
+    pubsub.close()
+
+
+# --- ProgressReporter ---
+
+def test_updates_are_coalesced_and_the_latest_wins(task):
+    reporter = ProgressReporter(task, None, min_interval=0.1, min_step=2)
+    for progress in range(101):
+        reporter.report(progress, 'Working')
+    _wait_for(lambda: task.progress_writes()[-1:] == [100])
+    reporter.close()
+    writes = task.progress_writes()
+    assert len(writes) < 10
+    assert reporter.coalesced == 101 - len(writes)
+    assert all(task_id == task.request.id for task_id, _, _ in task.updates)
+
+def test_writes_are_bounded_by_the_progress_step(task):
+    reporter = ProgressReporter(task, None, min_interval=0, min_step=5)
+    for progress in range(101):
+        reporter.report(progress, 'Working')
+        time.sleep(0.002) # let the writer keep up: only min_step limits the writes
+    _wait_for(lambda: task.progress_writes()[-1:] == [100])
+    reporter.close()
+    writes = task.progress_writes()
+    assert len(writes) <= 100 / 5 + 1
+    assert all(b - a >= 5 for a, b in zip(writes, writes[1:]))
+
+@pytest.mark.parametrize('state', ['SUCCESS', 'FAILURE'])
+def test_terminal_state_is_written_last_and_stops_the_writer(task, state):
+    reporter = ProgressReporter(task, None, min_interval=10, min_step=2, extra_meta={'original_filename': 'a.wav'})
+    reporter.report(10, 'Working') # written at once (first update)
+    _wait_for(lambda: task.progress_writes() == [10])
+    reporter.report(50, 'Working') # pending: min_interval has not passed
+    reporter(state, {'status': 'Done', 'progress': 100})
+    assert task.updates[-1] == (task.request.id, state, {'status': 'Done', 'progress': 100, 'original_filename': 'a.wav'})
+    assert reporter.state == state and reporter.sent == 2
+    assert not reporter._writer.is_alive()
+    reporter.report(60, 'Too late')
+    assert task.updates[-1][1] == state
+
+def test_updates_are_published_on_the_task_channel(task, channel):
+    reporter = ProgressReporter(task, REDIS_URL, min_interval=0, min_step=1, extra_meta={'original_filename': 'a.wav'})
+    reporter.report(5, 'Working')
+    _wait_for(lambda: task.progress_writes() == [5])
+    reporter('SUCCESS', {'status': 'Effects applied!', 'progress': 100, 'result_filename': 'out.wav'})
+    assert channel() == [
+        {'state': 'PROGRESS', 'meta': {'status': 'Working', 'progress': 5, 'original_filename': 'a.wav'}},
+        {'state': 'SUCCESS', 'meta': {'status': 'Effects applied!', 'progress': 100, 'result_filename': 'out.wav', 'original_filename': 'a.wav'}},
+    ]
+
+def test_publish_failure_does_not_stop_the_task(task, monkeypatch):
+    class Broken:
+        def publish(self, *args):
+            raise ConnectionError('down')
+    monkeypatch.setattr(progress_events, '_client', lambda url: Broken())
+    reporter = ProgressReporter(task, REDIS_URL)
+    reporter('SUCCESS', {'progress': 100})
+    reporter('FAILURE', {'progress': 0})
+    assert [state for _, state, _ in task.updates] == ['SUCCESS', 'FAILURE']
+    assert reporter._publish_failed
+
+
+# --- /events ---
+
+def _events(response):
+    """data: payloads of an SSE response body (keepalive comments are counted apart)."""
+    body = response.get_data(as_text=True)
+    events = [json.loads(line[len('data: '):]) for line in body.split('\n\n') if line.startswith('data: ')]
+    return events, body.count(': keepalive')
+
+@pytest.fixture
+def stream_config(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'PROGRESS_REDIS_URL', REDIS_URL)
+    monkeypatch.setitem(app.config, 'PROGRESS_STREAM_KEEPALIVE_SECONDS', 0.05)
+    monkeypatch.setitem(app.config, 'PROGRESS_STREAM_MAX_SECONDS', 5)
+    return app.config
+
+def _publish(task_id, state, meta):
+    progress_events._client(REDIS_URL).publish(progress_events.channel_name(task_id), json.dumps({'state': state, 'meta': meta}))
+
+def test_stream_ends_with_the_terminal_event(client, stream_config):
+    task_id = uuid.uuid4().hex
+    response = client.get(f'/events/{task_id}') # subscribed before the body is read
+    assert response.mimetype == 'text/event-stream'
+    _publish(task_id, 'PROGRESS', {'status': 'Working', 'progress': 40})
+    _publish(task_id, 'SUCCESS', {'status': 'Effects applied!', 'progress': 100, 'result_filename': 'out.wav'})
+    _publish(task_id, 'PROGRESS', {'status': 'Never sent', 'progress': 50})
+    events, _ = _events(response)
+    assert [event['state'] for event in events] == ['PENDING', 'PROGRESS', 'SUCCESS']
+    assert events[1]['progress'] == 40
+    assert events[2]['download_url'].endswith('/download/out.wav')
+
+def test_late_subscriber_gets_the_current_state(app, client, stream_config):
+    task_id = uuid.uuid4().hex
+    app.extensions['celery'].backend.store_result(task_id, {'status': 'Applying: Echo', 'progress': 60}, 'PROGRESS')
+    response = client.get(f'/events/{task_id}')
+    _publish(task_id, 'FAILURE', {'status': 'Effect processing error: boom', 'progress': 0})
+    events, _ = _events(response)
+    assert events[0] == {'task_id': task_id, 'state': 'PROGRESS', 'status': 'Applying: Echo', 'progress': 60}
+    assert events[1]['state'] == 'FAILURE' and events[1]['status_message'] == 'Effect processing error: boom'
+
+def test_finished_task_sends_one_event(app, client, stream_config):
+    task_id = uuid.uuid4().hex
+    app.extensions['celery'].backend.store_result(task_id, {'result_filename': 'out.wav', 'result_filenames': ['out.wav']}, 'SUCCESS')
+    events, keepalives = _events(client.get(f'/events/{task_id}'))
+    assert [event['state'] for event in events] == ['SUCCESS']
+    assert keepalives == 0
+
+def test_stream_stops_after_max_seconds(client, stream_config, monkeypatch):
+    monkeypatch.setitem(stream_config, 'PROGRESS_STREAM_MAX_SECONDS', 0.3)
+    started = time.monotonic()
+    events, keepalives = _events(client.get(f'/events/{uuid.uuid4().hex}'))
+    assert time.monotonic() - started < 2
+    assert [event['state'] for event in events] == ['PENDING']
+    assert keepalives >= 2
+
+def test_stream_unavailable_falls_back_to_polling(client, stream_config, monkeypatch):
+    def unavailable(*args):
+        raise ConnectionError('down')
+    monkeypatch.setattr(progress_events, 'Subscription', unavailable)
+    response = client.get('/events/abc')
+    assert response.status_code == 503
+    assert response.json['status_url'].endswith('/status/abc')
@@ -0,0 +1,134 @@
+import io
+import os
+import json
+import time
+import uuid
+import pytest
+
+from app.services import result_cache
+from .conftest import noise, wav_bytes
+
+
+@pytest.fixture
+def cache(app_context):
+    return result_cache._client(), result_cache._prefix()
+
+@pytest.fixture
+def out():
+    # The processed folder lives for the whole session: every test names its own results.
+    return f"out_{uuid.uuid4().hex}"
+
+def _store_result(app, filename, data=b'result'):
+    with open(f"{app.config['PROCESSED_FOLDER']}/{filename}", 'wb') as f:
+        f.write(data)
+
+def _lru_score(cache, key):
+    r, prefix = cache
+    return r.zscore(f"{prefix}lru", key)
+
+
+def test_registered_entry_is_in_flight(cache, out):
+    task_id = uuid.uuid4().hex
+    result_cache.register('k', task_id, f"{out}.wav")
+    entry = result_cache.lookup('k')
+    assert entry == {'task_id': task_id, 'result_filename': f"{out}.wav", 'result_filenames': [f"{out}.wav"], 'ready': False}
+    assert result_cache.owner(f"{out}.wav") == 'k'
+
+def test_complete_records_size_and_lookup_is_ready(app_context, cache, out):
+    r, prefix = cache
+    result_cache.register('k', uuid.uuid4().hex, [f"{out}.wav", f"{out}.mp3"])
+    _store_result(app_context, f"{out}.wav", b'x' * 10)
+    _store_result(app_context, f"{out}.mp3", b'x' * 5)
+    result_cache.complete('k', 15)
+    entry = result_cache.lookup('k')
+    assert entry['ready'] and entry['result_filenames'] == [f"{out}.wav", f"{out}.mp3"]
+    assert r.hget(f"{prefix}entry:k", 'size') == '15'
+    assert int(r.get(f"{prefix}bytes")) == 15
+
+def test_complete_recreates_a_missing_entry(app_context, cache, out):
+    # The task finished after its entry was dropped (or before it was registered).
+    task_id = uuid.uuid4().hex
+    result_cache.complete('k', 10)
+    assert result_cache.lookup('k') is None
+    _store_result(app_context, f"{out}.wav")
+    result_cache.complete('k', 10, task_id=task_id, result_filename=[f"{out}.wav"])
+    entry = result_cache.lookup('k')
+    assert entry['task_id'] == task_id and entry['ready']
+
+def test_lost_in_flight_entry_is_dropped(app_context, cache, out):
+    r, prefix = cache
+    result_cache.register('k', uuid.uuid4().hex, f"{out}.wav")
+    stale = time.time() - app_context.config['RESULT_CACHE_IN_FLIGHT_TIMEOUT_SECONDS'] - 1
+    r.hset(f"{prefix}entry:k", 'created', stale)
+    assert result_cache.lookup('k') is None
+    assert not r.exists(f"{prefix}entry:k")
+    assert result_cache.owner(f"{out}.wav") is None
+
+def test_failed_task_entry_is_dropped(app_context, cache, out):
+    task_id = uuid.uuid4().hex
+    result_cache.register('k', task_id, f"{out}.wav")
+    app_context.extensions['celery'].backend.mark_as_failure(task_id, RuntimeError('boom'))
+    assert result_cache.lookup('k') is None
+
+def test_lookup_refreshes_lru_only_when_ready(app_context, cache, out):
+    r, prefix = cache
+    result_cache.register('k', uuid.uuid4().hex, f"{out}.wav")
+    r.zadd(f"{prefix}lru", {'k': 1.0})
+    result_cache.lookup('k')
+    assert _lru_score(cache, 'k') == 1.0
+    _store_result(app_context, f"{out}.wav")
+    result_cache.lookup('k')
+    assert _lru_score(cache, 'k') > 1.0
+
+def test_evict_by_size_removes_least_recently_used(app_context, cache, out):
+    r, prefix = cache
+    now = time.time()
+    for index, key in enumerate(['old', 'new']):
+        result_cache.register(key, uuid.uuid4().hex, f"{out}_{key}.wav")
+        _store_result(app_context, f"{out}_{key}.wav", b'x' * 10)
+        result_cache.complete(key, 10)
+        r.zadd(f"{prefix}lru", {key: now - 10 + index})
+    assert result_cache.evict(max_bytes=15, max_age_seconds=3600) == 1
+    assert result_cache.lookup('old') is None
+    assert result_cache.lookup('new')['ready']
+    assert not os.path.exists(f"{app_context.config['PROCESSED_FOLDER']}/{out}_old.wav")
+
+
+def _upload(client, data):
+    return client.post('/upload', data={'effects_chain': json.dumps([{'name': 'gain', 'gain_db': -3}]),
+                                        'file': (io.BytesIO(data), 'a.wav')}, content_type='multipart/form-data')
+
+def test_eager_upload_completes_its_registered_entry(app, client):
+    # Eager tasks finish inside apply_async: the entry must exist before dispatch to get its size.
+    data = wav_bytes(noise(seconds=0.5))
+    response = _upload(client, data)
+    assert response.status_code == 202
+    with app.app_context():
+        r, prefix = result_cache._client(), result_cache._prefix()
+        keys = r.keys(f"{prefix}entry:*")
+        assert len(keys) == 1
+        entry = r.hgetall(keys[0])
+        assert entry['task_id'] == response.json['task_id']
+        assert int(entry['size']) > 0
+
+    again = _upload(client, data)
+    assert again.status_code == 200
+    assert again.json['cached'] and again.json['task_id'] == response.json['task_id']
+
+def test_evict_by_size_skips_in_flight_entries(app_context, cache, out):
+    r, prefix = cache
+    now = time.time()
+    in_flight_task = uuid.uuid4().hex
+    result_cache.register('in_flight', in_flight_task, f"{out}_in_flight.wav")
+    r.zadd(f"{prefix}lru", {'in_flight': now - 100}) # least recently used of all
+    for index, key in enumerate(['old', 'new']):
+        result_cache.register(key, uuid.uuid4().hex, f"{out}_{key}.wav")
+        _store_result(app_context, f"{out}_{key}.wav", b'x' * 10)
+        result_cache.complete(key, 10)
+        r.zadd(f"{prefix}lru", {key: now - 10 + index})
+    assert result_cache.evict(max_bytes=15, max_age_seconds=3600) == 1
+    assert result_cache.lookup('in_flight')['task_id'] == in_flight_task
+    assert result_cache.lookup('old') is None
+    # Only in-flight entries left over the budget: nothing more to evict.
+    assert result_cache.evict(max_bytes=0, max_age_seconds=3600) == 1
+    assert result_cache.lookup('in_flight')['task_id'] == in_flight_task
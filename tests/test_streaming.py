@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from pydub import AudioSegment
+
+from app.services import audio_processor, streaming
+from .conftest import noise, wav_bytes, pcm16
+
+AUDIO_INFO = {'duration': 5.0, 'channels': 2, 'sample_rate': 44100, 'sample_width': 2}
+CHAIN = [
+    {'name': 'gain', 'gain_db': 3},
+    {'name': 'high_pass_filter', 'cutoff_hz': 120, 'order': 2},
+    {'name': 'echo', 'delay_ms': 120, 'decay_factor': 0.4},
+    {'name': 'reverb', 'wet_level': 0.3, 'mode': 'convolution', 'tail_seconds': 0.5},
+]
+
+
+def _process(tmp_path, name, **kwargs):
+    input_path = tmp_path / 'input.wav'
+    if not input_path.exists():
+        input_path.write_bytes(wav_bytes(noise(seconds=5)))
+    output_path = tmp_path / f"{name}.wav"
+    success, result = audio_processor.apply_audio_effects_core(str(input_path), str(output_path), 'wav', CHAIN, **kwargs)
+    assert success, result
+    return pcm16(AudioSegment.from_file(str(output_path)))
+
+@pytest.mark.parametrize('block_frames, workers', [(65536, 1), (10000, 1), (16384, 3)])
+def test_streaming_matches_in_memory(tmp_path, monkeypatch, block_frames, workers):
+    in_memory = _process(tmp_path, 'in_memory')
+    calls = []
+    stream_audio_effects = streaming.stream_audio_effects
+    monkeypatch.setattr(streaming, 'stream_audio_effects', lambda *a, **kw: calls.append(kw) or stream_audio_effects(*a, **kw))
+    # min_bytes=0 sends every input through the streaming pipeline.
+    streamed = _process(tmp_path, f"streamed_{block_frames}_{workers}", stream_min_bytes=0, stream_block_frames=block_frames,
+                        parallel_workers=workers, audio_info=AUDIO_INFO)
+    assert len(calls) == 1
+    assert len(streamed) == len(in_memory)
+    assert np.abs(streamed - in_memory).max() <= 1
+
+def test_whole_buffer_chain_is_not_streamed(tmp_path):
+    chain_with_speed = CHAIN + [{'name': 'speed_pitch', 'factor': 1.25}]
+    input_path = tmp_path / 'input.wav'
+    input_path.write_bytes(wav_bytes(noise(seconds=2)))
+    output_path = tmp_path / 'output.wav'
+    success, result = audio_processor.apply_audio_effects_core(str(input_path), str(output_path), 'wav', chain_with_speed, stream_min_bytes=0)
+    assert success, result
+    assert len(AudioSegment.from_file(str(output_path))) == pytest.approx(2000 / 1.25, abs=20)
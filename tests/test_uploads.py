@@ -0,0 +1,79 @@
+import io
+import fcntl
+import json
+import pytest
+
+from app.utils import uploads
+from .conftest import noise, wav_bytes
+
+DATA = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def session(app_context):
+    return uploads.create_session('long.wav', len(DATA))
+
+def _part_bytes(session):
+    part_path, _ = uploads._session_paths(session['upload_id'])
+    with open(part_path, 'rb') as f:
+        return f.read()
+
+
+def test_chunks_append_in_order(session):
+    assert uploads.append_chunk(session, 0, io.BytesIO(DATA[:4000]), 4000) == 4000
+    assert uploads.append_chunk(session, 4000, io.BytesIO(DATA[4000:]), len(DATA) - 4000) == len(DATA)
+    assert _part_bytes(session) == DATA
+    assert uploads.load_session(session['upload_id'])['offset'] == len(DATA)
+
+def test_chunk_at_wrong_offset_is_refused(session):
+    uploads.append_chunk(session, 0, io.BytesIO(DATA[:4000]), 4000)
+    with pytest.raises(ValueError, match='expected 4000'):
+        uploads.append_chunk(session, 5000, io.BytesIO(DATA[5000:6000]), 1000)
+    assert _part_bytes(session) == DATA[:4000]
+
+def test_duplicate_chunk_with_stale_session_is_refused(session):
+    # A retried PUT loads the session before the first attempt finished: its offset is stale.
+    stale = dict(uploads.load_session(session['upload_id']))
+    uploads.append_chunk(session, 0, io.BytesIO(DATA[:4000]), 4000)
+    with pytest.raises(ValueError, match='expected 4000'):
+        uploads.append_chunk(stale, 0, io.BytesIO(DATA[:4000]), 4000)
+    assert stale['offset'] == 4000
+    assert _part_bytes(session) == DATA[:4000]
+
+def test_chunk_past_declared_size_is_refused(session):
+    with pytest.raises(ValueError, match='past the declared upload size'):
+        uploads.append_chunk(session, 0, io.BytesIO(DATA + b'x'), len(DATA) + 1)
+    assert _part_bytes(session) == b''
+
+def test_chunk_is_refused_while_another_is_written(session):
+    part_path, _ = uploads._session_paths(session['upload_id'])
+    with open(part_path, 'ab') as holder:
+        fcntl.flock(holder, fcntl.LOCK_EX)
+        with pytest.raises(ValueError, match='being written'):
+            uploads.append_chunk(session, 0, io.BytesIO(DATA[:4000]), 4000)
+    assert uploads.append_chunk(session, 0, io.BytesIO(DATA[:4000]), 4000) == 4000
+
+
+def _put(client, upload_id, data, start, total):
+    return client.put(f'/uploads/{upload_id}', data=data, headers={'Content-Range': f'bytes {start}-{start + len(data) - 1}/{total}'})
+
+def test_resumable_upload_route(client):
+    data = wav_bytes(noise(seconds=0.5))
+    created = client.post('/uploads', json={'filename': 'long.wav', 'size': len(data)})
+    assert created.status_code == 201
+    upload_id = created.json['upload_id']
+
+    assert _put(client, upload_id, data[:10000], 0, len(data)).json['offset'] == 10000
+    conflict = _put(client, upload_id, data[:10000], 0, len(data))
+    assert conflict.status_code == 409
+    assert conflict.json['offset'] == 10000
+    assert client.get(f'/uploads/{upload_id}').json['offset'] == 10000
+    assert _put(client, upload_id, data[10000:], 10000, len(data)).json['offset'] == len(data)
+
+    completed = client.post(f'/uploads/{upload_id}/complete', data={'effects_chain': json.dumps([{'name': 'gain', 'gain_db': -3}])})
+    assert completed.status_code == 202
+    assert client.get(f"/status/{completed.json['task_id']}").json['state'] == 'SUCCESS'
+
+def test_resumable_upload_size_limit(app, client):
+    too_big = app.config['CHUNKED_UPLOAD_MAX_BYTES'] + 1
+    assert client.post('/uploads', json={'filename': 'long.wav', 'size': too_big}).status_code == 400
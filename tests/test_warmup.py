@@ -0,0 +1,45 @@
+import json
+import pytest
+from pydub import utils as pydub_utils
+
+from app.services import streaming, warmup
+from app.utils import file_validator
+
+
+@pytest.fixture
+def fake_ffprobe(tmp_path, monkeypatch):
+    """Points the app's ffprobe lookup at a script printing the given JSON."""
+    def install(info):
+        script = tmp_path / 'ffprobe'
+        script.write_text(f"#!/bin/sh\ncat <<'EOF'\n{json.dumps(info)}\nEOF\n")
+        script.chmod(0o755)
+        monkeypatch.setattr(file_validator, 'ffprobe_path', lambda: str(script))
+    return install
+
+
+def test_warm_ffmpeg_leaves_pydub_alone():
+    get_prober_name = pydub_utils.get_prober_name
+    warmup.warm_ffmpeg()
+    assert pydub_utils.get_prober_name is get_prober_name
+
+def test_ffprobe_is_looked_up_once():
+    file_validator.ffprobe_path.cache_clear()
+    file_validator.ffprobe_path()
+    file_validator.ffprobe_path()
+    assert file_validator.ffprobe_path.cache_info().misses == 1
+
+def test_probe_audio_reads_ffprobe_output(fake_ffprobe):
+    fake_ffprobe({'streams': [{'channels': 2, 'sample_rate': '48000', 'bits_per_raw_sample': '24', 'duration': '12.5'}]})
+    assert streaming.probe_audio('/any/input.m4a') == {'duration': 12.5, 'channels': 2, 'sample_rate': 48000, 'sample_width': 4}
+
+def test_probe_audio_falls_back_to_the_format_duration(fake_ffprobe):
+    fake_ffprobe({'streams': [{'channels': 1, 'sample_rate': '44100'}], 'format': {'duration': '3.0'}})
+    assert streaming.probe_audio('/any/input.mp3')['duration'] == 3.0
+    fake_ffprobe({'streams': [{'channels': 1, 'sample_rate': '44100'}]})
+    assert streaming.probe_audio('/any/input.mp3')['duration'] == 0.0
+
+def test_probe_audio_without_audio_or_ffprobe(fake_ffprobe, monkeypatch):
+    fake_ffprobe({'streams': []})
+    assert streaming.probe_audio('/any/input.mp4') is None
+    monkeypatch.setattr(file_validator, 'ffprobe_path', lambda: None)
+    assert streaming.probe_audio('/any/input.mp3') is None